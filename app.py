@@ -5,6 +5,11 @@ from routes.locations import bp as locations_bp
 from routes.vis import bp as vis_bp
 from routes.drive import bp as drive_bp
 from routes.map_tool import bp as map_tool_bp
+from routes.search import bp as search_bp
+from routes.ws import bp as ws_bp
+from routes.rooms import bp as rooms_bp
+from routes.scenes import bp as scenes_bp
+from utils.codec import CodecJSONProvider
 import os
 import json
 from dotenv import load_dotenv
@@ -17,6 +22,7 @@ app = Flask(
     template_folder="templates",
     static_folder="static",
 )
+app.json = CodecJSONProvider(app)
 
 # Secret key for session management
 app.secret_key = os.getenv("SECRET_KEY", "dev_secret_key_123")
@@ -26,6 +32,10 @@ app.register_blueprint(admin_bp)
 app.register_blueprint(locations_bp, url_prefix="/api")
 app.register_blueprint(vis_bp)
 app.register_blueprint(map_tool_bp)
+app.register_blueprint(search_bp, url_prefix="/api")
+app.register_blueprint(ws_bp)
+app.register_blueprint(rooms_bp, url_prefix="/api")
+app.register_blueprint(scenes_bp, url_prefix="/api")
 
 def load_admin_password():
     try:
@@ -45,6 +55,7 @@ def require_login():
         'static', 
         'vis.index', 
         'map_tool.map_editor', # Map checks inside route for admin vs guest
+        'ws.table_socket', # WebSocket checks the session inside for admin vs guest
         'site_rules' # If exists
     ]
     
@@ -1,13 +1,13 @@
-from utils.drive import get_drive_service
+from utils.drive import drive_client
 
 if __name__ == "__main__":
     print("Authenticating with Google Drive...")
     try:
-        service = get_drive_service()
-        print("Authentication successful! token.json created.")
-        
-        # Test listing
-        results = service.files().list(pageSize=5, fields="files(id, name)").execute()
+        with drive_client() as service:
+            print("Authentication successful! token.json created.")
+
+            # Test listing
+            results = service.files().list(pageSize=5, fields="files(id, name)").execute()
         files = results.get('files', [])
         print("Files found:")
         for file in files:
@@ -0,0 +1,79 @@
+# bench_codec.py
+"""Micro-benchmark of the JSON codecs on state and tree sized payloads.
+
+Usage: python bench_codec.py [nodes]
+Compares the stdlib (pretty, as save_json used to write, and compact) with orjson /
+ujson / msgspec when they are installed. utils.codec uses orjson when available.
+"""
+import json
+import random
+import sys
+import timeit
+
+from utils.schema import Metadata
+
+
+def make_state(nodes):
+    """A campaign state.json: vis keys plus `nodes` Metadata entries."""
+    rnd = random.Random(1)
+    state = {"current_image": "https://drive.google.com/uc?export=view&id=1AbCdEf", "current_music": ""}
+    for i in range(nodes):
+        state[f"/kraina/region{i % 40}/miejsce{i}"] = Metadata(
+            name=f"Miejsce {i} – Łódź",
+            description="Opis lokacji " * rnd.randint(5, 40),
+            notes="Notatki MG " * rnd.randint(0, 20),
+            tags=[f"tag{rnd.randint(0, 50)}" for _ in range(rnd.randint(0, 6))],
+            sub=[f"pod{j}" for j in range(rnd.randint(0, 5))],
+        ).model_dump()
+    return state
+
+
+def make_tree(nodes):
+    """A /api/drive/tree response: nested folders."""
+    rnd = random.Random(2)
+    root = {"id": "root", "name": "Kampania", "children": []}
+    folders = [root]
+    for i in range(nodes):
+        parent = rnd.choice(folders)
+        child = {"id": f"1{i:032x}", "name": f"Folder {i} żółw", "children": []}
+        parent["children"].append(child)
+        folders.append(child)
+    return root
+
+
+def codecs():
+    yield "json (indent=2)", lambda o: json.dumps(o, indent=2, ensure_ascii=False), json.loads
+    yield "json (compact)", lambda o: json.dumps(o, separators=(",", ":"), ensure_ascii=False), json.loads
+    try:
+        import orjson
+        yield "orjson", orjson.dumps, orjson.loads
+    except ImportError:
+        pass
+    try:
+        import ujson
+        yield "ujson", lambda o: ujson.dumps(o, ensure_ascii=False), ujson.loads
+    except ImportError:
+        pass
+    try:
+        import msgspec
+        yield "msgspec", msgspec.json.encode, msgspec.json.decode
+    except ImportError:
+        pass
+
+
+def bench(label, payload, repeat=5):
+    print(f"\n{label}")
+    print(f"{'codec':<18}{'size KB':>10}{'dumps ms':>12}{'loads ms':>12}")
+    for name, dumps, loads in codecs():
+        encoded = dumps(payload)
+        number = max(1, int(0.2 / max(timeit.timeit(lambda: dumps(payload), number=1), 1e-6)))
+        dump_ms = min(timeit.repeat(lambda: dumps(payload), number=number, repeat=repeat)) / number * 1000
+        load_ms = min(timeit.repeat(lambda: loads(encoded), number=number, repeat=repeat)) / number * 1000
+        size = len(encoded.encode("utf-8") if isinstance(encoded, str) else encoded) / 1024
+        print(f"{name:<18}{size:>10.1f}{dump_ms:>12.2f}{load_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    bench(f"state.json with {nodes} nodes", make_state(nodes))
+    bench(f"folder tree with {nodes} folders", make_tree(nodes))
@@ -1,12 +1,37 @@
 from flask import Blueprint, jsonify, request
-from utils.drive import list_folder_content, get_file_content, update_file_content, create_folder, create_file, upload_file, get_file_metadata, rename_file, ROOT_FOLDER_ID, get_all_folders
-from utils.file_ops import save_json, load_json
-import json
+from utils.drive import list_folder_content, get_file_content, update_file, create_folder, create_file, upload_files, batch_rename, batch_make_public, get_file_metadata, ROOT_FOLDER_ID, get_all_folders, get_pool_stats, get_cache_stats, changes, FOLDER_MIME, MIRROR_MODE, mirror, is_offline_error
+from utils import codec
 from utils.drive_utils import normalize_drive_link
+from utils import entity_index
+from utils.write_queue import WriteQueue
+from utils.rooms import rooms
+from utils.state_store import SCENE_OPS
+from utils import registry_db
+from utils.http_cache import versioned_json
 import os
 
 bp = Blueprint("drive", __name__)
-STATE_FILE = "data/state.json"
+
+def drive_offline():
+    """True when the mirror saw Drive unreachable. Edits of existing entities are queued
+    then, but creates cannot be: the caller needs the id Drive assigns."""
+    return MIRROR_MODE and mirror.online is False
+
+def offline_rejection(e=None):
+    if e is not None:
+        print(f"Drive unreachable: {e}")
+    return jsonify({"error": "Drive is offline; creating files and folders needs a connection"}), 503
+
+def create_or_reject(create_fn, *args):
+    """Runs a Drive create call. Returns (result, None), or (None, 503 response) when Drive cannot be reached."""
+    if drive_offline():
+        return None, offline_rejection()
+    try:
+        return create_fn(*args), None
+    except Exception as e:
+        if not is_offline_error(e):
+            raise
+        return None, offline_rejection(e)
 
 @bp.route("/drive/list", methods=["GET"])
 def list_drive():
@@ -50,6 +75,35 @@ def list_drive():
         "entities": entities
     })
 
+@bp.route("/drive/stats", methods=["GET"])
+def drive_stats():
+    """Returns Drive client pool and metadata cache counters."""
+    return jsonify({"pool": get_pool_stats(), **get_cache_stats()})
+
+@bp.route("/drive/mirror/sync", methods=["POST"])
+def sync_mirror():
+    """Runs a full offline-mirror sync now."""
+    if not MIRROR_MODE:
+        return jsonify({"error": "Mirror mode is disabled (MIRROR_MODE=1)"}), 400
+    try:
+        downloaded = mirror.sync()
+    except Exception as e:
+        return jsonify({"error": f"Mirror sync failed: {e}"}), 502
+    return jsonify({"status": "success", "downloaded": downloaded, "mirror": mirror.stats()})
+
+@bp.route("/drive/entities", methods=["GET"])
+def list_entities():
+    """Lists indexed entities, optionally filtered by ?type=MAP|NPC|LOCATION..."""
+    if not entity_index.is_built():
+        entity_index.rebuild()
+    return jsonify(entity_index.query(request.args.get("type")))
+
+@bp.route("/drive/entities/reindex", methods=["POST"])
+def reindex_entities():
+    """Rescans Drive for metadata files and refreshes the entity index."""
+    count = entity_index.rebuild()
+    return jsonify({"status": "success", "count": count, "failed": entity_index.stats()["last_failed"]})
+
 @bp.route("/drive/entity", methods=["GET"])
 def get_entity():
     """Gets content of a specific entity file."""
@@ -60,7 +114,7 @@ def get_entity():
     content = get_file_content(file_id)
     if content:
         try:
-            return jsonify(json.loads(content))
+            return jsonify(codec.loads(content))
         except:
             return jsonify({"error": "Invalid JSON"}), 500
     return jsonify({"error": "File not found"}), 404
@@ -77,47 +131,71 @@ def update_metadata():
     if not folder_id or not entity_name or not metadata:
         return jsonify({"error": "Missing folder_id, name, or metadata"}), 400
 
-    content_str = json.dumps(metadata, indent=2, ensure_ascii=False)
+    content_str = codec.dumps_str(metadata, pretty=True)
+    new_filename = f"metadata_{entity_name}.json"
     
     if file_id:
-        # Check if we need to rename the file
-        current_meta = get_file_metadata(file_id, fields="name")
-        new_filename = f"metadata_{entity_name}.json"
-        
-        if current_meta and current_meta.get('name') != new_filename:
-             rename_success = rename_file(file_id, new_filename)
-             if not rename_success:
-                 print(f"Warning: Failed to rename file {file_id} to {new_filename}")
-
-        success = update_file_content(file_id, content_str)
-    else:
-        # Create new metadata file
-        filename = f"metadata_{entity_name}.json"
-        new_id = create_file(filename, folder_id, content_str)
-        success = new_id is not None
-        
-    if success:
-        # Update Local Cache
-        final_id = file_id if file_id else new_id
-        entity_type = metadata.get("type", "").upper()
-        fraction = metadata.get("fraction", "").strip()
+        # Marked dirty first, so a write that lands right away clears the flag again
+        if MIRROR_MODE:
+            mirror.apply_local_write(file_id, content_str, name=new_filename)
+        # Accept the save right away; the writer coalesces rapid edits of the same file
+        status = entity_writer.submit(file_id, write_entity, file_id, folder_id, entity_name, metadata, content_str)
+        return jsonify({"status": "success", "id": file_id, "write": status}), 202
         
-        cache_data = {
-            "id": final_id,
-            "name": entity_name,
-            "folder_id": folder_id,
-            "type": entity_type
-        }
+    # Create new metadata file (synchronously, the client needs the new id)
+    new_id, rejection = create_or_reject(create_file, new_filename, folder_id, content_str)
+    if rejection:
+        return rejection
+    if not new_id:
+        return jsonify({"error": "Failed to save metadata"}), 500
         
-        if entity_type == "NPC":
-            update_local_npc(cache_data)
-            
-        # Always update fraction registry to handle removals/changes
-        update_local_fraction(cache_data, fraction)
+    update_local_caches({"id": new_id, "name": new_filename, "parents": [folder_id]}, folder_id, entity_name, metadata)
+    return jsonify({"status": "success", "id": new_id})
 
-        return jsonify({"status": "success", "id": final_id})
-    else:
-        return jsonify({"error": "Failed to save metadata"}), 500
+@bp.route("/drive/queue", methods=["GET"])
+def write_queue_status():
+    """Returns background writer depth and per-item status (?file_id= for a single item)."""
+    file_id = request.args.get("file_id")
+    if file_id:
+        status = entity_writer.status(file_id)
+        if not status:
+            return jsonify({"error": "Unknown file_id"}), 404
+        return jsonify(status)
+    return jsonify(entity_writer.stats())
+
+# ===================== WRITE-BEHIND =====================
+
+def write_finished(file_id, state, error):
+    """A save that was given up must not stay in the mirror as if Drive had it."""
+    if state == "failed" and MIRROR_MODE:
+        mirror.drop_local_write(file_id)
+
+# Connectivity errors keep the write queued until Drive is reachable again
+entity_writer = WriteQueue(name="entity-writer", is_transient=is_offline_error, on_finished=write_finished)
+
+def write_entity(file_id, folder_id, entity_name, metadata, content_str):
+    """Background job: uploads content + name in one request, then updates local caches."""
+    updated = update_file(file_id, content_str, name=f"metadata_{entity_name}.json")
+    if updated is None:
+        return False
+    update_local_caches(updated, folder_id, entity_name, metadata)
+    return True
+
+def update_local_caches(file, folder_id, entity_name, metadata):
+    """Updates the entity index and the local NPC/faction registries after a save."""
+    entity_index.upsert(file, metadata)
+    entity_type = metadata.get("type", "").upper()
+    fraction = metadata.get("fraction", "").strip()
+    
+    cache_data = {
+        "id": file["id"],
+        "name": entity_name,
+        "folder_id": folder_id,
+        "type": entity_type
+    }
+    
+    # One row per entity; an empty fraction removes it from all factions
+    registry_db.upsert_entity(cache_data, fraction)
 
 @bp.route("/drive/add_folder", methods=["POST"])
 def add_folder():
@@ -129,41 +207,92 @@ def add_folder():
     if not parent_id or not name:
         return jsonify({"error": "Missing parent_id or name"}), 400
         
-    new_id = create_folder(name, parent_id)
+    new_id, rejection = create_or_reject(create_folder, name, parent_id)
+    if rejection:
+        return rejection
     if new_id:
+        if registry_db.has_folder(parent_id):
+            registry_db.upsert_folder(new_id, name, parent_id)
         return jsonify({"status": "success", "id": new_id})
     else:
         return jsonify({"error": "Failed to create folder"}), 500
 
 @bp.route("/upload", methods=["POST"])
 def upload():
-    """Uploads a file to the specified folder."""
+    """Uploads one or more files ("file" fields) to the specified folder.
+
+    Images are made public together in one batch call. A single file answers
+    {"ok", "link", "id"}; several answer {"ok", "files": [...]} with a result per file.
+    """
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
-    file = request.files['file']
+    files = [f for f in request.files.getlist('file') if f.filename]
     folder_id = request.form.get("folder_id")
-    
-    if file.filename == '':
+
+    if not files:
         return jsonify({"error": "No selected file"}), 400
     if not folder_id:
         return jsonify({"error": "Missing folder_id"}), 400
-        
-    result = upload_file(file, folder_id)
-    if result:
-        file_id = result.get("id")
-        link = result.get("webContentLink", "")
-        
-        # Construct direct link for images to ensure they display in <img> tags
-        if result.get("mimeType", "").startswith("image/"):
-             link = f"https://drive.google.com/uc?export=view&id={file_id}"
-             
-        return jsonify({"ok": True, "link": link, "id": file_id})
-    else:
+
+    results, rejection = create_or_reject(upload_files, files, folder_id)
+    if rejection:
+        return rejection
+    uploaded = [upload_result(f.filename, item) for f, item in zip(files, results)]
+    if len(uploaded) > 1:
+        ok = any(u["ok"] for u in uploaded)
+        return jsonify({"ok": ok, "files": uploaded}), 200 if ok else 500
+    if not uploaded[0]["ok"]:
         return jsonify({"error": "Upload failed"}), 500
+    return jsonify({"ok": True, "link": uploaded[0]["link"], "id": uploaded[0]["id"]})
+
+def upload_result(filename, item):
+    result = item["result"]
+    if not result:
+        return {"name": filename, "ok": False, "error": item["error"]}
+    file_id = result.get("id")
+    link = result.get("webContentLink", "")
+    # Construct direct link for images to ensure they display in <img> tags
+    if result.get("mimeType", "").startswith("image/"):
+        link = f"https://drive.google.com/uc?export=view&id={file_id}"
+    return {"name": filename, "ok": True, "id": file_id, "link": link, "error": item["error"]}
+
+@bp.route("/drive/batch", methods=["POST"])
+def batch_update():
+    """Renames and shares many files in one go: {"renames": {file_id: name}, "public": [file_id, ...]}.
+
+    Each part is one Drive batch call (100 operations per HTTP request). Answers the
+    result of every item: {"renames": {id: {"ok", "error"}}, "public": {...}}.
+    """
+    data = request.json or {}
+    renames = data.get("renames") or {}
+    public = data.get("public") or []
+    if not isinstance(renames, dict) or not isinstance(public, list) or not (renames or public):
+        return jsonify({"error": "Expected renames (object) and/or public (list)"}), 400
+    if drive_offline():
+        return offline_rejection()
+
+    def summary(results):
+        return {file_id: {"ok": item["error"] is None, "error": item["error"]} for file_id, item in results.items()}
+
+    answer = {}
+    if renames:
+        answer["renames"] = summary(batch_rename({str(k): str(v) for k, v in renames.items()}))
+    if public:
+        answer["public"] = summary(batch_make_public([str(i) for i in public]))
+    failed = sum(not item["ok"] for part in answer.values() for item in part.values())
+    return jsonify(dict(answer, status="success" if not failed else "partial", failed=failed))
+
+def room_store():
+    """State store of the ?room= game table, or None if it does not exist."""
+    room = rooms.get(request.args.get("room"))
+    return room.store if room else None
 
 @bp.route("/set_vis", methods=["GET"])
 def set_vis():
-    """Updates the current image in state.json."""
+    """Updates the current image of a room (?room=, default: the main table)."""
+    store = room_store()
+    if store is None:
+        return jsonify({"error": "Unknown room"}), 404
     image_url = request.args.get("url", "")
     if not image_url:
         return jsonify({"error": "Missing url"}), 400
@@ -171,69 +300,62 @@ def set_vis():
     # 🧠 Nowe: zamieniamy link zanim trafi do pliku
     final_link = normalize_drive_link(image_url)
 
-    state = load_json("data/state.json")
-    state["current_image"] = final_link
-    save_json("data/state.json", state)
+    store.apply("set_vis", {"current_image": final_link})
 
     return jsonify({"status": "success", "current_image": final_link})
 
 @bp.route("/set_music", methods=["GET"])
 def set_music():
-    """Updates the current music in state.json."""
+    """Updates the current music of a room (?room=, default: the main table)."""
+    store = room_store()
+    if store is None:
+        return jsonify({"error": "Unknown room"}), 404
     music_url = request.args.get("url")
     if not music_url:
         return jsonify({"error": "Missing url"}), 400
         
-    state = load_json(STATE_FILE)
-    state["current_music"] = music_url
-    save_json(STATE_FILE, state)
+    store.apply("set_music", {"current_music": music_url})
     
     return jsonify({"status": "success", "current_music": music_url})
 
-# ===================== LOCAL CACHE LOGIC =====================
+@bp.route("/state/history", methods=["GET"])
+def state_history():
+    """Lists the newest journal records (map and restore payloads are left out)."""
+    store = room_store()
+    if store is None:
+        return jsonify({"error": "Unknown room"}), 404
+    limit = request.args.get("limit", 50, type=int)
+    records = [
+        dict(r, data=None) if r["op"] in ("map", "restore") else r
+        for r in store.history(limit)
+    ]
+    return jsonify({"version": store.version, "journal": store.stats(), "records": records})
 
-LOCAL_NPCS = "data/local_npcs.json"
-LOCAL_FRACTIONS = "data/local_fractions.json"
-LOCAL_LOCATIONS = "data/local_locations.json"
+@bp.route("/state/rewind", methods=["POST"])
+def rewind_state():
+    """Restores the state after journal record `seq`, or from before the last `before` op.
 
-def update_local_npc(entity_data):
-    """Updates the local NPC list."""
-    npcs = load_json(LOCAL_NPCS)
-    if not isinstance(npcs, list):
-        npcs = []
-        
-    # Check if exists, update
-    found = False
-    for item in npcs:
-        if item.get("id") == entity_data["id"]:
-            item.update(entity_data)
-            found = True
-            break
-            
-    if not found:
-        npcs.append(entity_data)
-        
-    save_json(LOCAL_NPCS, npcs)
+    Without either, rewinds to before the last scene change (set_vis or a playlist advance).
+    """
+    store = room_store()
+    if store is None:
+        return jsonify({"error": "Unknown room"}), 404
+    data = request.json or {}
+    seq = data.get("seq")
+    if seq is None:
+        ops = (data["before"],) if data.get("before") else SCENE_OPS
+        last = next((r for r in reversed(store.history()) if r["op"] in ops), None)
+        if last is None:
+            return jsonify({"error": f"No {' or '.join(ops)} in the journal"}), 404
+        seq = last["seq"] - 1
+    try:
+        version = store.rewind(int(seq))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"status": "success", "restored": seq, "version": version, "state": store.get()})
 
-def update_local_fraction(entity_data, fraction_name):
-    """Updates the local Factions list. If fraction_name is empty, removes entity from all fractions."""
-    fractions = load_json(LOCAL_FRACTIONS)
-    if not isinstance(fractions, dict):
-        fractions = {}
-        
-    # Remove from all fractions first (clean slate)
-    for fname in list(fractions.keys()):
-        fractions[fname] = [i for i in fractions[fname] if i.get("id") != entity_data["id"]]
-        if not fractions[fname]:
-             del fractions[fname]
-             
-    # If we have a new fraction, add it there
-    if fraction_name:
-        if fraction_name not in fractions:
-            fractions[fraction_name] = []
-        fractions[fraction_name].append(entity_data)
-
-    save_json(LOCAL_FRACTIONS, fractions)
+# ===================== LOCAL CACHE LOGIC =====================
+# NPC, faction, location and folder registries live in SQLite (utils/registry_db.py).
 
 @bp.route("/local/location", methods=["POST"])
 def save_local_location():
@@ -245,39 +367,33 @@ def save_local_location():
     if not folder_id or not name:
         return jsonify({"error": "Missing id or name"}), 400
         
-    locations = load_json(LOCAL_LOCATIONS)
-    if not isinstance(locations, list):
-        locations = []
-        
-    # Avoid duplicates
-    if not any(l["id"] == folder_id for l in locations):
-        locations.append({"id": folder_id, "name": name})
-        save_json(LOCAL_LOCATIONS, locations)
-        
+    # Duplicates are ignored by the unique index
+    registry_db.add_location(folder_id, name)
     return jsonify({"status": "success"})
 
 @bp.route("/local/sidebar", methods=["GET"])
 def get_sidebar_data():
-    """Returns combined local data for sidebar."""
-    return jsonify({
-        "locations": load_json(LOCAL_LOCATIONS) or [],
-        "npcs": load_json(LOCAL_NPCS) or [],
-        "fractions": load_json(LOCAL_FRACTIONS) or {}
-    })
+    """Returns combined local data for sidebar (ETag / 304, optional ?wait=)."""
+    tables = ("entities", "locations")
+    return versioned_json(
+        "sidebar",
+        lambda: registry_db.version(*tables),
+        lambda: {
+            "locations": registry_db.list_locations(),
+            "npcs": registry_db.list_npcs(),
+            "fractions": registry_db.list_fractions()
+        },
+        lambda version, timeout: registry_db.wait_for_change(tables, version, timeout)
+    )
 
 # ===================== DYNAMIC TREE LOGIC =====================
 
 # We store flat headers: ID -> {name, parent_id}
-LOCAL_FOLDERS_FILE = "data/local_folders.json"
-
 def get_local_folders():
-    data = load_json(LOCAL_FOLDERS_FILE)
-    if not isinstance(data, dict):
-        return {}
-    return data
+    return registry_db.get_folders()
 
 def save_local_folders(data):
-    save_json(LOCAL_FOLDERS_FILE, data)
+    registry_db.replace_folders(data)
 
 @bp.route("/drive/visit", methods=["POST"])
 def visit_folder():
@@ -290,24 +406,52 @@ def visit_folder():
     if not folder_id or not name:
         return jsonify({"error": "Missing id or name"}), 400
         
-    folders = get_local_folders()
-    
-    # Update entry
-    folders[folder_id] = {
-        "id": folder_id,
-        "name": name,
-        "parent_id": parent_id
-    }
-    
-    save_local_folders(folders)
+    registry_db.upsert_folder(folder_id, name, parent_id)
     return jsonify({"status": "success"})
 
+def tree_is_built():
+    """True if the folder table holds a full scan of the current root, kept up to date by deltas."""
+    return registry_db.get_meta("tree_root") == str(ROOT_FOLDER_ID)
+
+def apply_folder_change(change):
+    """Changes feed listener: applies folder creates/renames/moves/removals to the flat cache."""
+    file = change.get("file") or {}
+    if not change.get("removed") and file.get("mimeType") != FOLDER_MIME:
+        return # Most changes are files, skip them before touching the disk
+    if not tree_is_built():
+        return
+    folder_id = change.get("fileId")
+    
+    if change.get("removed") or file.get("trashed"):
+        registry_db.remove_folder_tree(folder_id)
+        return
+        
+    parents = file.get("parents") or [None]
+    if folder_id == ROOT_FOLDER_ID or not ROOT_FOLDER_ID:
+        registry_db.upsert_folder(folder_id, file.get("name"), None if ROOT_FOLDER_ID else parents[0])
+    elif registry_db.has_folder(parents[0]):
+        registry_db.upsert_folder(folder_id, file.get("name"), parents[0])
+    else:
+        registry_db.remove_folder_tree(folder_id) # Moved out of the campaign (no-op if unknown)
+
+changes.add_listener(apply_folder_change)
+
 @bp.route("/drive/tree/refresh", methods=["POST"])
 def refresh_tree():
-    """Fetches ALL folders from Drive and rebuilds the flat cache."""
+    """Brings the flat folder cache up to date and returns the tree.
+
+    The first refresh (or ?full=1) scans the campaign root; later ones only apply
+    deltas from the Drive changes feed.
+    """
+    if tree_is_built() and request.args.get("full") != "1":
+        changes.poll()
+        return get_tree()
+        
     all_folders = get_all_folders()
+    if not all_folders:
+        return jsonify({"error": "Failed to fetch folders"}), 502
+        
     flat_map = {}
-    
     for f in all_folders:
         pid = f.get('parents', [None])[0] if f.get('parents') else None
         flat_map[f['id']] = {
@@ -316,15 +460,30 @@ def refresh_tree():
             "parent_id": pid
         }
     
-    # Ensure ROOT is there if configured
-    if ROOT_FOLDER_ID and ROOT_FOLDER_ID not in flat_map:
-         pass
-
     save_local_folders(flat_map)
+    registry_db.set_meta("tree_root", str(ROOT_FOLDER_ID))
     return get_tree() # Return the built tree
 
+_tree_cache = {"version": None, "body": None} # Encoded tree of the last folders version
+
 @bp.route("/drive/tree", methods=["GET"])
 def get_tree():
+    """Returns the folder tree (ETag / 304, optional ?wait=); rebuilt only when folders change."""
+    def build():
+        version = registry_db.version("folders")
+        if _tree_cache["version"] != version:
+            _tree_cache["body"] = codec.dumps(build_tree())
+            _tree_cache["version"] = version
+        return _tree_cache["body"]
+
+    return versioned_json(
+        "tree",
+        lambda: registry_db.version("folders"),
+        build,
+        lambda version, timeout: registry_db.wait_for_change(("folders",), version, timeout)
+    )
+
+def build_tree():
     """Reconstructs tree from local flat cache."""
     folders = get_local_folders()
     
@@ -356,4 +515,4 @@ def get_tree():
             
     sort_nodes(roots)
     
-    return jsonify(roots)
\ No newline at end of file
+    return roots
\ No newline at end of file
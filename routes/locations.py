@@ -1,20 +1,19 @@
 from flask import Blueprint, request, jsonify
 from werkzeug.utils import secure_filename
 import os
-from utils.file_ops import load_state, save_state, ensure_node
+from utils.state_store import state_store
 from utils.schema import Metadata, CampaignState
-from utils.drive import get_drive_service
+from utils.drive import drive_client
 from googleapiclient.http import MediaFileUpload
 
 bp = Blueprint("locations", __name__)
-STATE_PATH = "data/state.json"
 UPLOAD_FOLDER_ID = "<DRIVE_FOLDER_ID>"  # <-- folder na Drive, np. ID kampanii
 
 
 @bp.route("/tree", methods=["GET"])
 def get_tree():
-    """Zwraca drzewo całej kampanii (lokalnie z state.json)"""
-    state = load_state(STATE_PATH)
+    """Zwraca drzewo całej kampanii (z pamięci, bez czytania state.json)"""
+    state = state_store.campaign_state()
     tree = build_tree_from_state(state)
     return jsonify(tree)
 
@@ -59,7 +58,6 @@ def upload_asset():
     temp_path = os.path.join("data", filename)
     file.save(temp_path)
 
-    service = get_drive_service()
     file_metadata = {
         "name": filename,
         "parents": [UPLOAD_FOLDER_ID],
@@ -67,11 +65,12 @@ def upload_asset():
 
     media = MediaFileUpload(temp_path, resumable=True, mimetype="image/jpeg")
 
-    upload = (
-        service.files()
-        .create(body=file_metadata, media_body=media, fields="id, webViewLink, webContentLink")
-        .execute()
-    )
+    with drive_client() as service:
+        upload = (
+            service.files()
+            .create(body=file_metadata, media_body=media, fields="id, webViewLink, webContentLink")
+            .execute()
+        )
 
     # sprzątanie lokalnego pliku tymczasowego
     os.remove(temp_path)
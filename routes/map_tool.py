@@ -1,8 +1,13 @@
-from flask import Blueprint, render_template, jsonify, request, send_file, session
+from flask import Blueprint, render_template, jsonify, request, send_file, session, abort
 import os
-import json
+from utils import codec
 import base64
-from utils.drive import get_file_content, get_drive_service
+import shutil
+from utils.drive import get_file_content, get_file_path
+from utils import entity_index
+from utils.map_session import validate_ops
+from utils.rooms import rooms, DEFAULT_ROOM
+from utils.http_cache import versioned_json, wait_seconds
 from routes.drive import get_tree as get_drive_tree, get_local_folders, save_local_folders
 
 bp = Blueprint("map_tool", __name__)
@@ -12,42 +17,75 @@ MAP_ASSETS_DIR = os.path.join(ASSETS_DIR, "map")
 CHARACTERS_DIR = os.path.join(ASSETS_DIR, "characters")
 SAVED_MAPS_DIR = "data/maps"
 
-# Global state for map synchronization
-# In-memory storage. Reset on server restart.
-CURRENT_MAP_STATE = {
-    "data": None,
-    "timestamp": 0
-}
+# Map synchronization: numbered ops on top of each room's state journal, so it survives restarts
 
 # Ensure directories exist
 os.makedirs(SAVED_MAPS_DIR, exist_ok=True)
 os.makedirs(MAP_ASSETS_DIR, exist_ok=True)
 os.makedirs(CHARACTERS_DIR, exist_ok=True)
 
+def get_room(room_id):
+    room = rooms.get(room_id)
+    if room is None:
+        abort(404)
+    return room
+
 @bp.route("/map")
-def map_editor():
-    """Renders the standalone map editor."""
+@bp.route("/map/r/<room_id>")
+def map_editor(room_id=DEFAULT_ROOM):
+    """Renders the standalone map editor (of one game table)."""
+    get_room(room_id)
     is_admin = session.get('logged_in', False)
-    return render_template("map.html", is_admin=is_admin)
+    sync_url = "/api/map/sync" if room_id == DEFAULT_ROOM else f"/api/map/{room_id}/sync"
+    return render_template("map.html", is_admin=is_admin, room_id=room_id, sync_url=sync_url)
 
 @bp.route("/api/map/sync", methods=["GET", "POST"])
-def sync_map():
-    """Handles map synchronization between Admin and Guests."""
-    global CURRENT_MAP_STATE
-    
+@bp.route("/api/map/<room_id>/sync", methods=["GET", "POST"])
+def sync_map(room_id=DEFAULT_ROOM):
+    """Handles map synchronization between Admin and Guests.
+
+    POST {"ops": [...]} appends numbered ops (add/move/remove/update, see
+    utils/map_session.py); any other body replaces the whole map. GET ?since=<seq>
+    returns only the newer ops, or the full state ("full": true) for late joiners.
+    """
+    room = get_room(room_id)
+    map_session, store = room.map_session, room.store
     if request.method == "POST":
         # Only Admin can push updates
         if not session.get('logged_in'):
             return jsonify({"error": "Unauthorized"}), 403
             
         data = request.json
-        CURRENT_MAP_STATE["data"] = data
-        CURRENT_MAP_STATE["timestamp"] = os.times().system # Simple timestamp
-        return jsonify({"status": "success"})
+        if isinstance(data, dict) and "ops" in data:
+            error = validate_ops(data["ops"])
+            if error:
+                return jsonify({"error": error}), 400
+            try:
+                return jsonify({"status": "success", "seq": map_session.push_ops(data["ops"])})
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        return jsonify({"status": "success", "seq": map_session.push_full(data)})
     
     else: # GET
-        # Guests can pull updates
-        return jsonify(CURRENT_MAP_STATE)
+        # Guests can pull updates; unchanged maps get 304, ?wait= holds until the next push
+        since = request.args.get("since", type=int)
+        wait = wait_seconds()
+        if since is not None and wait and not request.if_none_match:
+            # A delta client that already has the current seq waits like a matching If-None-Match
+            version = store.get_version("map")
+            if since == map_session.snapshot().get("seq", 0):
+                store.wait_for_change(version, wait, which="map")
+
+        def build():
+            delta = map_session.since(since) if since is not None else None
+            return delta or dict(map_session.snapshot(), full=True)
+
+        return versioned_json(
+            f"map-{room_id}-{since}", # Delta bodies depend on since
+            lambda: store.get_version("map"),
+            build,
+            lambda version, timeout: store.wait_for_change(version, timeout, which="map")
+        )
 
 @bp.route("/api/map/assets")
 def list_assets():
@@ -104,8 +142,8 @@ def save_map():
         
     # Save Metadata
     meta_path = os.path.join(SAVED_MAPS_DIR, f"{clean_filename}_meta.json")
-    with open(meta_path, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2)
+    with open(meta_path, "wb") as f:
+        f.write(codec.dumps(metadata, pretty=True))
         
     return jsonify({"status": "success", "path": image_path})
 
@@ -113,76 +151,19 @@ def save_map():
 
 @bp.route("/api/map/drive-list", methods=["GET"])
 def list_drive_maps():
-    """Scans the local folder cache (from drive.py logic) for entities with type='MAP'."""
-    # We might need to iterate over all files we know about. 
-    # Since `local_folders.json` only stores folders, we might need a better source.
-    # However, `drive.py`'s `get_tree` rebuilds structure. 
-    # Let's rely on `local_npcs.json` / `local_fractions.json` pattern, 
-    # but currently maps might not be in a dedicated local registry.
-    
-    # Strategy: Fetch ALL files from Drive (slow) or use `routes/drive.py` existing logic?
-    # The user said: "load maps from entities that have in their metadata_NAME.json type: 'MAP'"
-    # `drive.py` lists entities in a folder. 
-    
-    # We will iterate through ALL folders in `local_folders.json` (if we have IDs) and list their content? No, that's too many requests.
-    # BETTER APPROACH: The User typically navigates the tree. 
-    # BUT the request implies a specific list. 
-    # Let's implement a search for type=MAP in the drive.
-    
-    service = get_drive_service()
-    query = "name contains 'metadata_' and name contains '.json' and trashed = false"
-    
-    # This might be heavy if many files, but it's the most reliable way to find ALL maps.
-    results = service.files().list(q=query, fields="files(id, name, parents)").execute()
-    files = results.get("files", [])
-    
-    maps = []
-    for f in files:
-        # We need to peek inside to see if type="MAP". 
-        # Downloading every metadata file is too slow.
-        # OPTIMIZATION: Assume the user names them properly or we just list them and let user click?
-        # No, we must filter.
-        # Let's try to search inside content? Drive API supports `fullText contains 'MAP'`.
-        pass
-
-    # Revert to: User selects a folder in standard UI -> we see entities.
-    # BUT, for this specific endpoint, let's just use the `drive.py` helper to list a specific folder if provided, 
-    # OR provide a flattened list of everything we've cached?
-    
-    # Let's stick to what `drive.py` does: `list_drive` returns entities.
-    # We will duplicate some logic or import?
-    # `drive.list_drive` requires a `folder_id`.
-    
-    # Special search endpoint for maps:
+    """Lists entities with type='MAP' from the local entity index (no Drive traffic once built)."""
     try:
-        query = "mimeType = 'application/json' and name contains 'metadata_' and trashed = false"
-        # We can't filter by content efficiently without downloading.
-        # So we will fetch them.
-        
-        results = service.files().list(q=query, fields="files(id, name, parents)", pageSize=100).execute()
-        files = results.get("files", [])
-        
-        # We have to check content for type="MAP"
-        # To avoid downloading ALL 100 files, we rely on the name? No.
-        # We'll download them. It's metadata, it's small.
+        if not entity_index.is_built():
+            entity_index.rebuild()
+            
+        maps = [{
+            "id": e["id"],
+            "name": e["name"],
+            "image": e["image"],
+            "metadata_id": e["id"] # The ID of the JSON file
+        } for e in entity_index.query("MAP")]
         
-        valid_maps = []
-        for f in files:
-            content = get_file_content(f['id'])
-            if content:
-                try:
-                    data = json.loads(content)
-                    if data.get("type", "").upper() == "MAP":
-                        valid_maps.append({
-                            "id": f['id'],
-                            "name": data.get("name", f["name"]),
-                            "image": data.get("image", ""),
-                            "metadata_id": f['id'] # The ID of the JSON file
-                        })
-                except:
-                    continue
-                    
-        return jsonify(valid_maps)
+        return jsonify(maps)
     except Exception as e:
         print(f"Error listing maps: {e}")
         return jsonify({"error": str(e)}), 500
@@ -201,7 +182,7 @@ def import_drive_map():
     if not content:
         return jsonify({"error": "Metadata not found"}), 404
     
-    meta_json = json.loads(content)
+    meta_json = codec.loads(content)
     image_drive_link = meta_json.get("image", "")
     
     # 2. Extract File ID from the image link
@@ -214,12 +195,10 @@ def import_drive_map():
     else:
         return jsonify({"error": "Could not parse image ID from link"}), 400
         
-    # 3. Download Image
-    service = get_drive_service()
-    try:
-        image_data = service.files().get_media(fileId=image_id).execute()
-    except Exception as e:
-        return jsonify({"error": f"Failed to download image: {e}"}), 500
+    # 3. Download Image (served from the local blob cache if unchanged on Drive)
+    cached_image = get_file_path(image_id)
+    if not cached_image:
+        return jsonify({"error": "Failed to download image"}), 500
         
     # 4. Save Locally
     map_name = meta_json.get("name", "imported_map")
@@ -228,15 +207,14 @@ def import_drive_map():
     local_image_path = os.path.join(SAVED_MAPS_DIR, f"{clean_filename}.png")
     local_meta_path = os.path.join(SAVED_MAPS_DIR, f"{clean_filename}_meta.json")
     
-    with open(local_image_path, "wb") as f:
-        f.write(image_data)
+    shutil.copyfile(cached_image, local_image_path)
         
     # Update metadata with local path?? 
     # User said: "load maps from entities... dont change them on google drive... store in proper folder"
     # We store the original metadata plus maybe extra MapTool specific data if we have it.
     
-    with open(local_meta_path, "w", encoding="utf-8") as f:
-        json.dump(meta_json, f, indent=2)
+    with open(local_meta_path, "wb") as f:
+        f.write(codec.dumps(meta_json, pretty=True))
         
     return jsonify({
         "status": "success", 
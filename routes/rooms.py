@@ -0,0 +1,24 @@
+from flask import Blueprint, request, jsonify
+from utils.rooms import rooms, room_path
+
+bp = Blueprint("rooms", __name__)
+
+@bp.route("/rooms", methods=["GET"])
+def list_rooms():
+    """Lists game tables with their display and map URLs."""
+    return jsonify({
+        "rooms": [{
+            "id": room_id,
+            "vis": room_path("/vis", room_id),
+            "map": room_path("/map", room_id),
+        } for room_id in rooms.list()],
+        "stats": rooms.stats()
+    })
+
+@bp.route("/rooms", methods=["POST"])
+def create_room():
+    """Creates a new game table: {"id": "<letters, digits, - or _>"}."""
+    room_id = (request.json or {}).get("id", "")
+    if not rooms.create(room_id):
+        return jsonify({"error": "Invalid or existing room id"}), 400
+    return jsonify({"status": "success", "id": room_id}), 201
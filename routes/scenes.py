@@ -0,0 +1,49 @@
+from flask import Blueprint, request, jsonify
+from utils.rooms import rooms
+from utils import scenes
+
+bp = Blueprint("scenes", __name__)
+
+def room_store():
+    """State store of the ?room= game table, or None if it does not exist."""
+    room = rooms.get(request.args.get("room"))
+    return room.store if room else None
+
+@bp.route("/scenes", methods=["GET"])
+def get_playlist():
+    """The scene playlist of a room (?room=, default: the main table) and prefetch counters."""
+    store = room_store()
+    if store is None:
+        return jsonify({"error": "Unknown room"}), 404
+    return jsonify({"playlist": scenes.get_playlist(store), "prefetch": scenes.prefetcher.stats()})
+
+@bp.route("/scenes", methods=["POST"])
+def set_playlist():
+    """Replaces the playlist: {"scenes": [<entity file id> | {"name", "image", "music", "notes"}, ...]}."""
+    store = room_store()
+    if store is None:
+        return jsonify({"error": "Unknown room"}), 404
+    items = (request.json or {}).get("scenes")
+    if not isinstance(items, list):
+        return jsonify({"error": "scenes must be a list"}), 400
+    loaded = scenes.load_scenes(items)
+    missing = [item for item, scene in zip(items, loaded) if scene is None]
+    if missing:
+        return jsonify({"error": "Unknown or invalid scenes", "scenes": missing}), 400
+    return jsonify({"status": "success", "playlist": scenes.set_playlist(store, loaded)})
+
+@bp.route("/scenes/advance", methods=["POST"])
+def advance():
+    """Shows another scene: {"index": n} or {"step": 1 | -1} (default: the next one)."""
+    store = room_store()
+    if store is None:
+        return jsonify({"error": "Unknown room"}), 404
+    data = request.json or {}
+    index = data.get("index")
+    if index is None:
+        index = scenes.get_playlist(store)["index"] + data.get("step", 1)
+    try:
+        playlist = scenes.goto(store, int(index))
+    except (IndexError, ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"status": "success", "index": playlist["index"], "scene": playlist["scenes"][playlist["index"]]})
@@ -0,0 +1,32 @@
+from flask import Blueprint, jsonify, request
+import time
+from utils import entity_index, search_index
+
+bp = Blueprint("search", __name__)
+
+@bp.route("/search", methods=["GET"])
+def search():
+    """Full-text search over entity metadata. Usage: /api/search?q=karczmarz&type=NPC&limit=20"""
+    query = request.args.get("q", "").strip()
+    entity_type = request.args.get("type", "").upper()
+    limit = min(request.args.get("limit", 20, type=int), 200)
+    if not query:
+        return jsonify({"error": "Missing q"}), 400
+        
+    if not entity_index.is_built():
+        entity_index.rebuild()
+    started = time.perf_counter()
+    entries = {}
+    
+    def accept(doc_id):
+        entries[doc_id] = entity_index.get(doc_id)
+        return entries[doc_id] is not None and (not entity_type or entries[doc_id]["type"] == entity_type)
+        
+    hits = search_index.search(query, limit=limit, accept=accept)
+    results = [{**entries[doc_id], "score": score} for doc_id, score in hits]
+    
+    return jsonify({
+        "query": query,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
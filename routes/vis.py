@@ -1,51 +1,213 @@
-from flask import Blueprint, jsonify, render_template, request, Response, stream_with_context
-from utils.file_ops import load_json
+from flask import Blueprint, render_template, request, Response, send_file, abort, jsonify, session
+from utils.rooms import rooms, room_path, DEFAULT_ROOM
+from utils.state_store import display_view
+from utils import codec
+from utils.http_cache import versioned_json
+from utils.drive import MIRROR_MODE, mirror
+from utils.drive_utils import extract_drive_id, direct_media_link, is_youtube_url
+from utils.proxy_cache import media_cache
+from utils.image_derivatives import derivatives, negotiate, snap_width
 import os
-import requests
 
 bp = Blueprint("vis", __name__)
-STATE_FILE = "data/state.json"
+
+STREAM_HEARTBEAT = 15 # Seconds between keep-alive comments on idle streams
+
+def get_room(room_id):
+    room = rooms.get(room_id)
+    if room is None:
+        abort(404)
+    return room
 
 @bp.route("/vis")
-def vis_page():
-    """Render the visualization page."""
-    return render_template("vis.html")
+@bp.route("/vis/r/<room_id>")
+def vis_page(room_id=DEFAULT_ROOM):
+    """Render the visualization page (of one game table)."""
+    get_room(room_id)
+    return render_template("vis.html", room_id=room_id, room_base=room_path("/vis", room_id))
 
 @bp.route("/vis/state")
-def get_vis_state():
-    """Return the current state for the visualization page to poll."""
-    state = load_json(STATE_FILE)
-    return jsonify(state)
+@bp.route("/vis/r/<room_id>/state")
+def get_vis_state(room_id=DEFAULT_ROOM):
+    """Return the current display state for the visualization page to poll (ETag / 304, optional ?wait=)."""
+    store = get_room(room_id).store
+    return versioned_json(f"vis-{room_id}", store.get_version, lambda: display_view(store.get()), store.wait_for_change)
+
+@bp.route("/vis/preload")
+@bp.route("/vis/r/<room_id>/preload")
+def get_preload(room_id=DEFAULT_ROOM):
+    """The next scene of the room's playlist, for displays to preload (ETag / 304, optional ?wait=).
+
+    Displays on the stream get the same hint as `next_scene` in the state.
+    """
+    store = get_room(room_id).store
+    return versioned_json(f"preload-{room_id}", store.get_version, lambda: {"next_scene": store.get().get("next_scene")}, store.wait_for_change)
+
+@bp.route("/vis/stream")
+@bp.route("/vis/r/<room_id>/stream")
+def vis_stream(room_id=DEFAULT_ROOM):
+    """Server-Sent Events: pushes the state on every change, with the state version as event id.
+
+    Browsers resume with Last-Event-ID; a client that is already current gets no initial event.
+    """
+    room = get_room(room_id)
+    store = room.store
+    try:
+        since = int(request.headers.get("Last-Event-ID") or request.args.get("since", -1))
+    except ValueError:
+        since = -1
+
+    def events():
+        version = since
+        sent = None
+        yield "retry: 2000\n\n"
+        while True:
+            rooms.touch(room) # An open display keeps its room loaded
+            if store.wait_for_change(version, timeout=STREAM_HEARTBEAT) == version:
+                yield ": heartbeat\n\n"
+                continue
+            state, version = store.get_versioned()
+            view = display_view(state)
+            if view != sent: # Playlist / campaign edits do not concern displays
+                sent = view
+                yield f"id: {version}\nevent: state\ndata: {codec.dumps_str(view)}\n\n"
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+PROXY_MAX_AGE = 3600 # Browsers revalidate cached media with the ETag after this
+
+def send_cached(path, meta):
+    """Serves a cached body with ETag / Last-Modified / Cache-Control; Range requests get 206."""
+    return send_file(
+        os.path.abspath(path),
+        mimetype=meta.get("content_type"),
+        conditional=True,
+        etag=meta.get("etag"),
+        last_modified=meta.get("last_modified"),
+        max_age=PROXY_MAX_AGE,
+    )
+
+def send_proxied(url):
+    """Serves url from the proxy cache. While it is being fetched the body is streamed
+    from the shared download, so concurrent requests never hit the origin twice.
+
+    Range requests on a running download get 206 as soon as the origin sent its length;
+    bytes not downloaded yet are waited for.
+    """
+    path, meta, download = media_cache.open(url)
+    if download is None:
+        return send_cached(path, meta)
+    download.wait_headers(media_cache.timeout)
+    length = download.length
+    if download.done or download.meta is None or (request.range and length is None):
+        return send_cached(*download.wait())
+    headers = {"ETag": f'"{download.meta["etag"]}"', "Cache-Control": f"public, max-age={PROXY_MAX_AGE}", "Accept-Ranges": "bytes"}
+    status, start, end = 200, 0, length
+    if request.range:
+        byte_range = request.range.range_for_length(length)
+        if byte_range is None:
+            return Response(status=416, headers={"Content-Range": f"bytes */{length}"})
+        status, (start, end) = 206, byte_range
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{length}"
+    if end is not None:
+        headers["Content-Length"] = str(end - start)
+    return Response(download.tail(start, end), status=status, mimetype=download.meta["content_type"], headers=headers)
+
+def room_media(state):
+    """Media URLs a room's displays may ask for: what is shown, the preload hint and the playlist."""
+    urls = {state.get("current_image"), state.get("current_music")}
+    for scene in [state.get("next_scene")] + list(state.get("playlist") or []):
+        if scene:
+            urls.update((scene.get("image"), scene.get("music")))
+    return urls - {None, ""}
+
+def allowed_media(url):
+    """The proxies need no login (displays use them), so guests only get media of a loaded room."""
+    return session.get("logged_in", False) or any(url in room_media(room.store.get()) for room in rooms.loaded())
+
+def mirrored_source(file_id, path):
+    """(path, meta) of a mirrored Drive file, shaped like the proxy cache entries."""
+    meta = mirror.get_metadata(file_id) or {}
+    mtime = os.path.getmtime(path)
+    return path, {"content_type": meta.get("mimeType"), "etag": meta.get("md5Checksum") or f"{file_id}-{int(mtime)}", "last_modified": mtime}
 
 @bp.route("/vis/proxy_image")
 def proxy_image():
     """
     Proxies an image from an external URL (e.g., Google Drive) to bypass CORS and redirect issues.
-    Usage: /vis/proxy_image?url=<ENCODED_URL>
+    Usage: /vis/proxy_image?url=<ENCODED_URL>[&w=<width>][&fmt=auto|webp|avif|jpeg|png]
+    Bodies are cached on disk (utils/proxy_cache.py), so re-showing a scene is served locally.
+    With w / fmt the image is resized and transcoded (utils/image_derivatives.py); fmt=auto
+    picks AVIF or WebP from the Accept header.
     """
     image_url = request.args.get('url')
     if not image_url:
         return "Missing URL", 400
+    if not allowed_media(image_url):
+        return "Not shown in any room", 403
+
+    # Offline mirror: Drive images are served from disk
+    file_id = extract_drive_id(image_url) if "google.com" in image_url else None
+    mirrored = mirror.blob_path(file_id) if file_id else None
+
+    width = request.args.get("w", type=int)
+    if derivatives.available and (width or request.args.get("fmt")):
+        try:
+            source = mirrored_source(file_id, mirrored) if mirrored and MIRROR_MODE else media_cache.fetch(image_url)
+            fmt = negotiate(request.args.get("fmt"), request.headers.get("Accept"))
+            response = send_cached(*derivatives.get(*source, snap_width(width) if width and width > 0 else None, fmt))
+            response.vary.add("Accept")
+            return response
+        except Exception as e:
+            print(f"Image derivative error, serving the original: {e}")
+
+    if mirrored and MIRROR_MODE:
+        return send_file(os.path.abspath(mirrored), mimetype=(mirror.get_metadata(file_id) or {}).get("mimeType"), conditional=True)
 
     try:
-        # Use stream=True to avoid loading the whole file into memory
-        # allow_redirects=True is crucial for Drive links (uc?export=view -> redirects to content)
-        req = requests.get(image_url, stream=True, allow_redirects=True, timeout=10)
-
-        # Basic error check
-        if req.status_code != 200:
-            return f"Error fetching image: {req.status_code}", 502
-
-        # Create a generator to stream the content
-        def generate():
-            for chunk in req.iter_content(chunk_size=4096):
-                yield chunk
-
-        # Pass along the content type (e.g. image/jpeg)
-        content_type = req.headers.get('Content-Type', 'application/octet-stream')
-        
-        return Response(stream_with_context(generate()), content_type=content_type)
-        
+        return send_proxied(image_url)
     except Exception as e:
         print(f"Proxy error: {e}")
-        return str(e), 500
\ No newline at end of file
+        if mirrored:
+            return send_file(os.path.abspath(mirrored), mimetype=(mirror.get_metadata(file_id) or {}).get("mimeType"), conditional=True)
+        return f"Error fetching image: {e}", 502
+
+@bp.route("/vis/proxy_audio")
+def proxy_audio():
+    """
+    Proxies a music file (Dropbox / Drive links) for the <audio> player of /vis.
+    Usage: /vis/proxy_audio?url=<ENCODED_URL>
+    Every display shares one cached copy; seeking and looping are Range requests served from disk.
+    """
+    music_url = request.args.get('url')
+    if not music_url:
+        return "Missing URL", 400
+    if is_youtube_url(music_url):
+        return "YouTube tracks are played by the YouTube player", 400
+    if not allowed_media(music_url):
+        return "Not played in any room", 403
+    try:
+        return send_proxied(direct_media_link(music_url))
+    except Exception as e:
+        print(f"Audio proxy error: {e}")
+        return f"Error fetching audio: {e}", 502
+
+@bp.route("/vis/proxy_audio/preload")
+def preload_audio():
+    """Starts caching a track in the background (e.g. the next scene's music), without sending it."""
+    music_url = request.args.get('url')
+    if not music_url or is_youtube_url(music_url):
+        return jsonify({"error": "Missing or YouTube URL"}), 400
+    if not allowed_media(music_url):
+        return jsonify({"error": "Not played in any room"}), 403
+    path, _, _ = media_cache.open(direct_media_link(music_url))
+    return jsonify({"status": "cached" if path else "fetching"}), 200 if path else 202
+
+@bp.route("/vis/proxy_stats")
+def proxy_stats():
+    """Cache hits, upstream fetches and coalesced (shared) downloads of the media proxy, plus image derivatives."""
+    return jsonify(dict(media_cache.stats(), derivatives=derivatives.stats()))
@@ -0,0 +1,115 @@
+from flask import Blueprint, jsonify, request, session
+import threading
+from utils import codec
+from utils.broadcast import BroadcastHub
+from utils.map_session import validate_ops
+from utils.rooms import rooms
+from utils.state_store import display_view
+
+# WebSockets need the optional flask-sock package; without it only the stats route exists
+# and displays keep using SSE / polling.
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:
+    Sock = None
+
+bp = Blueprint("ws", __name__)
+
+TOPICS = ("vis", "map")
+PING_INTERVAL = 25 # Seconds of silence before a ping, so dead connections are noticed
+
+
+def snapshot(topic):
+    """Hub topics are "<room_id>:vis" / "<room_id>:map"."""
+    room_id, kind = topic.rsplit(":", 1)
+    room = rooms.get(room_id)
+    if room is None: # Deleted from disk while subscribed
+        return {"type": "error", "error": "Unknown room"}
+    if kind == "vis":
+        state, version = room.store.get_versioned()
+        return {"type": "vis_snapshot", "version": version, "state": display_view(state)}
+    return {"type": "map_snapshot", "state": room.map_session.snapshot()}
+
+
+hub = BroadcastHub(snapshot)
+
+
+def watch_room(room):
+    """Room load hook: turns the room's journal records into hub messages."""
+    vis_topic, map_topic = f"{room.id}:vis", f"{room.id}:map"
+
+    def publish_change(op, data, version):
+        if op in ("set", "set_vis", "set_music", "scene"):
+            changes = display_view(data)
+            if changes:
+                hub.publish(vis_topic, {"type": "vis", "version": version, "changes": changes})
+        elif op == "map_ops":
+            seq = data["seq"]
+            ops = [dict(o, seq=seq - len(data["ops"]) + i + 1) for i, o in enumerate(data["ops"])]
+            hub.publish(map_topic, {"type": "map_ops", "seq": seq, "ops": ops})
+        elif op == "map":
+            hub.resync(map_topic)
+        elif op == "restore":
+            hub.resync(vis_topic)
+            hub.resync(map_topic)
+
+    room.store.add_listener(publish_change)
+
+rooms.add_load_hook(watch_room)
+
+
+def handle_incoming(room, raw, is_admin):
+    """Client -> server messages. Admins can push map ops; everything else is ignored."""
+    try:
+        message = codec.loads(raw)
+    except ValueError:
+        return
+    if not is_admin or not isinstance(message, dict) or message.get("type") != "map_ops":
+        return
+    if validate_ops(message.get("ops")) is None:
+        try:
+            room.map_session.push_ops(message["ops"])
+        except ValueError as e:
+            print(f"Rejected map ops from socket: {e}")
+
+
+def table_socket(ws):
+    """One connection per display/phone: /ws?room=<id>&topics=vis,map. Sends snapshots first, then updates."""
+    room = rooms.get(request.args.get("room"))
+    if room is None:
+        ws.close(reason=1008, message="Unknown room")
+        return
+    topics = [f"{room.id}:{t}" for t in request.args.get("topics", "vis,map").split(",") if t in TOPICS]
+    is_admin = session.get("logged_in", False)
+    subscriber = hub.connect(topics)
+
+    def read():
+        try:
+            while True:
+                handle_incoming(room, ws.receive(), is_admin)
+        except ConnectionClosed:
+            hub.disconnect(subscriber)
+
+    threading.Thread(target=read, name="ws-reader", daemon=True).start()
+    try:
+        while not subscriber.closed:
+            rooms.touch(room) # A connected table keeps its room loaded
+            message = hub.next_message(subscriber, timeout=PING_INTERVAL)
+            if message is not None:
+                ws.send(message)
+            elif not subscriber.closed:
+                ws.send('{"type":"ping"}')
+    except ConnectionClosed:
+        pass
+    finally:
+        hub.disconnect(subscriber)
+
+if Sock is not None:
+    Sock().route("/ws", bp=bp)(table_socket)
+
+
+@bp.route("/api/ws/stats")
+def ws_stats():
+    """Connected clients, message rates and backpressure counters."""
+    return jsonify(dict(hub.stats(), available=Sock is not None))
@@ -0,0 +1,38 @@
+# tests/conftest.py
+import os
+import sys
+import pytest
+
+# Modules are imported as in the app (utils.x, routes.x), from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_dir(tmp_path, monkeypatch):
+    """Relative data/ paths of module-level caches land in the test's temp dir, not the repo."""
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    """Empty entity and search indexes; Drive is replaced by `files` and `contents`."""
+    from utils import entity_index, search_index
+    for module, names in ((entity_index, ("_entries", "_by_type")), (search_index, ("_docs", "_postings", "_name_postings"))):
+        for name in names:
+            monkeypatch.setattr(module, name, {})
+    monkeypatch.setattr(search_index, "_vocab", [])
+    for module in (entity_index, search_index):
+        monkeypatch.setattr(module, "_loaded", False)
+        monkeypatch.setattr(module, "_save_timer", None)
+        monkeypatch.setattr(module, "SAVE_DELAY", 60)
+    monkeypatch.setattr(entity_index, "_built", False)
+    monkeypatch.setattr(entity_index, "_dirty", False)
+
+    drive = {"files": [], "contents": {}}
+    monkeypatch.setattr(entity_index.changes, "maybe_poll", lambda: None)
+    monkeypatch.setattr(entity_index, "list_metadata_files", lambda: drive["files"])
+    monkeypatch.setattr(entity_index, "get_files_content", lambda ids: {i: drive["contents"].get(i) for i in ids})
+    yield drive
+    for module in (entity_index, search_index):
+        if module._save_timer is not None:
+            module._save_timer.cancel()
@@ -0,0 +1,28 @@
+# tests/test_blob_cache.py
+import os
+from utils.blob_cache import BlobCache
+
+
+def test_index_writes_are_coalesced(tmp_path):
+    cache = BlobCache(str(tmp_path / "blobs"), max_bytes=1024 * 1024, save_delay=60)
+    for i in range(20):
+        cache.put_bytes(f"f{i}", "v1", b"body %d" % i)
+    cache.update_meta("f0", etag="x")
+    cache.discard("f1")
+    assert not os.path.exists(cache.index_file)
+
+    cache.flush()
+    cache.flush() # Nothing new to write
+    assert cache.stats()["index_writes"] == 1
+
+    reopened = BlobCache(str(tmp_path / "blobs"), max_bytes=1024 * 1024)
+    assert reopened.stats()["files"] == 19
+    assert reopened.get_meta("f0")[1] == {"etag": "x"}
+    assert open(reopened.get("f5", "v1"), "rb").read() == b"body 5"
+
+
+def test_index_is_written_after_the_delay(tmp_path):
+    cache = BlobCache(str(tmp_path / "blobs"), max_bytes=1024 * 1024, save_delay=0.05)
+    cache.put_bytes("f", "v1", b"body")
+    cache._save_timer.join(5)
+    assert os.path.exists(cache.index_file)
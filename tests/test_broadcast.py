@@ -0,0 +1,66 @@
+# tests/test_broadcast.py
+import json
+import pytest
+from utils.broadcast import BroadcastHub
+
+
+@pytest.fixture
+def hub():
+    snapshots = []
+
+    def snapshot(topic):
+        snapshots.append(topic)
+        return {"type": "snapshot", "topic": topic}
+
+    hub = BroadcastHub(snapshot, max_queue=3)
+    hub.snapshots = snapshots
+    return hub
+
+
+def drain(hub, subscriber):
+    messages = []
+    while True:
+        encoded = hub.next_message(subscriber, timeout=0)
+        if encoded is None:
+            return messages
+        messages.append(json.loads(encoded))
+
+
+def test_new_subscribers_start_with_a_snapshot(hub):
+    subscriber = hub.connect(["vis"])
+    hub.publish("vis", {"version": 1}) # Covered by the snapshot, which is taken when sent
+    assert drain(hub, subscriber) == [{"type": "snapshot", "topic": "vis"}]
+    hub.publish("vis", {"version": 2})
+    hub.publish("map", {"seq": 1}) # Not subscribed
+    assert drain(hub, subscriber) == [{"version": 2}]
+
+
+def test_a_slow_subscriber_gets_one_snapshot_instead_of_the_backlog(hub):
+    fast, slow = hub.connect(["vis", "map"]), hub.connect(["vis", "map"])
+    drain(hub, fast), drain(hub, slow)
+    hub.publish("map", {"seq": 1})
+    for version in range(1, 6):
+        hub.publish("vis", {"version": version})
+        drain(hub, fast)
+
+    messages = drain(hub, slow)
+    assert sorted(m["topic"] for m in messages) == ["map", "vis"]
+    assert hub.stats()["dropped"] == 3
+    hub.publish("vis", {"version": 6}) # Back to live messages after the snapshot
+    assert drain(hub, slow) == [{"version": 6}]
+
+
+def test_resync_replaces_queued_messages_of_a_topic(hub):
+    subscriber = hub.connect(["vis", "map"])
+    drain(hub, subscriber)
+    hub.publish("map", {"seq": 1})
+    hub.publish("vis", {"version": 1})
+    hub.resync("map")
+    assert drain(hub, subscriber) == [{"type": "snapshot", "topic": "map"}, {"version": 1}]
+
+
+def test_disconnected_subscribers_stop_waiting(hub):
+    subscriber = hub.connect(["vis"])
+    hub.disconnect(subscriber)
+    assert hub.next_message(subscriber, timeout=5) is None
+    assert hub.stats()["connected"] == 0
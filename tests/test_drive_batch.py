@@ -0,0 +1,113 @@
+# tests/test_drive_batch.py
+import io
+from contextlib import contextmanager
+import pytest
+from werkzeug.datastructures import FileStorage
+from utils import drive
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.batches.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+
+class FakeService:
+    """Answers the files() and permissions() calls the batch helpers make."""
+
+    def __init__(self):
+        self.batches = [] # Size of every executed batch
+        self.created = []
+        self.updated = {}
+        self.shared = []
+        self.refuse_sharing = set()
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def files(self):
+        return self
+
+    def permissions(self):
+        return Permissions(self)
+
+    def create(self, body, media_body, fields):
+        file_id = f"f{len(self.created) + 1}"
+        self.created.append(body["name"])
+        mime = "image/png" if body["name"].endswith(".png") else "application/pdf"
+        return FakeRequest({"id": file_id, "mimeType": mime, "webContentLink": f"link/{file_id}"})
+
+    def update(self, fileId, body, fields):
+        self.updated[fileId] = body
+        return FakeRequest(dict(body, id=fileId))
+
+
+class Permissions:
+    def __init__(self, service):
+        self.service = service
+
+    def create(self, fileId, body, fields):
+        if fileId in self.service.refuse_sharing:
+            return FakeRequest(RuntimeError("sharing disabled"))
+        self.service.shared.append(fileId)
+        return FakeRequest({"id": "p"})
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = FakeService()
+
+    @contextmanager
+    def drive_client():
+        yield service
+    monkeypatch.setattr(drive, "drive_client", drive_client)
+    return service
+
+
+def upload(name):
+    return FileStorage(io.BytesIO(b"data"), filename=name, content_type="application/octet-stream")
+
+
+def test_uploaded_images_are_made_public_in_one_batch(service):
+    results = drive.upload_files([upload("a.png"), upload("notes.pdf"), upload("b.png")], "folder")
+    assert [r["result"]["id"] for r in results] == ["f1", "f2", "f3"]
+    assert all(r["error"] is None for r in results)
+    assert service.shared == ["f1", "f3"]
+    assert service.batches == [2]
+
+
+def test_a_sharing_failure_is_reported_per_file(service):
+    service.refuse_sharing.add("f2")
+    results = drive.upload_files([upload("a.png"), upload("b.png")], "folder")
+    assert results[0]["error"] is None
+    assert results[1]["result"]["id"] == "f2" and "sharing disabled" in results[1]["error"]
+
+
+def test_renames_are_batched_by_the_limit(service, monkeypatch):
+    monkeypatch.setattr(drive, "BATCH_LIMIT", 2)
+    results = drive.batch_rename({"a": "A", "b": "B", "c": "C"})
+    assert {file_id: r["result"]["name"] for file_id, r in results.items()} == {"a": "A", "b": "B", "c": "C"}
+    assert service.updated == {"a": {"name": "A"}, "b": {"name": "B"}, "c": {"name": "C"}}
+    assert service.batches == [2, 1]
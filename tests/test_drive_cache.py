@@ -0,0 +1,122 @@
+# tests/test_drive_cache.py
+from contextlib import contextmanager
+from utils.drive_cache import TTLCache, ChangeFeed
+from utils.file_ops import load_json
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires_entries():
+    clock = FakeClock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set("a", 1)
+    assert cache.get("a") == (True, 1)
+    clock.now += 10
+    assert cache.get("a") == (False, None)
+    assert cache.stats()["expired"] == 1
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a") # "b" is now the oldest
+    cache.set("c", 3)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_invalidates_by_tag():
+    cache = TTLCache(ttl=60)
+    cache.set(("list", "folder"), ["f1", "f2"], tags=["folder", "f1", "f2"])
+    cache.set(("meta", "f1"), {"id": "f1"}, tags=["f1"])
+    cache.set(("meta", "f3"), {"id": "f3"}, tags=["f3"])
+    cache.invalidate("f1")
+    assert cache.get(("list", "folder"))[0] is False
+    assert cache.get(("meta", "f1"))[0] is False
+    assert cache.get(("meta", "f3"))[0] is True
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+
+class FakeChanges:
+    def __init__(self):
+        self.pages = {} # page token -> changes().list response
+        self.requested = []
+
+    def getStartPageToken(self):
+        return FakeRequest({"startPageToken": "1"})
+
+    def list(self, pageToken, pageSize, fields):
+        self.requested.append(pageToken)
+        return FakeRequest(self.pages[pageToken])
+
+
+class FakeService:
+    def __init__(self):
+        self._changes = FakeChanges()
+
+    def changes(self):
+        return self._changes
+
+
+def make_feed(service, clock=None, token_file=None):
+    @contextmanager
+    def factory():
+        yield service
+    return ChangeFeed(factory, interval=15, clock=clock or FakeClock(), token_file=token_file)
+
+
+def test_change_feed_first_poll_only_takes_the_start_token():
+    service = FakeService()
+    feed = make_feed(service)
+    seen = []
+    feed.add_listener(seen.append)
+    assert feed.poll() == 0
+    assert feed.page_token == "1"
+    assert seen == [] and service.changes().requested == []
+
+
+def test_change_feed_follows_pages_and_persists_the_token(tmp_path):
+    service = FakeService()
+    service.changes().pages = {
+        "1": {"changes": [{"fileId": "a"}], "nextPageToken": "2"},
+        "2": {"changes": [{"fileId": "b", "removed": True}], "newStartPageToken": "3"},
+    }
+    token_file = str(tmp_path / "changes.json")
+    feed = make_feed(service, token_file=token_file)
+    feed.page_token = "1"
+    seen = []
+    feed.add_listener(seen.append)
+    assert feed.poll() == 2
+    assert [c["fileId"] for c in seen] == ["a", "b"]
+    assert feed.page_token == "3"
+    assert load_json(token_file) == {"page_token": "3"}
+    assert make_feed(service, token_file=token_file).page_token == "3"
+
+
+def test_change_feed_maybe_poll_respects_the_interval():
+    service = FakeService()
+    service.changes().pages = {"1": {"changes": [], "newStartPageToken": "1"}}
+    clock = FakeClock()
+    feed = make_feed(service, clock=clock)
+    feed.page_token = "1"
+    feed.maybe_poll()
+    feed.maybe_poll()
+    assert service.changes().requested == ["1"]
+    clock.now += 15
+    feed.maybe_poll()
+    assert service.changes().requested == ["1", "1"]
@@ -0,0 +1,33 @@
+# tests/test_entity_index.py
+import os
+from utils import entity_index
+
+
+def entity_file(file_id, name, modified="1"):
+    return {"id": file_id, "name": f"metadata_{name}.json", "parents": ["folder"], "modifiedTime": modified}
+
+
+def test_feed_updates_are_saved_together(index):
+    for i in range(10):
+        entity_index.upsert(entity_file(f"e{i}", f"Npc {i}"), {"type": "npc"})
+    entity_index.remove("e0")
+    assert not os.path.exists(entity_index.ENTITY_INDEX_FILE)
+
+    entity_index.flush()
+    saved = entity_index.load_json(entity_index.ENTITY_INDEX_FILE)
+    assert len(saved["entities"]) == 9 and not saved["built"]
+    assert entity_index._save_timer is None and not entity_index._dirty
+
+
+def test_rebuild_writes_the_index_once(index, monkeypatch):
+    index["files"] = [entity_file(f"e{i}", f"Npc {i}") for i in range(5)]
+    index["contents"] = {f"e{i}": '{"type": "npc", "name": "Npc %d"}' % i for i in range(5)}
+    writes = []
+    save_json = entity_index.save_json
+    monkeypatch.setattr(entity_index, "save_json", lambda path, data, **kw: (writes.append(path), save_json(path, data, **kw)))
+
+    assert entity_index.rebuild() == 5
+    assert writes == [entity_index.ENTITY_INDEX_FILE]
+    saved = entity_index.load_json(entity_index.ENTITY_INDEX_FILE)
+    assert saved["built"] and len(saved["entities"]) == 5
+    assert [e["name"] for e in entity_index.query("NPC")] == [f"Npc {i}" for i in range(5)]
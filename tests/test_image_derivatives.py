@@ -0,0 +1,65 @@
+# tests/test_image_derivatives.py
+import threading
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from utils.image_derivatives import DerivativeCache, snap_width, negotiate, ENCODERS
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DerivativeCache(str(tmp_path / "derivatives"), max_bytes=50 * 1024 * 1024, workers=2)
+    yield cache
+    if cache._pool is not None:
+        cache._pool.shutdown()
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = str(tmp_path / "photo.jpg")
+    Image.new("RGB", (2000, 1000), (200, 120, 40)).save(path, format="JPEG")
+    return path, {"etag": "abc", "content_type": "image/jpeg"}
+
+
+def test_widths_and_formats():
+    assert [snap_width(w) for w in (None, 1, 320, 321, 10000)] == [None, 320, 320, 640, 3840]
+    assert negotiate("jpeg", "") == "jpeg"
+    assert negotiate("gif", "") is None
+    assert negotiate("auto", "text/html") is None
+    if "webp" in ENCODERS:
+        assert negotiate(None, "image/webp,*/*") == "webp"
+
+
+def test_resized_copies_are_rendered_once(cache, photo):
+    src_path, src_meta = photo
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(src_path, src_meta, 640, "jpeg"))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+
+    paths = {path for path, _ in results}
+    assert len(results) == 4 and len(paths) == 1 and src_path not in paths
+    with Image.open(paths.pop()) as img:
+        assert img.size == (640, 320)
+    assert cache.get(src_path, src_meta, 640, "jpeg")[0] == results[0][0]
+    stats = cache.stats()
+    assert stats["rendered"] == 1 and stats["hits"] + stats["coalesced"] == 4
+
+
+def test_nothing_to_gain_serves_the_source(cache, photo):
+    src_path, src_meta = photo
+    assert cache.get(src_path, src_meta, 3840, None) == (src_path, src_meta) # Already smaller, already JPEG
+    assert cache.get(src_path, src_meta, 3840, None) == (src_path, src_meta)
+    assert cache.stats()["passthrough"] == 2 and cache.stats()["rendered"] == 0
+
+
+def test_undecodable_sources_raise(cache, tmp_path):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    with pytest.raises(Exception):
+        cache.get(str(broken), {"etag": "x"}, 640, "jpeg")
+    assert cache.stats()["errors"] == 1
+    assert [p for p in (tmp_path / "derivatives").iterdir() if p.suffix == ".part"] == []
@@ -0,0 +1,94 @@
+# tests/test_journal.py
+import os
+import pytest
+from utils.journal import Journal
+from utils.state_store import StateStore
+
+
+def set_reducer(state, op, data):
+    state.update(data)
+
+
+def snapshot_dir(journal):
+    return sorted(s for s, _ in journal._snapshot_files())
+
+
+def test_load_replays_records_after_the_snapshot(tmp_path):
+    journal = Journal(str(tmp_path), set_reducer)
+    state = journal.load()
+    for i in range(5):
+        journal.append("set", {"n": i})
+        set_reducer(state, "set", {"n": i})
+    journal.snapshot(dict(state), journal.seq)
+    journal.append("set", {"n": 5})
+
+    reloaded = Journal(str(tmp_path), set_reducer)
+    assert reloaded.load() == {"n": 5}
+    assert reloaded.seq == 6
+
+
+def test_state_at_rewinds_across_snapshots(tmp_path):
+    journal = Journal(str(tmp_path), set_reducer, snapshot_every=10)
+    state = journal.load()
+    for i in range(1, 36):
+        journal.append("set", {"n": i})
+        set_reducer(state, "set", {"n": i})
+        if journal.needs_snapshot():
+            journal.snapshot(dict(state), journal.seq)
+    for seq in (1, 9, 10, 11, 35):
+        assert journal.state_at(seq) == {"n": seq}
+
+
+def test_retention_keeps_the_last_keep_records_records(tmp_path):
+    journal = Journal(str(tmp_path), set_reducer, snapshot_every=10, keep_records=50)
+    state = journal.load()
+    for i in range(1, 301):
+        journal.append("set", {"n": i})
+        set_reducer(state, "set", {"n": i})
+        if i % 3 == 0: # Checkpoints much more often than snapshot_every
+            journal.snapshot(dict(state), journal.seq)
+
+    assert journal.state_at(300 - 50) == {"n": 250}
+    assert len(journal.history()) >= 50
+    with pytest.raises(ValueError):
+        journal.state_at(100)
+    # Thinned to about one snapshot per snapshot_every records inside the window
+    assert len(snapshot_dir(journal)) <= 50 // 10 + 3
+
+
+def test_store_rewind_is_journaled(tmp_path):
+    store = StateStore(str(tmp_path / "state.json"), journal_dir=str(tmp_path / "journal"), flush_at_exit=False)
+    first = store.update(current_image="a.jpg")
+    store.update(current_image="b.jpg")
+    store.rewind(first)
+    assert store.get()["current_image"] == "a.jpg"
+    assert store.history()[-1]["op"] == "restore"
+    store.rewind(store.version - 1) # Undo the rewind
+    assert store.get()["current_image"] == "b.jpg"
+
+
+def test_full_maps_are_kept_out_of_the_log(tmp_path):
+    store = StateStore(str(tmp_path / "state.json"), journal_dir=str(tmp_path / "journal"), flush_at_exit=False)
+    big = {"data": {"svg": "x" * 100000}, "nodes": {}}
+    first = store.apply("map", big)
+    store.apply("map_ops", {"ops": [], "seq": 0})
+    store.rewind(first)
+    assert os.path.getsize(store.journal.log_file) < 1000
+    assert [(r["op"], r["data"]) for r in store.history()] == [("map", None), ("map_ops", {"ops": [], "seq": 0}), ("restore", None)]
+    assert store.journal.state_at(first)["map"] == big
+
+    reloaded = StateStore(str(tmp_path / "state.json"), journal_dir=str(tmp_path / "journal"), flush_at_exit=False)
+    assert reloaded.get_map() == big
+
+
+def test_payloads_older_than_the_kept_history_are_removed(tmp_path):
+    journal = Journal(str(tmp_path), set_reducer, snapshot_every=5, keep_records=10, external_ops=("big",))
+    state = journal.load()
+    for i in range(1, 31):
+        journal.append("big", {"n": i})
+        set_reducer(state, "big", {"n": i})
+        if journal.needs_snapshot():
+            journal.snapshot(dict(state), journal.seq)
+    kept = sorted(int(f[len("record-"):-len(".json")]) for f in os.listdir(tmp_path) if f.startswith("record-"))
+    assert kept == list(range(21, 31))
+    assert journal.state_at(25) == {"n": 25}
@@ -0,0 +1,59 @@
+# tests/test_map_session.py
+import pytest
+from utils.map_session import MapSession, validate_ops
+from utils.state_store import StateStore
+
+
+@pytest.fixture
+def session(tmp_path):
+    store = StateStore(str(tmp_path / "state.json"), journal_dir=str(tmp_path / "journal"), flush_at_exit=False)
+    return MapSession(store)
+
+
+def test_validate_ops():
+    assert validate_ops([]) is not None
+    assert validate_ops([{"op": "teleport", "id": 1}]) is not None
+    assert validate_ops([{"op": "add", "id": 1}]) is not None # No node
+    assert validate_ops([{"op": "add", "id": 1, "node": {"x": 0}}, {"op": "remove", "id": 1}]) is None
+
+
+def test_full_push_seeds_nodes_for_ops(session):
+    seq = session.push_full({"background": "map.png", "nodes": {1: {"x": 0, "y": 0}}})
+    assert session.snapshot()["nodes"] == {"1": {"x": 0, "y": 0}}
+    assert "nodes" not in session.snapshot()["data"]
+
+    seq = session.push_ops([{"op": "move", "id": 1, "x": 5, "y": 6}])
+    assert session.snapshot()["nodes"]["1"] == {"x": 5, "y": 6}
+    assert session.since(seq - 1)["ops"] == [{"op": "move", "id": 1, "x": 5, "y": 6, "seq": seq}]
+
+
+def test_ops_on_unknown_ids_are_rejected(session):
+    session.push_full({"background": "map.png", "nodes": {"a": {}}})
+    before = session.snapshot()
+    with pytest.raises(ValueError):
+        session.push_ops([{"op": "move", "id": "ghost", "x": 1, "y": 1}])
+    with pytest.raises(ValueError): # Removed earlier in the same batch
+        session.push_ops([{"op": "remove", "id": "a"}, {"op": "update", "id": "a", "attrs": {"hp": 1}}])
+    assert session.snapshot() == before
+
+
+def test_full_push_with_the_same_data_journals_only_the_diff(session):
+    seq = session.push_full({"background": "map.png", "nodes": {"a": {"x": 0}, "b": {"x": 1}}})
+    store = session.store
+
+    assert session.push_full({"background": "map.png", "nodes": {"a": {"x": 0}, "b": {"x": 1}}}) == seq
+    assert store.history()[-1]["op"] == "map"
+
+    new_seq = session.push_full({"background": "map.png", "nodes": {"a": {"x": 9}, "c": {"x": 2}}})
+    assert store.history()[-1]["op"] == "map_ops"
+    ops = session.since(seq)["ops"]
+    assert {(op["op"], op["id"]) for op in ops} == {("add", "a"), ("add", "c"), ("remove", "b")}
+    assert new_seq == seq + 3
+    assert session.snapshot()["nodes"] == {"a": {"x": 9}, "c": {"x": 2}}
+
+
+def test_since_falls_back_to_full_state_after_a_full_push(session):
+    session.push_full({"background": "a.png", "nodes": {"a": {}}})
+    seq = session.push_ops([{"op": "update", "id": "a", "attrs": {"hp": 3}}])
+    session.push_full({"background": "b.png"})
+    assert session.since(seq) is None
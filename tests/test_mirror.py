@@ -0,0 +1,170 @@
+# tests/test_mirror.py
+import hashlib
+import re
+from contextlib import contextmanager
+import pytest
+from utils.mirror import Mirror, FOLDER_MIME
+from utils.write_queue import WriteQueue
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeDrive:
+    """Files and bodies in memory, answering the calls Mirror makes."""
+
+    def __init__(self):
+        self.meta = {}
+        self.bodies = {}
+        self.offline = False
+
+    def add(self, file_id, name, mime, parent=None, body=None):
+        meta = {"id": file_id, "name": name, "mimeType": mime, "parents": [parent] if parent else []}
+        if body is not None:
+            self.bodies[file_id] = body
+            meta["md5Checksum"] = hashlib.md5(body).hexdigest()
+        self.meta[file_id] = meta
+        return meta
+
+    def files(self):
+        return self
+
+    def get(self, fileId, fields):
+        return FakeRequest(ConnectionError("offline") if self.offline else dict(self.meta[fileId]))
+
+    def list(self, q, fields, pageSize, pageToken):
+        parents = set(re.findall(r"'([^']+)' in parents", q))
+        files = [dict(m) for m in self.meta.values() if parents & set(m["parents"])]
+        return FakeRequest(ConnectionError("offline") if self.offline else {"files": files})
+
+
+class FakeMirror(Mirror):
+    during_download = None # Hook run while a body is being downloaded
+
+    def download(self, service, file_id, fh):
+        if self.during_download:
+            self.during_download(file_id)
+        fh.write(service.bodies[file_id])
+
+
+@pytest.fixture
+def drive():
+    drive = FakeDrive()
+    drive.add("root", "Campaign", FOLDER_MIME)
+    drive.add("npcs", "NPC", FOLDER_MIME, "root")
+    drive.add("e1", "metadata_Ala.json", "application/json", "npcs", b'{"name": "Ala"}')
+    drive.add("img", "ala.png", "image/png", "npcs", b"\x89PNG")
+    drive.add("doc", "notes.pdf", "application/pdf", "npcs", b"%PDF")
+    return drive
+
+
+def make_mirror(drive, directory, root_id="root"):
+    @contextmanager
+    def client_factory():
+        yield drive
+    return FakeMirror(str(directory), client_factory, root_id)
+
+
+def body(mirror, file_id):
+    path = mirror.blob_path(file_id)
+    return open(path, "rb").read() if path else None
+
+
+def test_sync_walks_the_subtree_and_downloads_json_and_images(drive, tmp_path):
+    mirror = make_mirror(drive, tmp_path)
+    assert mirror.sync() == 2
+    assert [f["id"] for f in mirror.list_folder("npcs")] == ["img", "e1", "doc"]
+    assert body(mirror, "e1") == b'{"name": "Ala"}'
+    assert body(mirror, "doc") is None # Only JSON and images are mirrored
+    assert mirror.sync() == 0 # Nothing changed
+
+
+def test_changes_update_the_index_and_bodies(drive, tmp_path):
+    mirror = make_mirror(drive, tmp_path)
+    mirror.sync()
+    changed = drive.add("e1", "metadata_Ala.json", "application/json", "npcs", b'{"name": "Ala 2"}')
+    mirror.apply_change({"fileId": "e1", "file": changed})
+    assert mirror.fetch_bodies() == 1
+    assert body(mirror, "e1") == b'{"name": "Ala 2"}'
+
+    mirror.apply_change({"fileId": "img", "removed": True})
+    assert not mirror.has("img") and body(mirror, "img") is None
+
+    mirror.apply_change({"fileId": "e1", "file": dict(changed, parents=["elsewhere"])})
+    assert not mirror.has("e1") # Moved out of the campaign
+
+
+def test_local_writes_win_until_drive_confirms(drive, tmp_path):
+    mirror = make_mirror(drive, tmp_path)
+    mirror.sync()
+    mirror.apply_local_write("e1", '{"name": "Local"}', name="metadata_Local.json")
+    mirror.sync() # Drive still has the old version
+    assert body(mirror, "e1") == b'{"name": "Local"}'
+    assert mirror.get_metadata("e1")["name"] == "metadata_Local.json"
+
+    confirmed = drive.add("e1", "metadata_Local.json", "application/json", "npcs", b'{"name": "Local"}')
+    mirror.apply_remote_write(confirmed, '{"name": "Local"}')
+    assert mirror.stats()["pending_writes"] == 0
+    assert mirror.fetch_bodies() == 0
+
+
+def test_a_local_write_during_a_download_is_not_overwritten(drive, tmp_path):
+    mirror = make_mirror(drive, tmp_path)
+    mirror.sync()
+    drive.add("e1", "metadata_Ala.json", "application/json", "npcs", b'{"name": "Remote"}')
+    mirror.apply_change({"fileId": "e1", "file": drive.meta["e1"]})
+    mirror.during_download = lambda file_id: mirror.apply_local_write(file_id, '{"name": "Local"}')
+    assert mirror.fetch_bodies() == 0
+    assert body(mirror, "e1") == b'{"name": "Local"}'
+
+
+def test_dropped_local_writes_fall_back_to_drive(drive, tmp_path):
+    mirror = make_mirror(drive, tmp_path)
+    mirror.sync()
+    mirror.apply_local_write("e1", '{"name": "Never uploaded"}', name="metadata_X.json")
+    mirror.drop_local_write("e1")
+    assert mirror.stats()["pending_writes"] == 0
+    assert body(mirror, "e1") == b'{"name": "Ala"}'
+    assert mirror.get_metadata("e1")["name"] == "metadata_Ala.json"
+
+
+def test_a_failed_queued_write_is_dropped_from_the_mirror(drive, tmp_path):
+    mirror = make_mirror(drive, tmp_path)
+    mirror.sync()
+    finished = []
+
+    def on_finished(key, state, error):
+        finished.append(state)
+        if state == "failed":
+            mirror.drop_local_write(key)
+
+    writer = WriteQueue(max_attempts=2, base_delay=0.01, on_finished=on_finished)
+    mirror.apply_local_write("e1", '{"name": "Rejected"}')
+    writer.submit("e1", lambda: False)
+    assert writer.flush(5)
+    assert finished == ["failed"]
+    assert mirror.stats()["pending_writes"] == 0
+    assert body(mirror, "e1") == b'{"name": "Ala"}'
+
+
+def test_pending_writes_do_not_survive_a_restart(drive, tmp_path):
+    mirror = make_mirror(drive, tmp_path)
+    mirror.sync()
+    mirror.apply_local_write("e1", '{"name": "Queued"}')
+    restarted = make_mirror(drive, tmp_path)
+    assert restarted.stats()["pending_writes"] == 0
+    assert restarted.fetch_bodies() == 1
+    assert body(restarted, "e1") == b'{"name": "Ala"}'
+
+
+def test_an_index_of_another_root_is_ignored(drive, tmp_path):
+    make_mirror(drive, tmp_path).sync()
+    other = make_mirror(drive, tmp_path, root_id="npcs")
+    assert not other.ready() and not other.has("e1")
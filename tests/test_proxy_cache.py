@@ -0,0 +1,179 @@
+# tests/test_proxy_cache.py
+import builtins
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from utils import proxy_cache
+from utils.proxy_cache import ProxyCache, FETCH_CHUNK_SIZE
+
+BODY = os.urandom(3 * FETCH_CHUNK_SIZE + 1234)
+
+
+class Origin:
+    """Local upstream: counts requests and holds bodies back until released."""
+
+    def __init__(self):
+        self.requests = []
+        self.release = threading.Event()
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                origin.requests.append(dict(self.headers))
+                if self.headers.get("If-None-Match") == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/mpeg")
+                self.send_header("Content-Length", str(len(BODY)))
+                self.send_header("ETag", '"v1"')
+                self.end_headers()
+                self.wfile.write(BODY[:FETCH_CHUNK_SIZE])
+                self.wfile.flush()
+                origin.release.wait(5)
+                self.wfile.write(BODY[FETCH_CHUNK_SIZE:])
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/track.mp3"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def origin():
+    origin = Origin()
+    yield origin
+    origin.release.set()
+    origin.server.shutdown()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ProxyCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024)
+
+
+def part_files(cache):
+    return [f for f in os.listdir(cache.blobs.directory) if f.endswith(".part")]
+
+
+def test_concurrent_requests_share_one_upstream_fetch(origin, cache):
+    results = []
+
+    def fetch():
+        path, _ = cache.fetch(origin.url, timeout=10)
+        with open(path, "rb") as f:
+            results.append(f.read())
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.3) # Every request is waiting on the download
+    origin.release.set()
+    for t in threads:
+        t.join(10)
+
+    assert results == [BODY] * 8
+    assert len(origin.requests) == 1
+    stats = cache.stats()
+    assert stats["upstream_fetches"] == 1 and stats["coalesced"] == 7 and stats["in_flight"] == 0
+
+
+def test_readers_stream_a_running_download(origin, cache):
+    path, _, download = cache.open(origin.url)
+    assert path is None
+    download.wait_headers(5)
+    assert download.length == len(BODY)
+    origin.release.set()
+    assert b"".join(download.tail(1000, FETCH_CHUNK_SIZE + 2000)) == BODY[1000:FETCH_CHUNK_SIZE + 2000]
+    assert download.wait(5)[0]
+
+
+def test_open_readers_do_not_block_publishing_on_windows(origin, cache, monkeypatch):
+    """Windows semantics: renaming or deleting a file with an open handle fails."""
+    handles = Counter()
+    real_open, real_replace, real_remove = builtins.open, os.replace, os.remove
+
+    class Tracked:
+        def __init__(self, path, mode="r", *args, **kwargs):
+            self._path = os.path.abspath(path)
+            self._file = real_open(path, mode, *args, **kwargs)
+            handles[self._path] += 1
+
+        def __getattr__(self, name):
+            return getattr(self._file, name)
+
+        def close(self):
+            if not self._file.closed:
+                handles[self._path] -= 1
+                self._file.close()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.close()
+
+    def check(*paths):
+        for path in paths:
+            if handles[os.path.abspath(path)] > 0:
+                raise PermissionError(f"{path} is open")
+
+    monkeypatch.setattr(proxy_cache, "open", Tracked, raising=False)
+    monkeypatch.setattr(os, "replace", lambda src, dst: (check(src, dst), real_replace(src, dst)))
+    monkeypatch.setattr(os, "remove", lambda path: (check(path), real_remove(path)))
+
+    _, _, download = cache.open(origin.url)
+    download.wait_headers(5)
+    reader = download.tail()
+    received = [next(reader)] # Suspended mid-stream, like a slow browser
+    origin.release.set()
+    path, _ = download.wait(10)
+    received.extend(reader)
+
+    assert b"".join(received) == BODY
+    assert path and open(path, "rb").read() == BODY
+    assert part_files(cache) == []
+    assert cache.blobs.get_meta(origin.url)[0] == path
+
+
+def test_a_failed_publish_still_releases_waiters(origin, cache, monkeypatch):
+    def refuse(src, dst):
+        raise PermissionError("locked")
+
+    monkeypatch.setattr(os, "replace", refuse)
+    origin.release.set()
+    with pytest.raises(PermissionError):
+        cache.fetch(origin.url, timeout=10)
+    assert part_files(cache) == []
+    assert cache.stats()["errors"] == 1
+
+
+def test_stale_entries_are_served_and_revalidated(origin, tmp_path):
+    origin.release.set()
+    cache = ProxyCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024, ttl=0)
+    path, meta = cache.fetch(origin.url, timeout=5)
+    assert meta["content_type"] == "audio/mpeg" and meta["upstream_etag"] == '"v1"'
+    stale_path, _, download = cache.open(origin.url)
+    assert stale_path == path and download is None
+    for _ in range(50):
+        if cache.stats()["revalidated"]:
+            break
+        time.sleep(0.05)
+    assert cache.stats()["revalidated"] == 1
+    assert origin.requests[-1].get("If-None-Match") == '"v1"'
+    assert len(origin.requests) == 2
+
+
+def test_bodies_over_the_limit_are_not_cached(origin, tmp_path):
+    origin.release.set()
+    cache = ProxyCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024, max_download_bytes=len(BODY) - 1)
+    with pytest.raises(ValueError):
+        cache.fetch(origin.url, timeout=5)
+    assert cache.blobs.get_meta(origin.url)[0] is None
+    assert part_files(cache) == []
@@ -0,0 +1,52 @@
+# tests/test_registry_db.py
+import threading
+import pytest
+from utils import registry_db
+from utils.file_ops import save_json
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh registry in the test's data/ directory (connections are per thread and per test)."""
+    monkeypatch.setattr(registry_db, "_local", threading.local())
+    monkeypatch.setattr(registry_db, "_initialized", False)
+    monkeypatch.setattr(registry_db, "_versions", {"entities": 0, "locations": 0, "folders": 0})
+    yield registry_db
+    conn = getattr(registry_db._local, "conn", None)
+    if conn is not None:
+        conn.close()
+
+
+def test_legacy_json_is_imported_once(db):
+    save_json(db.LEGACY_NPCS, [{"id": "n1", "name": "Ala", "type": "NPC"}])
+    save_json(db.LEGACY_FRACTIONS, {"Gildia": [{"id": "n2", "name": "Ola", "type": "NPC"}]})
+    save_json(db.LEGACY_LOCATIONS, [{"id": "l1", "name": "Karczma"}, {"id": "l1", "name": "Duplikat"}])
+    save_json(db.LEGACY_FOLDERS, {"f1": {"name": "NPC", "parent_id": None}, "f2": {"name": "Gildia", "parent_id": "f1"}})
+    save_json(db.LEGACY_TREE_SYNC, {"built_at": 1, "root": "root-id"})
+
+    assert [e["name"] for e in db.list_npcs()] == ["Ala", "Ola"]
+    assert {f: [e["id"] for e in members] for f, members in db.list_fractions().items()} == {"Gildia": ["n2"]}
+    assert db.list_locations() == [{"id": "l1", "name": "Karczma"}]
+    assert db.get_folders()["f2"] == {"id": "f2", "name": "Gildia", "parent_id": "f1"}
+    assert db.get_meta("tree_root") == "root-id"
+
+    # Later edits of the legacy files are not imported again
+    save_json(db.LEGACY_NPCS, [{"id": "n3", "name": "Ela", "type": "NPC"}])
+    db._initialized = False
+    assert [e["id"] for e in db.list_npcs()] == ["n1", "n2"]
+
+
+def test_versions_change_only_on_real_writes(db):
+    db.upsert_folder("f1", "NPC", None)
+    db.upsert_folder("f2", "Gildia", "f1")
+    db.upsert_folder("f3", "Miasto", None)
+    before = db.version("folders")
+
+    assert db.remove_folder_tree("ghost") is False
+    assert db.version("folders") == before
+    assert db.add_location("l1", "Karczma") and not db.add_location("l1", "Karczma")
+    assert db.version("locations") == "1"
+
+    assert db.remove_folder_tree("f1") is True
+    assert db.version("folders") != before
+    assert set(db.get_folders()) == {"f3"}
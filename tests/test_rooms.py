@@ -0,0 +1,72 @@
+# tests/test_rooms.py
+import os
+import pytest
+from utils.rooms import RoomRegistry, DEFAULT_ROOM, room_path
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def registry(tmp_path, clock):
+    registry = RoomRegistry(str(tmp_path / "rooms"), idle_ttl=3600, max_rooms=2, min_idle=60, clock=clock)
+    for room_id in ("a", "b", "c"):
+        assert registry.create(room_id)
+    return registry
+
+
+def loaded_ids(registry):
+    return [room.id for room in registry.loaded()]
+
+
+def test_room_ids_are_validated():
+    registry = RoomRegistry("rooms")
+    assert not registry.create("../etc") and not registry.create("") and not registry.create(DEFAULT_ROOM)
+    assert registry.get("missing") is None
+    assert registry.get() is registry.get(DEFAULT_ROOM)
+    assert room_path("/vis", DEFAULT_ROOM) == "/vis" and room_path("/vis", "a") == "/vis/r/a"
+
+
+def test_rooms_over_the_limit_go_least_recently_used_first(registry, clock):
+    registry.get("a")
+    clock.now += 10
+    registry.get("b")
+    clock.now += 10
+    registry.get("a") # "b" is now the oldest
+    clock.now += 10
+    registry.get("c") # Over max_rooms, but nobody has been idle for min_idle yet
+    assert loaded_ids(registry) == [DEFAULT_ROOM, "b", "a", "c"]
+
+    clock.now += 60
+    registry.get("c")
+    assert loaded_ids(registry) == [DEFAULT_ROOM, "a", "c"]
+    assert registry.stats() == {"loads": 3, "evictions": 1, "loaded": 3}
+
+
+def test_idle_rooms_are_flushed_and_reloaded_from_disk(registry, clock):
+    room = registry.get("a")
+    room.store.update(current_image="tavern.png")
+    clock.now += 3000
+    registry.touch(room) # A display is still connected
+    clock.now += 3000
+    registry.get("b")
+    assert "a" in loaded_ids(registry)
+
+    clock.now += 3600
+    registry.get("b")
+    assert "a" not in loaded_ids(registry)
+    assert os.path.exists(os.path.join(registry.directory, "a", "state.json"))
+
+    reloaded = registry.get("a")
+    assert reloaded is not room
+    assert reloaded.store.get()["current_image"] == "tavern.png"
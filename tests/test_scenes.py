@@ -0,0 +1,88 @@
+# tests/test_scenes.py
+import threading
+import time
+import pytest
+from flask import Flask
+from utils import scenes
+from utils.scenes import Prefetcher
+from utils.state_store import StateStore
+import routes.drive
+
+
+class FakeCache:
+    """Records fetched URLs; "slow" URLs never finish, "bad" ones fail."""
+
+    def __init__(self):
+        self.fetched = []
+        self.timeouts = []
+        self.done = threading.Event()
+
+    def fetch(self, url, timeout=None):
+        self.fetched.append(url)
+        self.timeouts.append(timeout)
+        try:
+            if "slow" in url:
+                raise TimeoutError(f"Download of {url} still running")
+            if "bad" in url:
+                raise ValueError("upstream said 500")
+            return url, {}
+        finally:
+            if url.endswith("last"):
+                self.done.set()
+
+
+def scene(name, image="", music=""):
+    return {"entity_id": None, "name": name, "image": image, "music": music, "notes": "GM only"}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(scenes, "prefetcher", Prefetcher(FakeCache()))
+    return StateStore(str(tmp_path / "state.json"), journal_dir=str(tmp_path / "journal"), flush_at_exit=False)
+
+
+def test_advancing_journals_a_scene_record(store):
+    playlist = [scene("Inn", "https://img/inn", "https://music/inn"), scene("Road", "https://img/road"), scene("Camp")]
+    scenes.set_playlist(store, playlist)
+    scenes.goto(store, 0)
+    scenes.goto(store, 1)
+    state = store.get()
+    assert [r["op"] for r in store.history()] == ["set", "scene", "scene"]
+    assert state["current_image"] == "https://img/road"
+    assert state["current_music"] == "https://music/inn" # Kept: the scene has no music
+    assert state["current_scene"] == "Road"
+    assert state["next_scene"] == {"name": "Camp", "image": "", "music": ""}
+    with pytest.raises(IndexError):
+        scenes.goto(store, 3)
+
+
+def test_rewind_defaults_to_before_the_last_scene_change(store, monkeypatch):
+    app = Flask(__name__)
+    app.register_blueprint(routes.drive.bp, url_prefix="/api")
+    monkeypatch.setattr(routes.drive, "room_store", lambda: store)
+    scenes.set_playlist(store, [scene("Inn", "https://img/inn"), scene("Road", "https://img/road")])
+    store.apply("set_vis", {"current_image": "https://img/map"})
+    scenes.goto(store, 1)
+    store.apply("set_music", {"current_music": "https://music/rain"})
+
+    response = app.test_client().post("/api/state/rewind", json={})
+    assert response.status_code == 200
+    assert store.get()["current_image"] == "https://img/map"
+    assert "current_music" not in store.get()
+
+    response = app.test_client().post("/api/state/rewind", json={"before": "node"})
+    assert response.status_code == 404
+
+
+def test_prefetch_uses_a_timeout_and_moves_on():
+    cache = FakeCache()
+    prefetcher = Prefetcher(cache)
+    prefetcher.warm([scene("A", "https://img/slow"), scene("B", "https://img/bad"), scene("C", "https://img/last")])
+    assert cache.done.wait(5)
+    assert cache.fetched == ["https://img/slow", "https://img/bad", "https://img/last"]
+    assert cache.timeouts == [scenes.PREFETCH_TIMEOUT] * 3
+    for _ in range(50):
+        if prefetcher.stats()["pending"] == 0:
+            break
+        time.sleep(0.02)
+    assert prefetcher.stats() == {"queued": 3, "warmed": 1, "errors": 2, "pending": 0}
@@ -0,0 +1,46 @@
+# tests/test_search.py
+import pytest
+from flask import Flask
+from utils import search_index
+import routes.search
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(routes.search.bp, url_prefix="/api")
+    return app.test_client()
+
+
+def metadata_file(file_id, name):
+    return {"id": file_id, "name": f"metadata_{name}.json", "parents": ["folder"], "modifiedTime": "1"}
+
+
+def test_terms_are_folded_and_match_as_prefixes(index):
+    search_index.index("a", "Karczmarz Łukasz", {"description": "Prowadzi karczmę w Łodzi", "tags": ["Żuraw"]})
+    search_index.index("b", "Kowal", {"notes": "Zna karczmarza", "elements": {"npc": ["Łukasz"]}})
+    assert search_index.tokenize("Łódź, ŻÓŁW straße") == ["lodz", "zolw", "strasse"]
+    assert [d for d, _ in search_index.search("LUKA")] == ["a", "b"] # Name hits rank first
+    assert [d for d, _ in search_index.search("karcz lodz")] == ["a"]
+    assert [d for d, _ in search_index.search("zuraw")] == ["a"]
+    assert [d for d, _ in search_index.search("karczmarz kowal")] == ["b"] # "karczmarza" in the notes
+    assert search_index.search("kowal lodz") == []
+
+    search_index.remove("a")
+    assert [d for d, _ in search_index.search("luk")] == ["b"]
+    assert "lodzi" not in search_index._vocab
+
+
+def test_first_search_builds_the_index(index, client):
+    index["files"] = [metadata_file("n1", "Ala"), metadata_file("l1", "Gospoda")]
+    index["contents"] = {
+        "n1": '{"type": "npc", "name": "Ala", "notes": "Pracuje w gospodzie"}',
+        "l1": '{"type": "location", "name": "Gospoda pod Łosiem"}',
+    }
+    response = client.get("/api/search?q=gosp")
+    assert response.status_code == 200
+    assert [r["id"] for r in response.json["results"]] == ["l1", "n1"]
+
+    response = client.get("/api/search?q=gosp&type=npc")
+    assert [r["name"] for r in response.json["results"]] == ["Ala"]
+    assert client.get("/api/search").status_code == 400
@@ -0,0 +1,71 @@
+# tests/test_write_queue.py
+import threading
+import time
+from utils.write_queue import WriteQueue
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def test_queued_writes_for_a_key_are_coalesced():
+    writer = WriteQueue()
+    started, release = threading.Event(), threading.Event()
+    written = []
+
+    def write(content):
+        if content == "v1":
+            started.set()
+            release.wait(5)
+        written.append(content)
+        return True
+
+    writer.submit("e1", write, "v1")
+    assert started.wait(5) # v1 is being written, v2..v4 wait behind it
+    for content in ("v2", "v3", "v4"):
+        status = writer.submit("e1", write, content)
+    assert status["coalesced"] == 2
+    writer.submit("e2", write, "other")
+    release.set()
+    assert writer.flush(5)
+
+    assert written == ["v1", "v4", "other"]
+    stats = writer.stats()
+    assert stats["submitted"] == 5 and stats["coalesced"] == 2 and stats["written"] == 3
+    assert writer.status("e1")["state"] == "done"
+
+
+def test_failures_back_off_exponentially_then_give_up():
+    writer = WriteQueue(max_attempts=3, base_delay=0.05, max_delay=60.0)
+    attempts = []
+
+    def write():
+        attempts.append(time.monotonic())
+        return False
+
+    writer.submit("e1", write)
+    wait_for(lambda: writer.status("e1")["state"] == "failed")
+
+    gaps = [b - a for a, b in zip(attempts, attempts[1:])]
+    assert gaps[0] >= 0.045 and gaps[1] >= 0.095 # base_delay, then doubled
+    assert writer.status("e1")["attempts"] == 3
+    assert writer.stats()["retries"] == 2 and writer.stats()["failed"] == 1
+
+
+def test_transient_errors_are_retried_until_they_pass():
+    offline = [True] * 6
+    writer = WriteQueue(max_attempts=2, base_delay=0.01, max_delay=0.02, is_transient=lambda e: isinstance(e, ConnectionError))
+
+    def write():
+        if offline and offline.pop():
+            raise ConnectionError("no route to host")
+        return True
+
+    writer.submit("e1", write)
+    wait_for(lambda: writer.status("e1")["state"] == "done")
+    assert writer.status("e1")["attempts"] == 7 # Past max_attempts: offline is not a failure
+    assert writer.stats()["failed"] == 0 and writer.stats()["retries"] == 6
@@ -0,0 +1,184 @@
+# utils/blob_cache.py
+import atexit
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from utils.file_ops import load_json, save_json
+
+SAVE_DELAY = 2.0 # Seconds to coalesce index writes after a burst of puts
+
+
+class BlobCache:
+    """On-disk, content-addressed cache of Drive file bodies.
+
+    Blobs are named after sha1(file_id + fingerprint), where the fingerprint is the
+    Drive md5Checksum (or version for files without one). Only the newest blob of a
+    file is kept and the whole cache is trimmed to `max_bytes`, least recently used first.
+
+    index.json is written `save_delay` seconds after a change (and at exit), not on every
+    put. After a crash the index may miss the newest blobs; they are fetched again.
+    """
+
+    def __init__(self, directory, max_bytes, save_delay=SAVE_DELAY):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.save_delay = save_delay
+        self.index_file = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        self._entries = None # file_id -> {"key", "fingerprint", "size"}, in LRU order
+        self._total = 0
+        self._dirty = False
+        self._save_timer = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "index_writes": 0}
+        atexit.register(self.flush)
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        data = load_json(self.index_file)
+        for file_id, entry in (data.items() if isinstance(data, dict) else []):
+            if os.path.exists(self._blob_path(entry["key"])):
+                self._entries[file_id] = entry
+                self._total += entry["size"]
+
+    def _save(self):
+        """Marks the index changed; it is written by flush(). Called under the lock."""
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """Writes pending index changes to disk."""
+        with self._lock:
+            self._save_timer = None
+            if not self._dirty:
+                return
+            save_json(self.index_file, self._entries, compact=True)
+            self._dirty = False
+            self._stats["index_writes"] += 1
+
+    def _blob_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    @staticmethod
+    def make_key(file_id, fingerprint):
+        return hashlib.sha1(f"{file_id}:{fingerprint}".encode("utf-8")).hexdigest()
+
+    def get(self, file_id, fingerprint=None):
+        """Returns the blob path for file_id, or None. Without a fingerprint any cached version matches."""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(file_id)
+            if entry is None or (fingerprint is not None and entry["fingerprint"] != fingerprint):
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(file_id)
+            self._stats["hits"] += 1
+            return self._blob_path(entry["key"])
+
+    def put(self, file_id, fingerprint, write_fn, meta=None):
+        """Stores a blob written by write_fn(fh) and returns its path. The file appears atomically.
+
+        `meta` is an optional JSON-serializable dict kept with the entry (see get_meta).
+        """
+        fd, tmp_path = self.mkstemp()
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                write_fn(fh)
+        except BaseException:
+            self._remove_file(tmp_path)
+            raise
+        return self.adopt(file_id, fingerprint, tmp_path, meta)
+
+    def mkstemp(self):
+        """Returns (fd, path) of a temp file in the cache directory, for adopt()."""
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.mkstemp(dir=self.directory, suffix=".part")
+
+    def adopt(self, file_id, fingerprint, tmp_path, meta=None):
+        """Moves a finished file (from mkstemp) into the cache and returns its blob path."""
+        key = self.make_key(file_id, fingerprint)
+        path = self._blob_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove_file(tmp_path)
+            raise
+
+        with self._lock:
+            self._load()
+            old = self._entries.pop(file_id, None)
+            if old:
+                self._total -= old["size"]
+                if old["key"] != key:
+                    self._remove_blob(old["key"])
+            size = os.path.getsize(path)
+            self._entries[file_id] = {"key": key, "fingerprint": fingerprint, "size": size}
+            if meta is not None:
+                self._entries[file_id]["meta"] = meta
+            self._total += size
+            self._evict()
+            self._save()
+        return path
+
+    def put_bytes(self, file_id, fingerprint, data, meta=None):
+        return self.put(file_id, fingerprint, lambda fh: fh.write(data), meta)
+
+    def get_meta(self, file_id):
+        """Returns (path, meta) of the cached entry without counting a hit, or (None, None)."""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(file_id)
+            if entry is None:
+                return None, None
+            return self._blob_path(entry["key"]), dict(entry.get("meta") or {})
+
+    def update_meta(self, file_id, **fields):
+        with self._lock:
+            self._load()
+            entry = self._entries.get(file_id)
+            if entry is not None:
+                entry.setdefault("meta", {}).update(fields)
+                self._save()
+
+    def discard(self, file_id):
+        with self._lock:
+            self._load()
+            old = self._entries.pop(file_id, None)
+            if old:
+                self._total -= old["size"]
+                self._remove_blob(old["key"])
+                self._save()
+
+    def _evict(self):
+        # Never evict the entry that was just added
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            file_id, entry = self._entries.popitem(last=False)
+            self._total -= entry["size"]
+            self._remove_blob(entry["key"])
+            self._stats["evictions"] += 1
+
+    def _remove_blob(self, key):
+        self._remove_file(self._blob_path(key))
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass # Gone already, or still open elsewhere (Windows)
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            stats = dict(self._stats)
+            stats["files"] = len(self._entries)
+            stats["bytes"] = self._total
+            stats["max_bytes"] = self.max_bytes
+        return stats
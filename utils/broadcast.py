@@ -0,0 +1,132 @@
+# utils/broadcast.py
+import threading
+import time
+from collections import deque
+from utils import codec
+
+
+class Subscriber:
+    """One connected client: its topics and a bounded queue of encoded messages."""
+
+    def __init__(self, topics):
+        self.topics = set(topics)
+        self.queue = deque() # (topic, encoded message)
+        self.stale = set(topics) # Topics owed a snapshot; new clients start with one each
+        self.closed = False
+        self.cond = threading.Condition()
+
+
+class BroadcastHub:
+    """Fans published messages out to subscribers of a topic ("vis", "map").
+
+    publish() encodes a message once and queues it for every subscriber. A slow
+    client whose queue reaches `max_queue` loses its queue and is marked stale: it
+    gets one fresh snapshot of the affected topics (snapshot_fn(topic)) instead of
+    the backlog, and further messages for those topics are skipped until then.
+    Messages carry a version/seq, so clients ignore ones already covered by a snapshot.
+    """
+
+    RATE_WINDOW = 10 # Seconds averaged by the message rate counters
+
+    def __init__(self, snapshot_fn, max_queue=64, clock=time.monotonic):
+        self.snapshot_fn = snapshot_fn
+        self.max_queue = max_queue
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._published = deque() # [second, count] buckets
+        self._sent = deque()
+        self._stats = {"connections": 0, "published": 0, "sent": 0, "dropped": 0, "snapshots": 0}
+
+    def connect(self, topics):
+        subscriber = Subscriber(topics)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            self._stats["connections"] += 1
+        return subscriber
+
+    def disconnect(self, subscriber):
+        with subscriber.cond:
+            subscriber.closed = True
+            subscriber.cond.notify_all()
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _count(self, buckets, n=1):
+        second = int(self.clock())
+        if buckets and buckets[-1][0] == second:
+            buckets[-1][1] += n
+        else:
+            buckets.append([second, n])
+        while buckets and buckets[0][0] <= second - self.RATE_WINDOW:
+            buckets.popleft()
+
+    def publish(self, topic, message):
+        """Queues a message (dict) for every subscriber of topic."""
+        encoded = codec.dumps_str(message)
+        with self._lock:
+            subscribers = [s for s in self._subscribers if topic in s.topics]
+            self._stats["published"] += 1
+            self._count(self._published)
+        dropped = 0
+        for subscriber in subscribers:
+            with subscriber.cond:
+                if topic in subscriber.stale:
+                    continue # The pending snapshot will include it
+                if len(subscriber.queue) >= self.max_queue:
+                    dropped += len(subscriber.queue)
+                    subscriber.stale.update(t for t, _ in subscriber.queue)
+                    subscriber.stale.add(topic)
+                    subscriber.queue.clear()
+                else:
+                    subscriber.queue.append((topic, encoded))
+                subscriber.cond.notify_all()
+        if dropped:
+            with self._lock:
+                self._stats["dropped"] += dropped
+
+    def resync(self, topic):
+        """Replaces queued messages of topic with a snapshot for every subscriber (e.g. after a full map push)."""
+        with self._lock:
+            subscribers = [s for s in self._subscribers if topic in s.topics]
+        for subscriber in subscribers:
+            with subscriber.cond:
+                subscriber.queue = deque(m for m in subscriber.queue if m[0] != topic)
+                subscriber.stale.add(topic)
+                subscriber.cond.notify_all()
+
+    def next_message(self, subscriber, timeout=None):
+        """Blocks for the subscriber's next encoded message. Returns None on timeout or disconnect."""
+        with subscriber.cond:
+            subscriber.cond.wait_for(lambda: subscriber.stale or subscriber.queue or subscriber.closed, timeout)
+            if subscriber.closed:
+                return None
+            if subscriber.stale:
+                topic = subscriber.stale.pop()
+            elif subscriber.queue:
+                topic, encoded = subscriber.queue.popleft()
+                self._mark_sent()
+                return encoded
+            else:
+                return None
+        encoded = codec.dumps_str(self.snapshot_fn(topic))
+        with self._lock:
+            self._stats["snapshots"] += 1
+        self._mark_sent()
+        return encoded
+
+    def _mark_sent(self):
+        with self._lock:
+            self._stats["sent"] += 1
+            self._count(self._sent)
+
+    def stats(self):
+        with self._lock:
+            self._count(self._published, 0)
+            self._count(self._sent, 0)
+            stats = dict(self._stats)
+            stats["connected"] = len(self._subscribers)
+            stats["published_per_s"] = round(sum(c for _, c in self._published) / self.RATE_WINDOW, 2)
+            stats["sent_per_s"] = round(sum(c for _, c in self._sent) / self.RATE_WINDOW, 2)
+            stats["queued"] = sum(len(s.queue) for s in self._subscribers)
+        return stats
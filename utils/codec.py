@@ -0,0 +1,48 @@
+# utils/codec.py
+import json
+from flask.json.provider import DefaultJSONProvider
+
+# JSON codec used for API responses and local files. orjson is used when installed
+# (several times faster on state/tree payloads, see bench_codec.py), otherwise the
+# stdlib json module. Both produce UTF-8 output with non-ASCII characters kept as is.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CODEC = "orjson" if orjson else "json"
+
+
+def dumps(obj, pretty=False, default=None) -> bytes:
+    """Serializes obj to UTF-8 bytes. pretty=True indents by 2 spaces (for files people read)."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, default=default, option=option)
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False, default=default).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=default).encode("utf-8")
+
+
+def dumps_str(obj, pretty=False, default=None) -> str:
+    return dumps(obj, pretty=pretty, default=default).decode("utf-8")
+
+
+def loads(data):
+    """Parses str or bytes. Raises ValueError on invalid JSON."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider (jsonify, request.json) backed by this codec."""
+
+    def dumps(self, obj, **kwargs):
+        return dumps_str(obj, default=kwargs.get("default", self.default))
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, default=self.default), mimetype=self.mimetype)
@@ -1,14 +1,23 @@
 import os
-import json
 import io
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import httplib2
+import google_auth_httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
-from google.auth.exceptions import RefreshError
+from google.auth.exceptions import RefreshError, TransportError
 from dotenv import load_dotenv
+from utils.drive_cache import TTLCache, ChangeFeed
+from utils.blob_cache import BlobCache
+from utils.mirror import Mirror
 
 load_dotenv()
 
@@ -17,8 +26,30 @@ CREDENTIALS_FILE = "credentials.json"
 TOKEN_FILE = "token.json"
 ROOT_FOLDER_ID = os.getenv('DRIVE_ROOT_FOLDER_ID')
 
-def get_drive_service():
-    """Gets the Drive service, handling auth via user credentials."""
+# ===================== CLIENT POOL =====================
+# Building a Drive client means reading token.json, maybe refreshing the token and
+# parsing the discovery document. We do that once and hand out pooled clients that
+# share one set of credentials and keep their HTTP connections open.
+
+POOL_MAX_IDLE = int(os.getenv("DRIVE_POOL_SIZE", "8"))
+HTTP_TIMEOUT = 60
+TOKEN_REFRESH_MARGIN = 300 # Refresh this many seconds before the token expires
+
+_pool_lock = threading.Lock()
+_auth_lock = threading.Lock() # Serializes token refreshes and re-authorization
+_idle_clients = []
+_credentials = None
+_credentials_generation = 0
+POOL_STATS = {
+    "built": 0,
+    "reused": 0,
+    "in_use": 0,
+    "token_refreshes": 0,
+    "auth_loads": 0,
+}
+
+def _authorize():
+    """Loads credentials from token.json, refreshing or re-authenticating if needed."""
     creds = None
     if os.path.exists(TOKEN_FILE):
         creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
@@ -43,55 +74,271 @@ def get_drive_service():
         with open(TOKEN_FILE, "w") as token:
             token.write(creds.to_json())
             
-    return build("drive", "v3", credentials=creds)
+    return creds
+
+def _expires_soon(creds):
+    if not creds.expiry:
+        return not creds.valid
+    now = datetime.now(timezone.utc).replace(tzinfo=None) # google-auth uses naive UTC
+    return creds.expiry - now < timedelta(seconds=TOKEN_REFRESH_MARGIN)
+
+def _usable(creds):
+    return creds is not None and not (_expires_soon(creds) and creds.refresh_token)
+
+def _get_credentials():
+    """Returns (credentials, generation), refreshing them proactively.
+
+    Refreshing and authorizing are network calls, so they run under _auth_lock only:
+    pool checkouts and returns (_pool_lock) never wait for the token endpoint.
+    """
+    global _credentials, _credentials_generation
+    with _pool_lock:
+        creds, generation = _credentials, _credentials_generation
+    if _usable(creds):
+        return creds, generation
+    with _auth_lock:
+        with _pool_lock: # Another thread may have refreshed while we waited
+            creds, generation = _credentials, _credentials_generation
+        if _usable(creds):
+            return creds, generation
+        if creds is not None:
+            try:
+                creds.refresh(Request())
+                with _pool_lock:
+                    POOL_STATS["token_refreshes"] += 1
+                with open(TOKEN_FILE, "w") as token:
+                    token.write(creds.to_json())
+                return creds, generation
+            except RefreshError:
+                print("Token refresh failed. Re-authenticating...")
+        creds = _authorize()
+        with _pool_lock:
+            _credentials = creds
+            _credentials_generation += 1
+            POOL_STATS["auth_loads"] += 1
+            return creds, _credentials_generation
+
+def _build_client(creds):
+    http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+    # static_discovery uses the discovery document bundled with the client library
+    return build("drive", "v3", http=http, cache_discovery=False, static_discovery=True)
+
+@contextmanager
+def drive_client():
+    """Checks a Drive client out of the pool for the duration of the block."""
+    creds, generation = _get_credentials()
+    with _pool_lock:
+        client = _idle_clients.pop() if _idle_clients else None
+        if client is not None and client[0] != generation:
+            client = None # Built for credentials that were replaced
+        if client is None:
+            POOL_STATS["built"] += 1
+        else:
+            POOL_STATS["reused"] += 1
+        POOL_STATS["in_use"] += 1
+
+    try:
+        if client is None:
+            client = (generation, _build_client(creds))
+        yield client[1]
+    finally:
+        with _pool_lock:
+            POOL_STATS["in_use"] -= 1
+            if client is not None and client[0] == _credentials_generation and len(_idle_clients) < POOL_MAX_IDLE:
+                _idle_clients.append(client)
+
+def get_pool_stats():
+    """Returns a snapshot of the client pool counters."""
+    with _pool_lock:
+        stats = dict(POOL_STATS)
+        stats["idle"] = len(_idle_clients)
+        stats["max_idle"] = POOL_MAX_IDLE
+        expiry = _credentials.expiry if _credentials else None
+    stats["token_expiry"] = expiry.isoformat() + "Z" if expiry else None
+    return stats
+
+# ===================== METADATA CACHE =====================
+# Listings and metadata are cached per folder/file id. Entries expire after the TTL
+# and are dropped early when the changes feed or one of our own writes touches them.
+
+metadata_cache = TTLCache(
+    max_entries=int(os.getenv("DRIVE_CACHE_SIZE", "2048")),
+    ttl=int(os.getenv("DRIVE_CACHE_TTL", "300")),
+)
+changes = ChangeFeed(
+    drive_client,
+    interval=int(os.getenv("DRIVE_CHANGES_INTERVAL", "15")),
+    token_file="data/drive_changes.json",
+)
+
+def _invalidate_change(change):
+    file = change.get("file") or {}
+    metadata_cache.invalidate(change.get("fileId"), *file.get("parents", []))
+
+changes.add_listener(_invalidate_change)
+
+def get_cache_stats():
+    stats = {"cache": metadata_cache.stats(), "changes": changes.stats(), "blobs": blob_cache.stats()}
+    if MIRROR_MODE:
+        stats["mirror"] = mirror.stats()
+    return stats
+
+# ===================== OFFLINE MIRROR =====================
+# With MIRROR_MODE=1 the campaign subtree is synced into data/mirror in the background
+# and reads are answered from it. Without it the mirror is only a fallback.
+
+MIRROR_MODE = os.getenv("MIRROR_MODE", "0") == "1"
+mirror = Mirror(
+    os.getenv("MIRROR_DIR", "data/mirror"),
+    drive_client,
+    ROOT_FOLDER_ID,
+    interval=int(os.getenv("MIRROR_INTERVAL", "60")),
+)
+if MIRROR_MODE:
+    changes.add_listener(mirror.apply_change)
+
+def is_offline_error(e):
+    """True if Drive could not be reached at all (as opposed to Drive rejecting the call)."""
+    return not isinstance(e, HttpError) and isinstance(
+        e, (httplib2.ServerNotFoundError, TransportError, socket.timeout, OSError)
+    )
+
+def _mirror_reads():
+    """True when reads should be served from the offline mirror."""
+    if not MIRROR_MODE or not ROOT_FOLDER_ID:
+        return False
+    mirror.start(lambda: changes.poll(raise_errors=True))
+    return mirror.ready()
 
 def list_folder_content(folder_id=None):
     """Lists files and folders in a specific folder."""
-    service = get_drive_service()
-    
     if not folder_id or folder_id == "root":
         folder_id = ROOT_FOLDER_ID
         
+    if _mirror_reads() and mirror.has(folder_id):
+        return mirror.list_folder(folder_id)
+        
+    changes.maybe_poll()
+    hit, files = metadata_cache.get(("list", folder_id))
+    if hit:
+        return list(files)
+        
     try:
-        results = service.files().list(
-            q=f"'{folder_id}' in parents and trashed=false",
-            fields="files(id, name, mimeType, webViewLink, webContentLink)",
-            orderBy="folder,name"
-        ).execute()
-        return results.get("files", [])
+        with drive_client() as service:
+            results = service.files().list(
+                q=f"'{folder_id}' in parents and trashed=false",
+                fields="files(id, name, mimeType, webViewLink, webContentLink)",
+                orderBy="folder,name"
+            ).execute()
+        files = results.get("files", [])
+        # Tag with the children too, so a rename/removal of any of them drops the listing
+        metadata_cache.set(("list", folder_id), files, tags=[folder_id] + [f["id"] for f in files])
+        return list(files)
     except HttpError as e:
         print(f"An error occurred: {e}")
         return []
+    except Exception as e:
+        if is_offline_error(e) and mirror.has(folder_id):
+            return mirror.list_folder(folder_id)
+        raise
 
 def get_file_metadata(file_id, fields="id, name, parents, mimeType"):
     """Gets metadata for a file or folder."""
-    service = get_drive_service()
+    if _mirror_reads() and mirror.has(file_id):
+        return mirror.get_metadata(file_id)
+        
+    changes.maybe_poll()
+    hit, file = metadata_cache.get(("meta", file_id, fields))
+    if hit:
+        return dict(file)
+        
     try:
-        file = service.files().get(fileId=file_id, fields=fields).execute()
-        return file
+        with drive_client() as service:
+            file = service.files().get(fileId=file_id, fields=fields).execute()
+        metadata_cache.set(("meta", file_id, fields), file, tags=[file_id])
+        return dict(file)
     except HttpError as e:
         print(f"Error getting metadata for {file_id}: {e}")
+        if e.resp.status == 404:
+            blob_cache.discard(file_id) # Deleted: get_file_path must not fall back to the old body
         return None
+    except Exception as e:
+        if is_offline_error(e) and mirror.has(file_id):
+            return mirror.get_metadata(file_id)
+        raise
+
+# ===================== CONTENT CACHE =====================
+# File bodies are kept on disk keyed by file id + md5Checksum/version. A cached body
+# is revalidated with a (cached) metadata call instead of downloading it again.
+
+blob_cache = BlobCache(
+    os.getenv("BLOB_CACHE_DIR", "data/blob_cache"),
+    max_bytes=int(os.getenv("BLOB_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+)
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+CONTENT_FIELDS = "id, md5Checksum, version" # Metadata needed to revalidate a cached body
+
+def _discard_deleted(change):
+    """Changes feed listener: bodies of deleted or trashed files are dropped, not kept as a fallback."""
+    if change.get("removed") or (change.get("file") or {}).get("trashed"):
+        blob_cache.discard(change.get("fileId"))
+
+changes.add_listener(_discard_deleted)
+
+def _fingerprint(meta):
+    return meta.get("md5Checksum") or meta.get("version")
+
+def get_file_path(file_id):
+    """Returns a local path with the current content of a Drive file, downloading it only if changed."""
+    if _mirror_reads():
+        path = mirror.blob_path(file_id)
+        if path:
+            return path
+            
+    try:
+        meta = get_file_metadata(file_id, fields=CONTENT_FIELDS)
+    except Exception as e:
+        if not is_offline_error(e):
+            raise
+        meta = None
+    if not meta:
+        # Drive unreachable or failing: fall back to whatever we have (deleted files were discarded)
+        return mirror.blob_path(file_id) or blob_cache.get(file_id)
+        
+    fingerprint = _fingerprint(meta)
+    path = blob_cache.get(file_id, fingerprint)
+    if path:
+        return path
+        
+    def download(fh):
+        with drive_client() as service:
+            request = service.files().get_media(fileId=file_id)
+            # Stream straight to disk instead of buffering the body in memory
+            downloader = MediaIoBaseDownload(fh, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+            done = False
+            while done is False:
+                status, done = downloader.next_chunk()
+                
+    try:
+        return blob_cache.put(file_id, fingerprint, download)
+    except Exception as e:
+        print(f"Error downloading file {file_id}: {e}")
+        return mirror.blob_path(file_id) or blob_cache.get(file_id)
 
 def get_file_content(file_id):
     """Downloads file content (for JSON/Text)."""
-    service = get_drive_service()
+    path = get_file_path(file_id)
+    if not path:
+        return None
     try:
-        request = service.files().get_media(fileId=file_id)
-        file = io.BytesIO()
-        downloader = MediaIoBaseDownload(file, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        return file.getvalue().decode('utf-8')
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
     except Exception as e:
         print(f"Error reading file {file_id}: {e}")
         return None
 
 def create_folder(name, parent_id=None):
     """Creates a folder."""
-    service = get_drive_service()
-    
     if not parent_id or parent_id == "root":
         parent_id = ROOT_FOLDER_ID
         
@@ -101,27 +348,16 @@ def create_folder(name, parent_id=None):
         'parents': [parent_id]
     }
     try:
-        file = service.files().create(body=file_metadata, fields='id').execute()
+        with drive_client() as service:
+            file = service.files().create(body=file_metadata, fields='id').execute()
+        metadata_cache.invalidate(parent_id)
         return file.get('id')
     except HttpError as e:
         print(f"Error creating folder: {e}")
         return None
 
-def update_file_content(file_id, content):
-    """Updates a file's content (text/json)."""
-    service = get_drive_service()
-    try:
-        media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype='application/json', resumable=True)
-        service.files().update(fileId=file_id, media_body=media).execute()
-        return True
-    except HttpError as e:
-        print(f"Error updating file: {e}")
-        return False
-
 def create_file(name, parent_id, content, mime_type='application/json'):
     """Creates a new file."""
-    service = get_drive_service()
-    
     if not parent_id or parent_id == "root":
         parent_id = ROOT_FOLDER_ID
         
@@ -131,85 +367,209 @@ def create_file(name, parent_id, content, mime_type='application/json'):
     }
     try:
         media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype=mime_type, resumable=True)
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        with drive_client() as service:
+            file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        metadata_cache.invalidate(parent_id)
         return file.get('id')
     except HttpError as e:
         print(f"Error creating file: {e}")
         return None
 
-def make_file_public(file_id):
-    """Makes a file public (reader permission for anyone)."""
-    service = get_drive_service()
-    try:
-        permission = {
-            'type': 'anyone',
-            'role': 'reader',
-        }
-        service.permissions().create(
-            fileId=file_id,
-            body=permission,
-            fields='id',
-        ).execute()
-        return True
-    except HttpError as e:
-        print(f"Error making file public: {e}")
-        return False
+def update_file(file_id, content, name=None):
+    """Updates content and (optionally) the name of a file in a single request.
 
-def upload_file(file_storage, parent_id="root"):
-    """Uploads a file (FileStorage) to Drive."""
-    service = get_drive_service()
-    
-    if not parent_id or parent_id == "root":
-        parent_id = ROOT_FOLDER_ID
-        
-    file_metadata = {
-        'name': file_storage.filename,
-        'parents': [parent_id]
-    }
+    Returns the updated file (id, name, parents, modifiedTime) or None on failure.
+    """
     try:
-        # Create a MediaIoBaseUpload from the file stream
-        media = MediaIoBaseUpload(file_storage.stream, mimetype=file_storage.mimetype, resumable=True)
-        file = service.files().create(body=file_metadata, media_body=media, fields='id, webContentLink, mimeType').execute()
-        
-        # Check if it's an image and make it public
-        if file.get('mimeType', '').startswith('image/'):
-            make_file_public(file.get('id'))
-            
+        body = {'name': name} if name else None
+        # Entity JSON is small, a simple multipart upload saves the resumable session round trip
+        media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype='application/json', resumable=False)
+        with drive_client() as service:
+            file = service.files().update(
+                fileId=file_id, body=body, media_body=media,
+                fields='id, name, parents, modifiedTime, md5Checksum, version'
+            ).execute()
+        metadata_cache.invalidate(file_id)
+        # We already know the new body, so the next read is a cache hit
+        blob_cache.put_bytes(file_id, _fingerprint(file), content.encode('utf-8'))
+        mirror.apply_remote_write(file, content)
         return file
     except HttpError as e:
-        print(f"Error uploading file: {e}")
+        print(f"Error updating file {file_id}: {e}")
         return None
 
-def rename_file(file_id, new_name):
-    """Renames a file in Google Drive."""
-    service = get_drive_service()
-    try:
-        file_metadata = {'name': new_name}
-        service.files().update(fileId=file_id, body=file_metadata, fields='id, name').execute()
-        return True
-    except HttpError as e:
-        print(f"Error renaming file {file_id} to {new_name}: {e}")
-        return False
+def upload_files(file_storages, parent_id="root"):
+    """Uploads files (FileStorage) to Drive. Images are then made public with one batch call.
+
+    Returns one {"result": <file or None>, "error": <message or None>} per file, in order.
+    """
+    if not parent_id or parent_id == "root":
+        parent_id = ROOT_FOLDER_ID
+
+    results = []
+    for file_storage in file_storages:
+        file_metadata = {
+            'name': file_storage.filename,
+            'parents': [parent_id]
+        }
+        try:
+            # Create a MediaIoBaseUpload from the file stream
+            media = MediaIoBaseUpload(file_storage.stream, mimetype=file_storage.mimetype, resumable=True)
+            with drive_client() as service:
+                file = service.files().create(body=file_metadata, media_body=media, fields='id, webContentLink, mimeType').execute()
+            results.append({"result": file, "error": None})
+        except HttpError as e:
+            print(f"Error uploading file {file_storage.filename}: {e}")
+            results.append({"result": None, "error": str(e)})
+    metadata_cache.invalidate(parent_id)
+
+    # Images are shown through their public links
+    images = [r["result"]["id"] for r in results if r["result"] and r["result"].get('mimeType', '').startswith('image/')]
+    shared = batch_make_public(images) if images else {}
+    for r in results:
+        error = r["result"] and shared.get(r["result"]["id"], {}).get("error")
+        if error:
+            r["error"] = f"Uploaded, but not made public: {error}"
+    return results
 
-def get_all_folders():
-    """Fetches ALL folders in the hierarchy to build a local tree."""
-    service = get_drive_service()
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+FOLDER_QUERY_CHUNK = 40 # Parents per "in parents" query, keeps the q string well under the limit
+
+def _list_folders(service, query):
     folders = []
     page_token = None
-    
+    while True:
+        response = service.files().list(
+            q=f"mimeType='{FOLDER_MIME}' and trashed=false and ({query})" if query else f"mimeType='{FOLDER_MIME}' and trashed=false",
+            fields="nextPageToken, files(id, name, parents)",
+            pageSize=1000,
+            pageToken=page_token
+        ).execute()
+        folders.extend(response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return folders
+
+def get_all_folders(root_id=None):
+    """Fetches the folder hierarchy under root_id (ROOT_FOLDER_ID by default) to build a local tree.
+
+    Walks the tree level by level, asking for the children of many parents per query.
+    Without a configured root it falls back to every folder in the Drive.
+    """
+    root_id = root_id or ROOT_FOLDER_ID
     try:
-        while True:
-            response = service.files().list(
-                q="mimeType='application/vnd.google-apps.folder' and trashed=false",
-                fields="nextPageToken, files(id, name, parents)",
-                pageToken=page_token
-            ).execute()
-            
-            folders.extend(response.get('files', []))
-            page_token = response.get('nextPageToken')
-            if not page_token:
-                break
+        with drive_client() as service:
+            if not root_id:
+                return _list_folders(service, None)
+                
+            root = service.files().get(fileId=root_id, fields="id, name").execute()
+            folders = [{"id": root["id"], "name": root["name"], "parents": []}]
+            frontier = [root_id]
+            while frontier:
+                children = []
+                for start in range(0, len(frontier), FOLDER_QUERY_CHUNK):
+                    chunk = frontier[start:start + FOLDER_QUERY_CHUNK]
+                    children.extend(_list_folders(service, " or ".join(f"'{fid}' in parents" for fid in chunk)))
+                folders.extend(children)
+                frontier = [f["id"] for f in children]
         return folders
     except HttpError as e:
         print(f"Error fetching all folders: {e}")
-        return []
\ No newline at end of file
+        return []
+
+# ===================== BATCH REQUESTS =====================
+# Drive accepts up to 100 calls in one multipart batch request. Media uploads and
+# downloads are not allowed in batches, so file contents are fetched in parallel instead.
+
+BATCH_LIMIT = 100
+CONTENT_WORKERS = 8
+
+def execute_batch(build_requests):
+    """Executes calls built by `build_requests(service)` -> {key: HttpRequest} as batches.
+
+    Returns {key: {"result": <response or None>, "error": <message or None>}}.
+    """
+    results = {}
+    keys = []
+    
+    def callback(request_id, response, exception):
+        results[request_id] = {
+            "result": response,
+            "error": str(exception) if exception else None
+        }
+        
+    try:
+        with drive_client() as service:
+            items = list(build_requests(service).items())
+            keys = [key for key, _ in items]
+            for start in range(0, len(items), BATCH_LIMIT):
+                batch = service.new_batch_http_request(callback=callback)
+                for key, request in items[start:start + BATCH_LIMIT]:
+                    batch.add(request, request_id=key)
+                batch.execute()
+    except Exception as e:
+        print(f"Batch request failed: {e}")
+        
+    for key in keys:
+        results.setdefault(key, {"result": None, "error": "Batch request failed"})
+    return results
+
+def batch_get_metadata(file_ids, fields="id, name, parents, mimeType"):
+    """Gets metadata for many files, serving cached entries without a request."""
+    results = {}
+    missing = []
+    for file_id in dict.fromkeys(file_ids):
+        hit, file = metadata_cache.get(("meta", file_id, fields))
+        if hit:
+            results[file_id] = {"result": dict(file), "error": None}
+        else:
+            missing.append(file_id)
+            
+    if missing:
+        fetched = execute_batch(lambda service: {
+            file_id: service.files().get(fileId=file_id, fields=fields) for file_id in missing
+        })
+        for file_id, item in fetched.items():
+            if item["result"] is not None:
+                metadata_cache.set(("meta", file_id, fields), item["result"], tags=[file_id])
+        results.update(fetched)
+    return results
+
+def batch_update_metadata(updates):
+    """Applies metadata-only updates in batches. `updates` maps file_id -> request body.
+
+    Returns {file_id: {"result", "error"}} like execute_batch.
+    """
+    results = execute_batch(lambda service: {
+        file_id: service.files().update(fileId=file_id, body=body, fields='id, name, parents, modifiedTime')
+        for file_id, body in updates.items()
+    })
+    metadata_cache.invalidate(*updates.keys())
+    return results
+
+def batch_rename(renames):
+    """Renames many files. `renames` maps file_id -> new name."""
+    return batch_update_metadata({file_id: {'name': name} for file_id, name in renames.items()})
+
+def batch_make_public(file_ids):
+    """Grants 'anyone with the link' read access to many files."""
+    permission = {'type': 'anyone', 'role': 'reader'}
+    return execute_batch(lambda service: {
+        file_id: service.permissions().create(fileId=file_id, body=permission, fields='id')
+        for file_id in dict.fromkeys(file_ids)
+    })
+
+def get_files_content(file_ids):
+    """Downloads many text files in parallel. Returns {file_id: content or None}.
+
+    The cached bodies are revalidated with one batch metadata request up front, so only
+    files that changed cost a request of their own.
+    """
+    file_ids = list(dict.fromkeys(file_ids))
+    if not file_ids:
+        return {}
+    if not _mirror_reads():
+        changes.maybe_poll()
+        batch_get_metadata(file_ids, fields=CONTENT_FIELDS)
+    with ThreadPoolExecutor(max_workers=min(CONTENT_WORKERS, len(file_ids))) as pool:
+        return dict(zip(file_ids, pool.map(get_file_content, file_ids)))
@@ -0,0 +1,168 @@
+# utils/drive_cache.py
+import threading
+import time
+from collections import OrderedDict
+from utils.file_ops import load_json, save_json
+
+
+class TTLCache:
+    """Bounded LRU cache with per-entry TTL and tag based invalidation.
+
+    Every entry can carry tags (Drive file/folder ids). Invalidating a tag drops
+    every entry that mentions it, e.g. a folder listing that contains a renamed file.
+    """
+
+    def __init__(self, max_entries=2048, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (expires_at, value, tags)
+        self._tags = {} # tag -> set(keys)
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def get(self, key):
+        """Returns (hit, value)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return False, None
+            if entry[0] <= self.clock():
+                self._drop(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return True, entry[1]
+
+    def set(self, key, value, tags=(), ttl=None):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+            tags = frozenset(tags)
+            self._entries[key] = (expires_at, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, *tags):
+        """Drops every entry tagged with any of the given ids."""
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+            stats["ttl"] = self.ttl
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _drop(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class ChangeFeed:
+    """Incremental reader of the Drive changes feed.
+
+    `client_factory` is a context manager yielding a Drive service (drive_client in
+    production, a fake service in tests). Listeners get each change dict as returned
+    by changes().list.
+    """
+
+    FIELDS = (
+        "nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, parents, "
+        "trashed, modifiedTime, md5Checksum, version, webViewLink, webContentLink))"
+    )
+
+    def __init__(self, client_factory, interval=15, clock=time.monotonic, token_file=None):
+        self.client_factory = client_factory
+        self.interval = interval
+        self.clock = clock
+        # Persisting the page token lets listeners catch up on changes made while we were down
+        self.token_file = token_file
+        self.page_token = load_json(token_file).get("page_token") if token_file else None
+        self._listeners = []
+        self._poll_lock = threading.Lock()
+        self._last_poll = None
+        self._stats = {"polls": 0, "changes": 0, "errors": 0}
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def maybe_poll(self):
+        """Polls if the interval elapsed. Never blocks behind another thread's poll."""
+        if self._last_poll is not None and self.clock() - self._last_poll < self.interval:
+            return 0
+        if not self._poll_lock.acquire(blocking=False):
+            return 0
+        try:
+            return self._poll()
+        finally:
+            self._poll_lock.release()
+
+    def poll(self, raise_errors=False):
+        """Polls now and returns the number of changes applied."""
+        with self._poll_lock:
+            return self._poll(raise_errors)
+
+    def _poll(self, raise_errors=False):
+        self._last_poll = self.clock()
+        applied = 0
+        try:
+            with self.client_factory() as service:
+                token = self.page_token
+                if token is None:
+                    # First poll only establishes where the feed starts
+                    self.page_token = service.changes().getStartPageToken().execute()["startPageToken"]
+                while token:
+                    response = service.changes().list(
+                        pageToken=token,
+                        pageSize=1000,
+                        fields=self.FIELDS,
+                    ).execute()
+                    for change in response.get("changes", []):
+                        for listener in self._listeners:
+                            listener(change)
+                        applied += 1
+                    if "newStartPageToken" in response:
+                        self.page_token = response["newStartPageToken"]
+                    token = response.get("nextPageToken")
+            if self.token_file:
+                save_json(self.token_file, {"page_token": self.page_token}, compact=True)
+        except Exception as e:
+            self._stats["errors"] += 1
+            if raise_errors:
+                raise
+            print(f"Error polling Drive changes: {e}")
+        self._stats["polls"] += 1
+        self._stats["changes"] += applied
+        return applied
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["interval"] = self.interval
+        stats["seconds_since_poll"] = round(self.clock() - self._last_poll, 1) if self._last_poll is not None else None
+        return stats
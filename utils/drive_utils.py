@@ -1,10 +1,10 @@
 # utils/drive_utils.py
 import re, requests
 
-def normalize_drive_link(url_or_id: str) -> str:
-    """Zamienia wszystkie typy linków z Google Drive na bezpośredni (userContent)"""
+def extract_drive_id(url_or_id: str):
+    """Wyciąga ID pliku z linku Google Drive (lub zwraca samo ID). None jeśli to nie Drive."""
     if not url_or_id:
-        return ""
+        return None
 
     file_id = None
 
@@ -24,10 +24,30 @@ def normalize_drive_link(url_or_id: str) -> str:
         if not url_or_id.startswith("http"):
             file_id = url_or_id.strip()
 
+    return file_id
+
+def normalize_drive_link(url_or_id: str) -> str:
+    """Zamienia wszystkie typy linków z Google Drive na bezpośredni (userContent)"""
+    if not url_or_id:
+        return ""
+
+    file_id = extract_drive_id(url_or_id)
+
     if file_id:
         # Zwracamy stabilny link z parametrem export=view
         # Link ten powoduje przekierowanie (302) do treści, ale zazwyczaj działa poprawnie w tagach <img>
         return f"https://drive.google.com/uc?export=view&id={file_id}"
 
     # Jeśli nie udało się wyciągnąć ID, a to link, zwracamy oryginał
-    return url_or_id
\ No newline at end of file
+    return url_or_id
+
+YOUTUBE_ID = re.compile(r"^.*((youtu.be/)|(v/)|(/u/\w/)|(embed/)|(watch\?))\??v?=?([^#&?]*).*")
+
+def is_youtube_url(url: str) -> bool:
+    """Ta sama reguła co extractYoutubeId w templates/vis.html"""
+    match = YOUTUBE_ID.match(url or "")
+    return bool(match) and len(match.group(7)) == 11
+
+def direct_media_link(url: str) -> str:
+    """Link do pobrania pliku audio (Dropbox dl=1, Drive usp=direct), jak w odtwarzaczu /vis"""
+    return (url or "").replace("dl=0", "dl=1").replace("usp=sharing", "usp=direct")
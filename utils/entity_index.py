@@ -0,0 +1,235 @@
+# utils/entity_index.py
+import atexit
+import threading
+from utils.drive import changes, drive_client, get_file_content, get_files_content
+from utils.file_ops import load_json, save_json
+from utils import codec, search_index
+
+# Local index of every metadata_*.json entity: id -> {id, name, type, folder_id, modifiedTime, image}
+# Filled by a full scan once, then kept current by our own saves and the Drive changes feed.
+ENTITY_INDEX_FILE = "data/entity_index.json"
+METADATA_QUERY = "name contains 'metadata_' and mimeType = 'application/json' and trashed = false"
+SAVE_DELAY = 2.0 # Seconds to coalesce saves after a burst of changes feed updates
+
+_lock = threading.RLock()
+_entries = {}
+_by_type = {}
+_built = False
+_loaded = False
+_dirty = False
+_save_timer = None
+_stats = {"rebuilds": 0, "failed": 0, "last_failed": 0} # Entity files that could not be downloaded or parsed
+
+
+def is_metadata_file(name):
+    return bool(name) and name.startswith("metadata_") and name.endswith(".json")
+
+
+def _entity_name(file_name):
+    return file_name.replace("metadata_", "", 1)[:-len(".json")]
+
+
+def _load():
+    global _loaded, _built
+    if _loaded:
+        return
+    data = load_json(ENTITY_INDEX_FILE)
+    for entry in data.get("entities", []) if isinstance(data, dict) else []:
+        _add(entry)
+    _built = bool(data.get("built")) if isinstance(data, dict) else False
+    _loaded = True
+
+
+def _schedule_save():
+    """Marks the index changed; it is written by flush() after SAVE_DELAY. Called under _lock."""
+    global _dirty, _save_timer
+    _dirty = True
+    if _save_timer is None:
+        _save_timer = threading.Timer(SAVE_DELAY, flush)
+        _save_timer.daemon = True
+        _save_timer.start()
+
+
+def flush():
+    """Writes pending index changes to disk."""
+    global _dirty, _save_timer
+    with _lock:
+        _save_timer = None
+        if not _dirty:
+            return
+        save_json(ENTITY_INDEX_FILE, {"built": _built, "entities": list(_entries.values())}, compact=True)
+        _dirty = False
+
+
+def _add(entry):
+    _discard(entry["id"])
+    _entries[entry["id"]] = entry
+    _by_type.setdefault(entry["type"], set()).add(entry["id"])
+
+
+def _discard(file_id):
+    old = _entries.pop(file_id, None)
+    if old:
+        ids = _by_type.get(old["type"])
+        ids.discard(file_id)
+        if not ids:
+            del _by_type[old["type"]]
+    return old
+
+
+def make_entry(file, metadata):
+    """Builds an index entry from Drive file fields and the parsed metadata JSON."""
+    parents = file.get("parents") or [None]
+    if not isinstance(metadata, dict):
+        metadata = {}
+    return {
+        "id": file["id"],
+        "name": metadata.get("name") or _entity_name(file.get("name", "")),
+        "type": str(metadata.get("type", "")).upper(),
+        "folder_id": parents[0],
+        "modifiedTime": file.get("modifiedTime"),
+        "image": metadata.get("image", ""),
+    }
+
+
+def upsert(file, metadata):
+    """Adds or replaces one entity. `file` needs id, name, parents and modifiedTime."""
+    with _lock:
+        _load()
+        entry = make_entry(file, metadata)
+        _add(entry)
+        _schedule_save()
+    search_index.index(entry["id"], entry["name"], metadata)
+
+
+def remove(file_id):
+    with _lock:
+        _load()
+        if _discard(file_id):
+            _schedule_save()
+    search_index.remove(file_id)
+
+
+def is_built():
+    with _lock:
+        _load()
+        return _built
+
+
+def query(entity_type=None):
+    """Returns entities of a type (all entities if no type), sorted by name."""
+    changes.maybe_poll()
+    with _lock:
+        _load()
+        if entity_type:
+            ids = _by_type.get(entity_type.upper(), ())
+            results = [_entries[i] for i in ids]
+        else:
+            results = list(_entries.values())
+    return sorted(results, key=lambda e: e["name"].lower())
+
+
+def get(file_id):
+    with _lock:
+        _load()
+        return _entries.get(file_id)
+
+
+def list_metadata_files():
+    """Lists every metadata_*.json file with maximum page size."""
+    files = []
+    page_token = None
+    with drive_client() as service:
+        while True:
+            response = service.files().list(
+                q=METADATA_QUERY,
+                fields="nextPageToken, files(id, name, parents, modifiedTime)",
+                pageSize=1000,
+                pageToken=page_token
+            ).execute()
+            files.extend(f for f in response.get("files", []) if is_metadata_file(f["name"]))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return files
+
+
+def rebuild():
+    """Full scan. Only files whose modifiedTime changed since the last scan are downloaded.
+
+    The whole result is written once, right away (it also covers pending feed updates).
+    """
+    global _built, _dirty
+    # Make sure the changes feed has a start token before scanning, so nothing slips between
+    changes.maybe_poll()
+    files = list_metadata_files()
+    with _lock:
+        _load()
+        known = dict(_entries)
+    stale = [
+        f for f in files
+        if (known.get(f["id"]) or {}).get("modifiedTime") != f.get("modifiedTime") or not search_index.has(f["id"])
+    ]
+    contents = get_files_content([f["id"] for f in stale])
+
+    fresh = {}
+    failed = 0
+    for f in files:
+        if f["id"] in contents:
+            try:
+                metadata = codec.loads(contents[f["id"]] or "")
+            except ValueError:
+                # Download failed or invalid JSON: keep the previous entry (its old
+                # modifiedTime makes the next scan retry), never drop a known entity
+                failed += 1
+                print(f"Could not read entity {f['id']}, keeping the previous entry")
+                if f["id"] in known:
+                    fresh[f["id"]] = known[f["id"]]
+                continue
+            fresh[f["id"]] = make_entry(f, metadata)
+            search_index.index(f["id"], fresh[f["id"]]["name"], metadata)
+        else:
+            fresh[f["id"]] = known[f["id"]]
+    search_index.retain(fresh)
+
+    with _lock:
+        _entries.clear()
+        _by_type.clear()
+        for entry in fresh.values():
+            _add(entry)
+        _built = True
+        _stats["rebuilds"] += 1
+        _stats["failed"] += failed
+        _stats["last_failed"] = failed
+        _dirty = True
+        flush()
+    return len(fresh)
+
+
+def stats():
+    with _lock:
+        return dict(_stats, entities=len(_entries))
+
+
+def on_change(change):
+    """Changes feed listener: keeps entities current without rescanning."""
+    file = change.get("file") or {}
+    file_id = change.get("fileId")
+    if change.get("removed") or file.get("trashed"):
+        remove(file_id)
+        return
+    if not is_metadata_file(file.get("name")):
+        if get(file_id):
+            remove(file_id) # Renamed to something that is no longer an entity
+        return
+    known = get(file_id)
+    if known and known.get("modifiedTime") == file.get("modifiedTime"):
+        return
+    content = get_file_content(file_id)
+    try:
+        upsert(file, codec.loads(content or ""))
+    except ValueError:
+        print(f"Skipping invalid entity JSON {file_id}")
+
+
+changes.add_listener(on_change)
+atexit.register(flush)
@@ -1,22 +1,38 @@
-import os, json
+import os, tempfile
+from utils import codec
 from utils.schema import Metadata, CampaignState
 
 def load_json(path: str):
     if not os.path.exists(path):
         return {}
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return codec.loads(f.read())
     except Exception:
         return {}
 
-def save_json(path: str, data: dict):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def atomic_write(path: str, write_fn, mode: str = "w"):
+    """Writes via a temp file + fsync + rename, so readers never see a partial file."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode, **({"encoding": "utf-8"} if "b" not in mode else {})) as f:
+            write_fn(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def save_json(path: str, data: dict, compact: bool = False):
+    """Atomically writes JSON. compact=True skips indentation (for machine-only cache files)."""
+    payload = codec.dumps(data, pretty=not compact)
+    atomic_write(path, lambda f: f.write(payload), mode="wb")
 
-def load_state(path: str) -> CampaignState:
-    raw = load_json(path)
+def validate_state(raw: dict) -> CampaignState:
+    """Validates campaign nodes; invalid entries are replaced by defaults."""
     if not raw:
         raw = {"/": Metadata.default("ROOT").model_dump()}
     try:
@@ -29,17 +45,5 @@ def load_state(path: str) -> CampaignState:
                 raw[k] = Metadata.default(k).model_dump()
         return CampaignState.model_validate(raw)
 
-def save_state(path: str, state: CampaignState):
-    save_json(path, state.model_dump())
-
-def ensure_node(state: CampaignState, path: str) -> Metadata:
-    root = state.root
-    if path not in root:
-        name = path.strip("/").split("/")[-1] or "ROOT"
-        root[path] = Metadata.default(name=name)
-    return root[path]
-
 def save_vis_state(path: str, data: dict):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
\ No newline at end of file
+    save_json(path, data)
\ No newline at end of file
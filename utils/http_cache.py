@@ -0,0 +1,40 @@
+# utils/http_cache.py
+import uuid
+from flask import request, Response
+from utils import codec
+
+# Versions of in-process counters restart with the server, so every ETag carries the boot id
+BOOT_ID = uuid.uuid4().hex[:8]
+MAX_WAIT = 30 # Upper bound for ?wait= long-polls, in seconds
+
+
+def wait_seconds():
+    """The ?wait= long-poll timeout of the current request (0 = answer right away)."""
+    return min(max(request.args.get("wait", 0, type=float), 0), MAX_WAIT)
+
+
+def versioned_json(tag, get_version, build, wait_for_change=None):
+    """Answers a polled GET with a strong ETag derived from a version counter.
+
+    get_version() returns the current version, build() the payload (or encoded bytes)
+    and wait_for_change(version, timeout) blocks until the version moves on. A request
+    whose If-None-Match is current gets 304; with ?wait=N it is held for up to N
+    seconds first and answered with the new body as soon as the version changes.
+    """
+    version = get_version()
+    etag = f"{tag}-{BOOT_ID}-{version}"
+    if request.if_none_match.contains(etag):
+        wait = wait_seconds()
+        if wait and wait_for_change is not None:
+            version = wait_for_change(version, wait)
+            etag = f"{tag}-{BOOT_ID}-{version}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+    body = build()
+    response = Response(body if isinstance(body, bytes) else codec.dumps(body), mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
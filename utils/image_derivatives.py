@@ -0,0 +1,201 @@
+# utils/image_derivatives.py
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from utils.blob_cache import BlobCache
+
+# Resized / transcoded copies of proxied images for phones and TV browsers. Needs the
+# optional Pillow package; without it the proxy serves the original images.
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+# Requested widths are rounded up to one of these, so a few files per image cover every screen
+WIDTHS = (320, 640, 960, 1280, 1920, 2560, 3840)
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+QUALITY = {"avif": 55, "webp": 80, "jpeg": 85}
+MAX_PIXELS = 120_000_000 # Larger sources are refused (decompression bombs)
+
+
+def _encoders():
+    if Image is None:
+        return set()
+    encoders = {"jpeg", "png"}
+    if features.check("webp"):
+        encoders.add("webp")
+    try:
+        import pillow_avif # noqa: F401 - registers the AVIF plugin on older Pillow
+    except ImportError:
+        pass
+    Image.init()
+    if "AVIF" in Image.SAVE:
+        encoders.add("avif")
+    return encoders
+
+ENCODERS = _encoders()
+
+
+def snap_width(width):
+    """Rounds a requested width up to the nearest bucket (None stays None)."""
+    if width is None:
+        return None
+    return next((w for w in WIDTHS if w >= width), WIDTHS[-1])
+
+
+def negotiate(fmt, accept):
+    """Picks the output format from ?fmt= and the Accept header.
+
+    "auto" (or no fmt) prefers AVIF, then WebP when the browser lists them; None keeps
+    the source format.
+    """
+    fmt = (fmt or "auto").lower()
+    if fmt != "auto":
+        return fmt if fmt in ENCODERS else None
+    for candidate in ("avif", "webp"):
+        if candidate in ENCODERS and MIME_TYPES[candidate] in (accept or ""):
+            return candidate
+    return None
+
+
+def render(src_path, out_path, width, fmt):
+    """Writes the derivative to out_path. Runs in a worker process.
+
+    Returns False when the source should be served as it is (animated images, or
+    nothing to change).
+    """
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    with Image.open(src_path) as img:
+        if getattr(img, "is_animated", False):
+            return False
+        source_format = (img.format or "").lower()
+        if width and img.format == "JPEG":
+            img.draft("RGB", (width, width * img.height // max(img.width, 1))) # DCT scaling: decodes far fewer pixels
+        out_format = fmt or ("png" if source_format == "png" else "jpeg")
+        if (not width or width >= img.width) and out_format == source_format:
+            return False
+        img = ImageOps.exif_transpose(img)
+        if width and width < img.width:
+            img.thumbnail((width, img.height * width // img.width), Image.LANCZOS)
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+        if out_format == "jpeg" or not has_alpha:
+            img = img.convert("RGB")
+        elif img.mode != "RGBA":
+            img = img.convert("RGBA")
+        options = {"quality": QUALITY[out_format]} if out_format in QUALITY else {"optimize": True}
+        img.save(out_path, format=out_format.upper(), **options)
+    return True
+
+
+class DerivativeCache:
+    """Derivatives of proxied images, generated in a process pool and kept in a BlobCache.
+
+    Entries are keyed by the source etag + width + format. Concurrent requests for the
+    same derivative share one job. Decoding a 20-megapixel photo takes a CPU core for
+    a while, so it happens in worker processes and never holds the GIL of the request
+    threads.
+    """
+
+    def __init__(self, directory, max_bytes, workers=None):
+        self.blobs = BlobCache(directory, max_bytes)
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._jobs = {} # derivative id -> Event set when its job ends
+        self._passthrough = set() # Derivative ids that are served as the source
+        self._stats = {"hits": 0, "rendered": 0, "coalesced": 0, "passthrough": 0, "errors": 0}
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # Workers must not be forked from the threaded server (locks held by other
+                # threads would be copied locked); forkserver / spawn start them clean
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+            return self._pool
+
+    def _discard(self, pool):
+        """Drops a broken pool (a worker died, e.g. out of memory), so the next job starts a new one."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def get(self, src_path, src_meta, width, fmt):
+        """Returns (path, meta) of the derivative, or (src_path, src_meta) when there is nothing to gain.
+
+        Blocks while the derivative is generated. Raises when the image cannot be decoded.
+        """
+        derivative_id = f"{src_meta['etag']}:{width or ''}:{fmt or ''}"
+        path, meta = self.blobs.get_meta(derivative_id)
+        if path and os.path.exists(path):
+            with self._lock:
+                self._stats["hits"] += 1
+            return path, meta
+
+        with self._lock:
+            if derivative_id in self._passthrough:
+                self._stats["passthrough"] += 1
+                return src_path, src_meta
+            done = self._jobs.get(derivative_id)
+            owner = done is None
+            if owner:
+                done = self._jobs[derivative_id] = threading.Event()
+            else:
+                self._stats["coalesced"] += 1
+        if not owner: # Another request is generating it
+            done.wait()
+            path, meta = self.blobs.get_meta(derivative_id)
+            return (path, meta) if path else (src_path, src_meta)
+        try:
+            return self._generate(derivative_id, src_path, src_meta, width, fmt)
+        finally:
+            with self._lock:
+                self._jobs.pop(derivative_id, None)
+            done.set()
+
+    def _generate(self, derivative_id, src_path, src_meta, width, fmt):
+        fd, out_path = self.blobs.mkstemp()
+        os.close(fd)
+        pool = self._executor()
+        try:
+            changed = pool.submit(render, src_path, out_path, width, fmt).result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._discard(pool)
+            os.remove(out_path)
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        if not changed:
+            os.remove(out_path)
+            with self._lock:
+                self._passthrough.add(derivative_id)
+                self._stats["passthrough"] += 1
+            return src_path, src_meta
+        content_type = MIME_TYPES.get(fmt) or (MIME_TYPES["png"] if src_meta.get("content_type") == "image/png" else MIME_TYPES["jpeg"])
+        meta = {
+            "content_type": content_type,
+            "etag": BlobCache.make_key(derivative_id, src_meta["etag"]),
+            "last_modified": src_meta.get("last_modified"),
+        }
+        path = self.blobs.adopt(derivative_id, src_meta["etag"], out_path, meta)
+        with self._lock:
+            self._stats["rendered"] += 1
+        return path, meta
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, available=self.available, encoders=sorted(ENCODERS), in_progress=len(self._jobs), disk=self.blobs.stats())
+
+
+derivatives = DerivativeCache(
+    os.getenv("DERIVATIVE_CACHE_DIR", "data/derivative_cache"),
+    max_bytes=int(os.getenv("DERIVATIVE_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+)
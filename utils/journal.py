@@ -0,0 +1,166 @@
+# utils/journal.py
+import glob
+import os
+import threading
+import time
+from utils import codec
+from utils.file_ops import load_json, save_json, atomic_write
+
+
+class Journal:
+    """Append-only change log with periodic compacted snapshots.
+
+    Each mutation is one JSON line {"seq", "ts", "op", "data"} in journal.log, so a
+    write costs O(change). Snapshots (snapshot-<seq>.json) hold the full state after
+    `seq`; startup loads the newest one and replays the records after it.
+
+    Retention is by record count, not by number of snapshots: at least the last
+    `keep_records` records stay rewindable by state_at(), however often snapshots are
+    taken. Snapshots inside that window are thinned to one per `snapshot_every` records,
+    and journal.log is only rewritten once `keep_records` records have fallen out of it.
+
+    Records of `external_ops` (whole-document payloads such as a full map) keep their
+    data in record-<seq>.json, so journal.log stays small and listing the history never
+    parses them; their log lines carry {"file": "record-<seq>.json"} instead of the data.
+
+    `reducer(state, op, data)` applies one record to a state dict in place.
+    """
+
+    def __init__(self, directory, reducer, snapshot_every=200, keep_records=1000, external_ops=()):
+        self.directory = directory
+        self.reducer = reducer
+        self.snapshot_every = snapshot_every
+        self.keep_records = keep_records
+        self.external_ops = tuple(external_ops)
+        self.log_file = os.path.join(directory, "journal.log")
+        self.seq = 0
+        self.since_snapshot = 0
+        self._log_base = 0 # journal.log holds the records after this seq
+        self._lock = threading.Lock()
+
+    # ---------- files ----------
+
+    def _snapshot_files(self):
+        """Returns [(seq, path)] sorted by seq."""
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "snapshot-*.json")):
+            try:
+                files.append((int(os.path.basename(path)[len("snapshot-"):-len(".json")]), path))
+            except ValueError:
+                continue
+        return sorted(files)
+
+    def _record_file(self, seq):
+        return os.path.join(self.directory, f"record-{seq}.json")
+
+    def _records(self, after=0, upto=None, with_data=True):
+        """Yields the log records in range. External payloads are read only if `with_data`, else data is None."""
+        if not os.path.exists(self.log_file):
+            return
+        with open(self.log_file, "rb") as f:
+            for line in f:
+                try:
+                    record = codec.loads(line)
+                except ValueError:
+                    continue # Torn last line after a crash
+                if record["seq"] > after and (upto is None or record["seq"] <= upto):
+                    if "file" in record:
+                        record["data"] = load_json(os.path.join(self.directory, record["file"])) if with_data else None
+                    yield record
+
+    def _drop_record_files(self, upto):
+        """Removes external payloads of records no snapshot can replay any more (seq <= upto)."""
+        for path in glob.glob(os.path.join(self.directory, "record-*.json")):
+            try:
+                seq = int(os.path.basename(path)[len("record-"):-len(".json")])
+            except ValueError:
+                continue
+            if seq <= upto:
+                os.remove(path)
+
+    # ---------- load / append ----------
+
+    def load(self, initial=None):
+        """Returns the latest state: newest snapshot + replayed records. Sets self.seq.
+
+        On first use `initial` becomes snapshot 0, so every record can be rewound.
+        """
+        snapshots = self._snapshot_files()
+        if not snapshots:
+            save_json(os.path.join(self.directory, "snapshot-0.json"), {"seq": 0, "ts": time.time(), "state": initial or {}}, compact=True)
+            snapshots = self._snapshot_files()
+        snapshot = load_json(snapshots[-1][1])
+        state, base = snapshot.get("state", {}), snapshot.get("seq", snapshots[-1][0])
+        self.seq = base
+        self._log_base = snapshots[0][0]
+        self.since_snapshot = 0
+        for record in self._records(after=base):
+            self.reducer(state, record["op"], record["data"])
+            self.seq = record["seq"]
+            self.since_snapshot += 1
+        return state
+
+    def append(self, op, data):
+        """Appends one record and returns its seq."""
+        with self._lock:
+            self.seq += 1
+            self.since_snapshot += 1
+            record = {"seq": self.seq, "ts": time.time(), "op": op}
+            if op in self.external_ops:
+                # Payload first: a log line never points at a missing file
+                save_json(self._record_file(self.seq), data, compact=True)
+                record["file"] = os.path.basename(self._record_file(self.seq))
+            else:
+                record["data"] = data
+            line = codec.dumps(record)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.log_file, "ab") as f:
+                f.write(line + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            return self.seq
+
+    def needs_snapshot(self):
+        return self.since_snapshot >= self.snapshot_every
+
+    # ---------- snapshots ----------
+
+    def snapshot(self, state, seq):
+        """Writes the full state after `seq` and drops history older than `keep_records` records."""
+        save_json(os.path.join(self.directory, f"snapshot-{seq}.json"), {"seq": seq, "ts": time.time(), "state": state}, compact=True)
+        with self._lock:
+            self.since_snapshot = self.seq - seq
+            snapshots = [s for s, _ in self._snapshot_files()]
+            # Base: the newest snapshot that still covers the last keep_records records
+            base = max([s for s in snapshots if s <= self.seq - self.keep_records] or [snapshots[0]])
+            kept = [base]
+            for s in snapshots:
+                if s > base and (s - kept[-1] >= self.snapshot_every or s == snapshots[-1]):
+                    kept.append(s)
+            for s in set(snapshots) - set(kept):
+                os.remove(os.path.join(self.directory, f"snapshot-{s}.json"))
+            if base - self._log_base >= self.keep_records:
+                records = [codec.dumps(r) + b"\n" for r in self._records(after=base, with_data=False)]
+                atomic_write(self.log_file, lambda f: f.writelines(records), mode="wb")
+                self._log_base = base
+            self._drop_record_files(base)
+
+    def state_at(self, seq):
+        """Rebuilds the state right after record `seq` (within the kept history)."""
+        base = [(s, p) for s, p in self._snapshot_files() if s <= seq]
+        if not base:
+            raise ValueError(f"Record {seq} is older than the kept history")
+        snapshot = load_json(base[-1][1])
+        state = snapshot.get("state", {})
+        for record in self._records(after=base[-1][0], upto=seq):
+            self.reducer(state, record["op"], record["data"])
+        return state
+
+    def history(self, limit=None):
+        """Returns the newest `limit` records (all rewindable ones by default), oldest first.
+
+        External payloads are not read: their records have data None.
+        """
+        snapshots = self._snapshot_files()
+        records = list(self._records(after=snapshots[0][0] if snapshots else 0, with_data=False))
+        return records if limit is None else records[-limit:]
@@ -0,0 +1,139 @@
+# utils/map_session.py
+import threading
+import time
+from collections import deque
+
+# Shared map state: {"seq", "timestamp", "data", "nodes"}. `data` is the last full push
+# (legacy clients) without its "nodes", `nodes` the node attributes by id, seeded by a
+# full push that has a "nodes" dict and edited by numbered operations:
+#   {"op": "add", "id": ..., "node": {...}}
+#   {"op": "move", "id": ..., "x": ..., "y": ...}
+#   {"op": "update", "id": ..., "attrs": {...}}
+#   {"op": "remove", "id": ...}
+OPS = ("add", "move", "update", "remove")
+EMPTY_MAP = {"seq": 0, "timestamp": 0, "data": None, "nodes": {}}
+
+
+def validate_ops(ops):
+    """Returns an error message for a malformed op list, or None."""
+    if not isinstance(ops, list) or not ops:
+        return "ops must be a non-empty list"
+    for op in ops:
+        if not isinstance(op, dict) or op.get("op") not in OPS or op.get("id") is None:
+            return f"Invalid op: {op}"
+        if op["op"] == "add" and not isinstance(op.get("node"), dict):
+            return f"add needs a node: {op}"
+        if op["op"] == "update" and not isinstance(op.get("attrs"), dict):
+            return f"update needs attrs: {op}"
+    return None
+
+
+def apply_ops(map_state, ops, timestamp):
+    """Returns a new map state with ops applied; each op gets the next seq.
+
+    The nodes dict is copied (not the nodes), so readers holding the old state are
+    never affected. Ops on unknown ids are numbered but change nothing.
+    """
+    map_state = map_state or EMPTY_MAP
+    nodes = dict(map_state.get("nodes") or {})
+    seq = map_state.get("seq", 0)
+    for op in ops:
+        seq += 1
+        node_id = str(op["id"])
+        if op["op"] == "add":
+            nodes[node_id] = op["node"]
+        elif op["op"] == "remove":
+            nodes.pop(node_id, None)
+        elif node_id in nodes:
+            attrs = {"x": op.get("x"), "y": op.get("y")} if op["op"] == "move" else op["attrs"]
+            nodes[node_id] = dict(nodes[node_id], **attrs)
+    return {"seq": seq, "timestamp": timestamp, "data": map_state.get("data"), "nodes": nodes}
+
+
+class MapSession:
+    """Numbered operation log in front of the map state kept in a StateStore.
+
+    Every batch is journaled by the store (op "map_ops") and kept in a bounded
+    in-memory log, so guests can ask for the ops after the seq they have. Clients
+    that are further behind (or after a full push / rewind) get the full state.
+    """
+
+    def __init__(self, store, log_size=2000):
+        self.store = store
+        self._lock = threading.Lock()
+        self._log = deque(maxlen=log_size) # ops with their "seq"
+        self._log_version = None # store.map_version the log is valid for
+
+    def _current(self):
+        return self.store.get_map() or EMPTY_MAP
+
+    def push_ops(self, ops):
+        """Applies and logs a batch of ops. Returns the new seq.
+
+        Raises ValueError when an op targets a node that does not exist (at that point of the batch).
+        """
+        with self._lock:
+            current = self._current()
+            known = set(current.get("nodes") or {})
+            for op in ops:
+                node_id = str(op["id"])
+                if op["op"] == "add":
+                    known.add(node_id)
+                elif node_id not in known:
+                    raise ValueError(f"Unknown node id: {op['id']}")
+                elif op["op"] == "remove":
+                    known.discard(node_id)
+            return self._append(current, ops)
+
+    def _append(self, current, ops):
+        """Journals ops as one "map_ops" record and logs them. Call with self._lock held."""
+        if self.store.get_version("map") != self._log_version:
+            self._log.clear() # Replaced by a full push or a rewind
+        seq = current.get("seq", 0)
+        # "seq" (after the batch) lets listeners number the ops without reading the store
+        self._log_version = self.store.apply("map_ops", {"ops": ops, "timestamp": time.time(), "seq": seq + len(ops)})
+        for op in ops:
+            seq += 1
+            self._log.append(dict(op, seq=seq))
+        return seq
+
+    def push_full(self, data):
+        """Replaces the whole map (legacy full-state POST). Returns the new seq.
+
+        A "nodes" dict in the pushed map seeds the node state, so ops can edit it afterwards.
+        When only nodes changed, just the differences are journaled (as add / remove ops).
+        """
+        nodes = data.get("nodes") if isinstance(data, dict) else None
+        if isinstance(nodes, dict):
+            data = {k: v for k, v in data.items() if k != "nodes"}
+            nodes = {str(node_id): node for node_id, node in nodes.items()}
+        else:
+            nodes = {}
+        with self._lock:
+            current = self._current()
+            if data is not None and data == current.get("data"):
+                old = current.get("nodes") or {}
+                ops = [{"op": "add", "id": node_id, "node": node} for node_id, node in nodes.items() if old.get(node_id) != node]
+                ops += [{"op": "remove", "id": node_id} for node_id in old if node_id not in nodes]
+                return self._append(current, ops) if ops else current.get("seq", 0)
+            seq = current.get("seq", 0) + 1
+            self.store.apply("map", {"seq": seq, "timestamp": time.time(), "data": data, "nodes": nodes})
+            self._log.clear()
+            self._log_version = None
+            return seq
+
+    def since(self, seq):
+        """Returns {"seq", "timestamp", "ops"} with the ops after `seq`, or None if the log no longer has them."""
+        with self._lock:
+            current = self._current()
+            if seq == current.get("seq", 0):
+                return {"seq": seq, "timestamp": current.get("timestamp"), "ops": []}
+            if self.store.get_version("map") != self._log_version or not self._log:
+                return None
+            if seq < self._log[0]["seq"] - 1 or seq > current.get("seq", 0):
+                return None
+            ops = [op for op in self._log if op["seq"] > seq]
+            return {"seq": current.get("seq", 0), "timestamp": current.get("timestamp"), "ops": ops}
+
+    def snapshot(self):
+        return self._current()
@@ -0,0 +1,323 @@
+# utils/mirror.py
+import os
+import tempfile
+import threading
+import time
+from googleapiclient.http import MediaIoBaseDownload
+from utils.file_ops import load_json, save_json
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+
+class Mirror:
+    """Local read-through copy of the campaign subtree (folders, metadata JSON, images).
+
+    The index keeps Drive metadata for every file under `root_id`; bodies of JSON and
+    image files are stored in `<directory>/blobs/<file_id>`. The first sync walks the
+    whole subtree, later ones apply the Drive changes feed (see apply_change) and
+    download only bodies whose md5Checksum/version changed.
+
+    `client_factory` is a context manager yielding a Drive service, so the engine can
+    run against a fake Drive.
+    """
+
+    FIELDS = "id, name, mimeType, parents, trashed, md5Checksum, version, modifiedTime, webViewLink, webContentLink"
+    QUERY_CHUNK = 40
+
+    def __init__(self, directory, client_factory, root_id, interval=60):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.index_file = os.path.join(directory, "index.json")
+        self.client_factory = client_factory
+        self.root_id = root_id
+        self.interval = interval
+        self.online = None
+        self._lock = threading.RLock()
+        self._files = {}
+        self._children = {}
+        self._fetched = {} # file_id -> fingerprint of the body on disk
+        self._dirty = set() # Local writes not yet confirmed by Drive
+        self._synced_at = None
+        self._thread = None
+        self._stats = {"syncs": 0, "downloads": 0, "errors": 0}
+        self._load()
+
+    # ---------- index ----------
+
+    def _load(self):
+        data = load_json(self.index_file)
+        if data and data.get("root") != self.root_id:
+            # Index of another campaign folder: start over (its pending writes cannot apply here)
+            print(f"Mirror index is for root {data.get('root')}, not {self.root_id}; resyncing")
+            return
+        for meta in data.get("files", {}).values():
+            self._put(meta)
+        self._fetched = data.get("fetched", {})
+        # Queued writes live in memory, so the ones still pending at the last exit never
+        # reached Drive: serve Drive's version again (re-downloaded by fetch_bodies)
+        for file_id in data.get("dirty", []):
+            self._fetched.pop(file_id, None)
+        self._synced_at = data.get("synced_at")
+
+    def _save(self):
+        save_json(self.index_file, {
+            "root": self.root_id,
+            "synced_at": self._synced_at,
+            "files": self._files,
+            "fetched": self._fetched,
+            "dirty": sorted(self._dirty),
+        }, compact=True)
+
+    def _put(self, meta):
+        self._drop(meta["id"], subtree=False)
+        self._files[meta["id"]] = meta
+        for parent in meta.get("parents") or []:
+            self._children.setdefault(parent, set()).add(meta["id"])
+
+    def _drop(self, file_id, subtree=True):
+        meta = self._files.pop(file_id, None)
+        if meta is None:
+            return
+        for parent in meta.get("parents") or []:
+            self._children.get(parent, set()).discard(file_id)
+        if subtree:
+            for child in list(self._children.pop(file_id, ())):
+                self._drop(child)
+            self._fetched.pop(file_id, None)
+            self._remove_blob(file_id)
+
+    @staticmethod
+    def _fingerprint(meta):
+        return meta.get("md5Checksum") or meta.get("version")
+
+    @staticmethod
+    def _wants_body(meta):
+        mime = meta.get("mimeType", "")
+        return mime == "application/json" or mime.startswith("image/")
+
+    def _blob_path(self, file_id):
+        return os.path.join(self.blob_dir, file_id)
+
+    def _remove_blob(self, file_id):
+        try:
+            os.remove(self._blob_path(file_id))
+        except OSError:
+            pass
+
+    # ---------- reads ----------
+
+    def ready(self):
+        return self._synced_at is not None
+
+    def has(self, file_id):
+        return file_id in self._files
+
+    def get_metadata(self, file_id):
+        with self._lock:
+            meta = self._files.get(file_id)
+            return dict(meta) if meta else None
+
+    def list_folder(self, folder_id):
+        """Same shape and order as list_folder_content: folders first, then by name."""
+        with self._lock:
+            items = [dict(self._files[c]) for c in self._children.get(folder_id, ())]
+        items.sort(key=lambda f: (f.get("mimeType") != FOLDER_MIME, f.get("name", "").lower()))
+        return items
+
+    def blob_path(self, file_id):
+        path = self._blob_path(file_id)
+        return path if file_id in self._fetched and os.path.exists(path) else None
+
+    # ---------- writes ----------
+
+    def apply_local_write(self, file_id, content, name=None):
+        """Makes a queued (not yet uploaded) write visible to mirror reads."""
+        with self._lock:
+            meta = self._files.get(file_id)
+            if meta is None:
+                return
+            if name:
+                meta["name"] = name
+            self._dirty.add(file_id)
+            self._write_blob(file_id, lambda fh: fh.write(content.encode("utf-8")), None)
+            self._save()
+
+    def apply_remote_write(self, file, content=None):
+        """Records a write Drive confirmed. `file` carries the fields returned by the update."""
+        with self._lock:
+            meta = self._files.get(file["id"])
+            if meta is None:
+                return
+            meta.update(file)
+            self._dirty.discard(file["id"])
+            if content is not None:
+                self._write_blob(file["id"], lambda fh: fh.write(content.encode("utf-8")), self._fingerprint(meta))
+            self._save()
+
+    def drop_local_write(self, file_id):
+        """A queued write was given up: Drive's version is the truth again.
+
+        Re-reads the file's metadata and body now, or on the next background round
+        when Drive cannot be reached.
+        """
+        with self._lock:
+            if file_id not in self._dirty:
+                return
+            self._dirty.discard(file_id)
+            self._fetched.pop(file_id, None)
+            self._save()
+        try:
+            with self.client_factory() as service:
+                meta = service.files().get(fileId=file_id, fields=self.FIELDS).execute()
+            self.apply_change({"fileId": file_id, "file": meta})
+            self.fetch_bodies()
+        except Exception as e:
+            self._stats["errors"] += 1
+            print(f"Mirror refresh of {file_id} failed: {e}")
+
+    def _write_blob(self, file_id, write_fn, fingerprint, remote=False):
+        """Writes a body and records its fingerprint. Returns False when a remote body
+        (remote=True) arrived after a local write of the file, which it must not replace."""
+        os.makedirs(self.blob_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                write_fn(fh)
+            with self._lock:
+                if remote and file_id in self._dirty:
+                    os.remove(tmp_path)
+                    return False
+                os.replace(tmp_path, self._blob_path(file_id))
+                self._fetched[file_id] = fingerprint
+            return True
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # ---------- sync ----------
+
+    def _list_children(self, service, parent_ids):
+        query = " or ".join(f"'{pid}' in parents" for pid in parent_ids)
+        files = []
+        page_token = None
+        while True:
+            response = service.files().list(
+                q=f"trashed=false and ({query})",
+                fields=f"nextPageToken, files({self.FIELDS})",
+                pageSize=1000,
+                pageToken=page_token
+            ).execute()
+            files.extend(response.get("files", []))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return files
+
+    def sync(self):
+        """Full walk of the campaign subtree, then downloads changed bodies."""
+        with self.client_factory() as service:
+            root = service.files().get(fileId=self.root_id, fields=self.FIELDS).execute()
+            found = {root["id"]: dict(root, parents=[])}
+            frontier = [root["id"]]
+            while frontier:
+                children = []
+                for start in range(0, len(frontier), self.QUERY_CHUNK):
+                    children.extend(self._list_children(service, frontier[start:start + self.QUERY_CHUNK]))
+                for meta in children:
+                    found[meta["id"]] = meta
+                frontier = [m["id"] for m in children if m.get("mimeType") == FOLDER_MIME]
+
+        with self._lock:
+            for file_id in [f for f in self._files if f not in found]:
+                self._drop(file_id)
+            for meta in found.values():
+                if meta["id"] in self._dirty and meta["id"] in self._files:
+                    continue # Keep our pending version until the upload lands
+                self._put(meta)
+            self._synced_at = time.time()
+            self._stats["syncs"] += 1
+            self._save()
+        return self.fetch_bodies()
+
+    def apply_change(self, change):
+        """Changes feed listener: keeps the index current between full syncs."""
+        file = change.get("file") or {}
+        file_id = change.get("fileId")
+        with self._lock:
+            if not self.ready():
+                return
+            if change.get("removed") or file.get("trashed"):
+                if file_id in self._files:
+                    self._drop(file_id)
+                    self._save()
+                return
+            parents = file.get("parents") or []
+            if file_id == self.root_id or any(p in self._files for p in parents):
+                if file_id not in self._dirty:
+                    self._put(dict(file, parents=[] if file_id == self.root_id else parents))
+                    self._save()
+            elif file_id in self._files:
+                self._drop(file_id) # Moved out of the campaign
+                self._save()
+
+    def fetch_bodies(self):
+        """Downloads bodies that are missing or stale. Returns the number downloaded."""
+        with self._lock:
+            stale = [
+                meta for meta in self._files.values()
+                if self._wants_body(meta) and meta["id"] not in self._dirty
+                and (self._fetched.get(meta["id"], False) != self._fingerprint(meta) or not os.path.exists(self._blob_path(meta["id"])))
+            ]
+        downloaded = 0
+        with self.client_factory() as service:
+            for meta in stale:
+                # Downloaded without the lock: a local write meanwhile wins over this body
+                if self._write_blob(meta["id"], lambda fh: self.download(service, meta["id"], fh), self._fingerprint(meta), remote=True):
+                    downloaded += 1
+        if downloaded:
+            with self._lock:
+                self._stats["downloads"] += downloaded
+                self._save()
+        return downloaded
+
+    def download(self, service, file_id, fh):
+        """Streams a file body into fh. Fakes without media support can override this."""
+        downloader = MediaIoBaseDownload(fh, service.files().get_media(fileId=file_id))
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+
+    # ---------- background ----------
+
+    def start(self, poll_changes=None):
+        """Starts the background sync loop once. poll_changes() feeds apply_change between syncs."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(poll_changes,), name="drive-mirror", daemon=True)
+            self._thread.start()
+
+    def _run(self, poll_changes):
+        while True:
+            try:
+                if not self.ready() or poll_changes is None:
+                    self.sync()
+                else:
+                    poll_changes()
+                    self.fetch_bodies()
+                self.online = True
+            except Exception as e:
+                self.online = False
+                self._stats["errors"] += 1
+                print(f"Mirror sync failed: {e}")
+            time.sleep(self.interval)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["files"] = len(self._files)
+            stats["bodies"] = len(self._fetched)
+            stats["pending_writes"] = len(self._dirty)
+            stats["synced_at"] = self._synced_at
+            stats["online"] = self.online
+        return stats
@@ -0,0 +1,240 @@
+# utils/proxy_cache.py
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from utils.blob_cache import BlobCache
+
+FETCH_CHUNK_SIZE = 256 * 1024
+TAIL_IDLE_TIMEOUT = 60 # Seconds a reader waits for the next chunk before giving up
+
+
+def _http_time(value):
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+class Download:
+    """One upstream fetch in progress. Every request for the URL reads from its part file."""
+
+    def __init__(self, url, part_path):
+        self.url = url
+        self.part_path = part_path
+        self.cond = threading.Condition()
+        self.meta = None # Set once the upstream headers arrive
+        self.length = None # Upstream Content-Length, if sent
+        self.written = 0
+        self.done = False
+        self.error = None
+        self.path = None # Blob path once finished
+
+    def wait_headers(self, timeout=None):
+        """Blocks until the body starts (meta is set) or the download ended."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.meta is not None or self.done, timeout)
+
+    def wait(self, timeout=None):
+        """Blocks until the download ended. Returns (path, meta); raises its error."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.done, timeout):
+                raise TimeoutError(f"Download of {self.url} still running")
+            if self.error:
+                raise self.error
+            return self.path, self.meta
+
+    def tail(self, start=0, end=None):
+        """Yields bytes start..end-1 of the body (to the end by default) as they are written.
+
+        Must be called after wait_headers(). The file is opened per chunk, under cond:
+        on Windows an open file can be neither renamed nor deleted, and ProxyCache._complete
+        moves or removes the part file under cond, so it never finds a reader holding it.
+        """
+        position = start
+        while end is None or position < end:
+            with self.cond:
+                self.cond.wait_for(lambda: self.written > position or self.done, TAIL_IDLE_TIMEOUT)
+                if self.done and not self.path:
+                    return # Failed
+                available = self.written if end is None else min(self.written, end)
+                if available <= position:
+                    return # Finished or stalled
+                try:
+                    with open(self.path if self.done else self.part_path, "rb") as fh:
+                        fh.seek(position)
+                        chunk = fh.read(min(available - position, FETCH_CHUNK_SIZE))
+                except OSError as e:
+                    print(f"Reading {self.url} failed: {e}") # E.g. evicted right after finishing
+                    return
+            if not chunk:
+                return
+            position += len(chunk)
+            yield chunk
+
+
+class ProxyCache:
+    """On-disk cache of remote media (Drive/Dropbox images and audio) for the /vis proxies.
+
+    Bodies live in a BlobCache keyed by URL (size cap, LRU eviction), together with the
+    upstream Content-Type, ETag and Last-Modified. All fetches share one pooled
+    requests.Session, so redirect chains such as Drive's uc?export=view reuse their
+    TLS connections.
+
+    Fetches are single-flight: a URL has at most one upstream download at a time, run
+    in a background thread, and concurrent requests for it stream from that download
+    (Download.tail) instead of starting their own. Entries older than `ttl` seconds
+    are served as they are while a conditional GET revalidates them in the background.
+    Bodies over `max_download_bytes` (by Content-Length or by what arrived) fail the fetch.
+    """
+
+    def __init__(self, directory, max_bytes, ttl=24 * 3600, timeout=30, max_download_bytes=512 * 1024 * 1024):
+        self.blobs = BlobCache(directory, max_bytes)
+        self.max_download_bytes = max_download_bytes # Larger bodies are aborted, not cached
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._inflight = {} # url -> Download
+        self._stats = {"hits": 0, "upstream_fetches": 0, "coalesced": 0, "revalidated": 0, "stale_served": 0, "errors": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def open(self, url):
+        """Returns (path, meta, None) for a cached body, or (None, None, Download) while it is fetched.
+
+        meta has content_type, etag (ours, strong), last_modified (unix time) and fetched_at.
+        """
+        path, meta = self.blobs.get_meta(url)
+        if path and os.path.exists(path):
+            self.blobs.get(url) # LRU touch
+            if time.time() - meta.get("fetched_at", 0) < self.ttl:
+                self._count("hits")
+            else:
+                self._count("stale_served")
+                self._start(url, meta)
+            return path, meta, None
+        return None, None, self._start(url, None)
+
+    def fetch(self, url, timeout=None):
+        """Returns (path, meta) of the cached body, waiting for the download if needed.
+
+        Raises requests.RequestException / ValueError when the origin fails and nothing is cached.
+        """
+        path, meta, download = self.open(url)
+        return (path, meta) if download is None else download.wait(timeout)
+
+    def _start(self, url, cached_meta):
+        """Returns the running download of url, starting one if there is none."""
+        with self._lock:
+            download = self._inflight.get(url)
+            if download is not None:
+                self._stats["coalesced"] += 1
+                return download
+            fd, part_path = self.blobs.mkstemp()
+            os.close(fd)
+            download = self._inflight[url] = Download(url, part_path)
+            self._stats["upstream_fetches"] += 1
+        threading.Thread(target=self._download, args=(download, cached_meta), name="proxy-fetch", daemon=True).start()
+        return download
+
+    def _download(self, download, cached_meta):
+        url = download.url
+        headers = {}
+        if cached_meta:
+            if cached_meta.get("upstream_etag"):
+                headers["If-None-Match"] = cached_meta["upstream_etag"]
+            if cached_meta.get("upstream_last_modified"):
+                headers["If-Modified-Since"] = cached_meta["upstream_last_modified"]
+        try:
+            with self.session.get(url, stream=True, allow_redirects=True, timeout=self.timeout, headers=headers) as resp:
+                if resp.status_code == 304 and cached_meta:
+                    self._count("revalidated")
+                    self.blobs.update_meta(url, fetched_at=time.time())
+                    path, meta = self.blobs.get_meta(url)
+                    if path is None:
+                        raise ValueError("Revalidated entry was evicted meanwhile")
+                    with download.cond:
+                        self._complete(download, path, meta)
+                elif resp.status_code != 200:
+                    raise ValueError(f"Upstream returned {resp.status_code}")
+                else:
+                    self._receive(download, resp)
+        except Exception as e:
+            self._count("errors")
+            print(f"Proxy fetch of {url} failed: {e}")
+            with download.cond:
+                self._complete(download, None, None, e)
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+
+    @staticmethod
+    def _complete(download, path, meta, error=None):
+        """Publishes the outcome to readers. Called with download.cond held, in the same
+        section that moved the part file (readers only open it under cond). Waiters are
+        released even when removing the part file fails."""
+        try:
+            if os.path.exists(download.part_path):
+                os.remove(download.part_path)
+        except OSError as e:
+            print(f"Could not remove {download.part_path}: {e}")
+        finally:
+            download.path, download.error = path, error
+            download.meta = meta or download.meta
+            if path and os.path.exists(path):
+                download.written = os.path.getsize(path) # Also covers 304s, where nothing was written
+            download.done = True
+            download.cond.notify_all()
+
+    def _receive(self, download, resp):
+        """Writes the body to the part file, waking readers after each chunk, then moves it into the cache."""
+        upstream_etag = resp.headers.get("ETag")
+        upstream_last_modified = resp.headers.get("Last-Modified")
+        fingerprint = upstream_etag or upstream_last_modified or str(time.time())
+        now = time.time()
+        meta = {
+            "content_type": resp.headers.get("Content-Type", "application/octet-stream"),
+            "upstream_etag": upstream_etag,
+            "upstream_last_modified": upstream_last_modified,
+            "last_modified": _http_time(upstream_last_modified) or now,
+            "fetched_at": now,
+            "etag": BlobCache.make_key(download.url, fingerprint),
+        }
+        length = resp.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > self.max_download_bytes:
+            raise ValueError(f"Body of {length} bytes is over the {self.max_download_bytes} byte limit")
+        with download.cond:
+            download.meta = meta
+            download.length = int(length) if length.isdigit() and "Content-Encoding" not in resp.headers else None
+            download.cond.notify_all()
+        with open(download.part_path, "wb") as fh:
+            for chunk in resp.iter_content(chunk_size=FETCH_CHUNK_SIZE):
+                if download.written + len(chunk) > self.max_download_bytes:
+                    raise ValueError(f"Body is over the {self.max_download_bytes} byte limit")
+                fh.write(chunk)
+                fh.flush()
+                with download.cond:
+                    download.written += len(chunk)
+                    download.cond.notify_all()
+        with download.cond:
+            self._complete(download, self.blobs.adopt(download.url, fingerprint, download.part_path, meta), meta)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._inflight), disk=self.blobs.stats())
+
+
+# Shared by the image and audio proxies
+media_cache = ProxyCache(
+    os.getenv("PROXY_CACHE_DIR", "data/proxy_cache"),
+    max_bytes=int(os.getenv("PROXY_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024))),
+    max_download_bytes=int(os.getenv("PROXY_MAX_DOWNLOAD_BYTES", str(512 * 1024 * 1024))),
+)
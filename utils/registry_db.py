@@ -0,0 +1,255 @@
+# utils/registry_db.py
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from utils.file_ops import load_json
+
+# Local registries (NPCs, factions, saved locations, folder tree) in one SQLite file.
+# Replaces data/local_npcs.json, local_fractions.json, local_locations.json and
+# local_folders.json, which are imported once on first use.
+DB_FILE = "data/registry.db"
+LEGACY_NPCS = "data/local_npcs.json"
+LEGACY_FRACTIONS = "data/local_fractions.json"
+LEGACY_LOCATIONS = "data/local_locations.json"
+LEGACY_FOLDERS = "data/local_folders.json"
+LEGACY_TREE_SYNC = "data/tree_sync.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    folder_id TEXT,
+    type TEXT NOT NULL DEFAULT '',
+    fraction TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_entities_type ON entities(type);
+CREATE INDEX IF NOT EXISTS idx_entities_fraction ON entities(fraction);
+
+CREATE TABLE IF NOT EXISTS locations (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS folders (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    parent_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_folders_parent ON folders(parent_id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+# In-process change counters per table, for ETags and long-polling (see utils/http_cache.py)
+_versions = {"entities": 0, "locations": 0, "folders": 0}
+_changed = threading.Condition()
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
+        conn = sqlite3.connect(DB_FILE, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def transaction():
+    """Yields a connection; commits on success, rolls back on error."""
+    _ensure_initialized()
+    conn = _connect()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _ensure_initialized():
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        conn = _connect()
+        conn.executescript(SCHEMA)
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone() is None:
+            with conn:
+                _migrate_json(conn)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', '1')")
+        _initialized = True
+
+
+def _migrate_json(conn):
+    """One-shot import of the JSON registries."""
+    npcs = load_json(LEGACY_NPCS)
+    for e in npcs if isinstance(npcs, list) else []:
+        _upsert_entity(conn, e, "")
+
+    fractions = load_json(LEGACY_FRACTIONS)
+    for fraction, members in (fractions.items() if isinstance(fractions, dict) else []):
+        for e in members:
+            _upsert_entity(conn, e, fraction)
+
+    locations = load_json(LEGACY_LOCATIONS)
+    for loc in locations if isinstance(locations, list) else []:
+        conn.execute("INSERT OR IGNORE INTO locations (id, name) VALUES (?, ?)", (loc["id"], loc["name"]))
+
+    folders = load_json(LEGACY_FOLDERS)
+    conn.executemany(
+        "INSERT OR REPLACE INTO folders (id, name, parent_id) VALUES (?, ?, ?)",
+        [(fid, f["name"], f.get("parent_id")) for fid, f in folders.items()] if isinstance(folders, dict) else []
+    )
+    tree_sync = load_json(LEGACY_TREE_SYNC)
+    if tree_sync.get("built_at"):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('tree_root', ?)", (str(tree_sync.get("root")),))
+
+
+def _bump(table):
+    with _changed:
+        _versions[table] += 1
+        _changed.notify_all()
+
+
+def version(*tables):
+    """Returns a version string that changes whenever one of the tables is written."""
+    with _changed:
+        return ".".join(str(_versions[t]) for t in tables)
+
+
+def wait_for_change(tables, since, timeout=None):
+    """Blocks until version(*tables) differs from `since` or `timeout` passes. Returns the version."""
+    with _changed:
+        _changed.wait_for(lambda: version(*tables) != since, timeout)
+        return version(*tables)
+
+
+def _upsert_entity(conn, entity, fraction):
+    conn.execute(
+        """INSERT INTO entities (id, name, folder_id, type, fraction) VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(id) DO UPDATE SET name = excluded.name, folder_id = excluded.folder_id,
+               type = excluded.type, fraction = excluded.fraction""",
+        (entity["id"], entity.get("name", ""), entity.get("folder_id"), entity.get("type", ""), fraction or "")
+    )
+
+
+def _entity(row):
+    return {"id": row["id"], "name": row["name"], "folder_id": row["folder_id"], "type": row["type"]}
+
+# ===================== ENTITIES =====================
+
+def upsert_entity(entity, fraction=""):
+    """Inserts or updates an entity with its faction ('' removes it from every faction)."""
+    with transaction() as conn:
+        _upsert_entity(conn, entity, fraction)
+    _bump("entities")
+
+
+def list_npcs():
+    with transaction() as conn:
+        rows = conn.execute("SELECT * FROM entities WHERE type = 'NPC' ORDER BY rowid").fetchall()
+    return [_entity(r) for r in rows]
+
+
+def list_fractions():
+    """Returns {fraction: [entities]}."""
+    fractions = {}
+    with transaction() as conn:
+        rows = conn.execute("SELECT * FROM entities WHERE fraction != '' ORDER BY fraction, rowid").fetchall()
+    for r in rows:
+        fractions.setdefault(r["fraction"], []).append(_entity(r))
+    return fractions
+
+# ===================== LOCATIONS =====================
+
+def add_location(location_id, name):
+    """Adds a saved location. Returns False if it was already saved."""
+    with transaction() as conn:
+        added = conn.execute("INSERT OR IGNORE INTO locations (id, name) VALUES (?, ?)", (location_id, name)).rowcount > 0
+    if added:
+        _bump("locations")
+    return added
+
+
+def list_locations():
+    with transaction() as conn:
+        rows = conn.execute("SELECT id, name FROM locations ORDER BY position").fetchall()
+    return [dict(r) for r in rows]
+
+# ===================== FOLDERS =====================
+
+def get_folders():
+    """Returns the flat folder map: id -> {id, name, parent_id}."""
+    with transaction() as conn:
+        rows = conn.execute("SELECT id, name, parent_id FROM folders").fetchall()
+    return {r["id"]: dict(r) for r in rows}
+
+
+def has_folder(folder_id):
+    with transaction() as conn:
+        return conn.execute("SELECT 1 FROM folders WHERE id = ?", (folder_id,)).fetchone() is not None
+
+
+def upsert_folder(folder_id, name, parent_id):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO folders (id, name, parent_id) VALUES (?, ?, ?)",
+            (folder_id, name, parent_id)
+        )
+    _bump("folders")
+
+
+def remove_folder_tree(folder_id):
+    """Removes a folder and all of its descendants. Returns False if it was not known."""
+    with transaction() as conn:
+        conn.execute(
+            """WITH RECURSIVE subtree(id) AS (
+                   SELECT ?
+                   UNION SELECT f.id FROM folders f JOIN subtree s ON f.parent_id = s.id
+               )
+               DELETE FROM folders WHERE id IN subtree""",
+            (folder_id,)
+        )
+        # Not cursor.rowcount: Python before 3.12 reports -1 for statements starting with WITH
+        removed = conn.execute("SELECT changes()").fetchone()[0] > 0
+    if removed:
+        _bump("folders")
+    return removed
+
+
+def replace_folders(flat_map):
+    """Replaces the whole folder table (after a full scan)."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM folders")
+        conn.executemany(
+            "INSERT INTO folders (id, name, parent_id) VALUES (?, ?, ?)",
+            [(fid, f["name"], f.get("parent_id")) for fid, f in flat_map.items()]
+        )
+    _bump("folders")
+
+# ===================== META =====================
+
+def get_meta(key, default=None):
+    with transaction() as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else default
+
+
+def set_meta(key, value):
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
@@ -0,0 +1,145 @@
+# utils/rooms.py
+import atexit
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from utils.state_store import StateStore, state_store
+from utils.map_session import MapSession
+
+# Each game table (room) has its own display state, music and map, journaled under
+# data/rooms/<room_id>/. The default room is the original data/state.json store.
+ROOMS_DIR = "data/rooms"
+DEFAULT_ROOM = "default"
+ROOM_ID = re.compile(r"^[A-Za-z0-9_-]{1,40}$")
+
+
+def room_path(prefix, room_id):
+    """Page URL of a room: "/vis" for the default one, "/vis/r/<room_id>" for the others.
+
+    Rooms have their own path segment, so no room id can shadow a fixed /vis or /map route.
+    """
+    return prefix if room_id == DEFAULT_ROOM else f"{prefix}/r/{room_id}"
+
+
+class Room:
+    def __init__(self, room_id, store, map_log_size):
+        self.id = room_id
+        self.store = store
+        self.map_session = MapSession(store, log_size=map_log_size)
+        self.last_used = 0
+
+
+class RoomRegistry:
+    """Rooms loaded on demand and kept in memory while in use.
+
+    Lookup is one dict access. Rooms idle for `idle_ttl` seconds are flushed to disk
+    and dropped from memory; beyond `max_rooms` the least recently used ones go as soon
+    as they have been idle for `min_idle` seconds. Memory per room is bounded by the
+    map op log (`map_log_size`). Long-lived connections call touch() to stay loaded.
+    """
+
+    def __init__(self, directory, idle_ttl=3600, max_rooms=32, min_idle=60, map_log_size=500, clock=time.monotonic):
+        self.directory = directory
+        self.idle_ttl = idle_ttl
+        self.max_rooms = max_rooms
+        self.min_idle = min_idle
+        self.map_log_size = map_log_size
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._rooms = OrderedDict() # room_id -> Room, least recently used first
+        self._default = Room(DEFAULT_ROOM, state_store, map_log_size=2000)
+        self._stats = {"loads": 0, "evictions": 0}
+        self._load_hooks = []
+        atexit.register(self.flush)
+
+    def add_load_hook(self, fn):
+        """Calls fn(room) for the default room now and for every room loaded later."""
+        self._load_hooks.append(fn)
+        fn(self._default)
+
+    def _room_dir(self, room_id):
+        return os.path.join(self.directory, room_id)
+
+    def exists(self, room_id):
+        return room_id == DEFAULT_ROOM or (bool(ROOM_ID.match(room_id or "")) and os.path.isdir(self._room_dir(room_id)))
+
+    def create(self, room_id):
+        """Creates a room on disk. Returns False if the id is invalid or taken."""
+        if not ROOM_ID.match(room_id or "") or self.exists(room_id):
+            return False
+        os.makedirs(self._room_dir(room_id))
+        return True
+
+    def list(self):
+        rooms = [DEFAULT_ROOM]
+        if os.path.isdir(self.directory):
+            rooms += sorted(r for r in os.listdir(self.directory) if ROOM_ID.match(r) and r != DEFAULT_ROOM)
+        return rooms
+
+    def get(self, room_id=None):
+        """Returns the Room, loading it if needed, or None if it does not exist."""
+        default = not room_id or room_id == DEFAULT_ROOM
+        with self._lock:
+            room = self._default if default else self._rooms.get(room_id)
+            if room is None:
+                if not self.exists(room_id):
+                    return None
+                path = self._room_dir(room_id)
+                store = StateStore(os.path.join(path, "state.json"), journal_dir=os.path.join(path, "journal"), flush_at_exit=False)
+                room = self._rooms[room_id] = Room(room_id, store, self.map_log_size)
+                self._stats["loads"] += 1
+                for hook in self._load_hooks:
+                    hook(room)
+            self._touch(room)
+            evicted = self._evict()
+        for old in evicted:
+            old.store.flush()
+        return room
+
+    def touch(self, room):
+        with self._lock:
+            if self._rooms.get(room.id) is room:
+                self._touch(room)
+
+    def _touch(self, room):
+        room.last_used = self.clock()
+        if room.id in self._rooms:
+            self._rooms.move_to_end(room.id)
+
+    def _evict(self):
+        """Drops idle rooms from the LRU end. Returns them so they are flushed outside the lock."""
+        now = self.clock()
+        evicted = []
+        while self._rooms:
+            room = next(iter(self._rooms.values()))
+            idle = now - room.last_used
+            if idle >= self.idle_ttl or (len(self._rooms) > self.max_rooms and idle >= self.min_idle):
+                del self._rooms[room.id]
+                evicted.append(room)
+                self._stats["evictions"] += 1
+            else:
+                break
+        return evicted
+
+    def loaded(self):
+        """The rooms in memory, default room first."""
+        with self._lock:
+            return [self._default] + list(self._rooms.values())
+
+    def flush(self):
+        """Writes a snapshot of every loaded room (called at exit)."""
+        with self._lock:
+            loaded = list(self._rooms.values())
+        for room in loaded:
+            room.store.flush()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["loaded"] = len(self._rooms) + 1
+        return stats
+
+
+rooms = RoomRegistry(ROOMS_DIR)
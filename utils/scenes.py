@@ -0,0 +1,146 @@
+# utils/scenes.py
+import queue
+import threading
+from utils import codec
+from utils.drive import get_files_content
+from utils.drive_utils import normalize_drive_link, direct_media_link, is_youtube_url
+from utils.proxy_cache import media_cache
+
+# Scene playlists: an ordered list of scenes per room, kept in the room state as
+#   "playlist": [{"entity_id", "name", "image", "music", "notes"}, ...], "scene_index": -1
+# These keys hold GM notes and are never sent to displays (see DISPLAY_KEYS). Advancing
+# sets current_image / current_music / current_scene and the `next_scene` preload hint
+# in one "scene" journal record, and warms the media cache for the scenes after it.
+PREFETCH_AHEAD = 2 # Upcoming scenes kept warm in the media cache
+PREFETCH_TIMEOUT = 60 # Seconds the prefetch thread waits for one download before moving on
+
+
+def make_scene(metadata, entity_id=None):
+    """Scene from entity metadata (utils/schema.py Metadata fields) or an inline dict."""
+    return {
+        "entity_id": entity_id or metadata.get("entity_id"),
+        "name": metadata.get("name", ""),
+        "image": normalize_drive_link(metadata.get("image", "")),
+        "music": metadata.get("music", ""),
+        "notes": metadata.get("notes", ""),
+    }
+
+
+def load_scenes(items):
+    """Resolves playlist items: entity file ids or inline scene dicts. Unusable items become None.
+
+    Entity files are fetched together (one batch revalidation, parallel downloads).
+    """
+    ids = [item for item in items if isinstance(item, str) and item]
+    contents = get_files_content(ids) if ids else {}
+    scenes = []
+    for item in items:
+        if isinstance(item, dict):
+            scenes.append(make_scene(item))
+            continue
+        try:
+            metadata = codec.loads(contents.get(item) or "") if item in contents else None
+        except ValueError:
+            metadata = None
+        scenes.append(make_scene(metadata, entity_id=item) if isinstance(metadata, dict) else None)
+    return scenes
+
+
+def preload_hint(scene):
+    """What displays should preload for a scene (no GM notes)."""
+    if not scene:
+        return None
+    return {"name": scene["name"], "image": scene["image"], "music": scene["music"]}
+
+
+def media_urls(scene):
+    """Upstream URLs the proxies will fetch for a scene (YouTube music is not proxied)."""
+    urls = [scene["image"]] if scene["image"] else []
+    if scene["music"] and not is_youtube_url(scene["music"]):
+        urls.append(direct_media_link(scene["music"]))
+    return urls
+
+
+def get_playlist(store):
+    state = store.get()
+    return {"scenes": state.get("playlist") or [], "index": state.get("scene_index", -1)}
+
+
+def set_playlist(store, scenes):
+    """Replaces the playlist of a room. Nothing is shown until the first advance."""
+    store.apply("set", {"playlist": scenes, "scene_index": -1, "next_scene": preload_hint(scenes[0] if scenes else None)})
+    prefetcher.warm(scenes[:PREFETCH_AHEAD])
+    return {"scenes": scenes, "index": -1}
+
+
+def goto(store, index):
+    """Shows scene `index`. Music is kept playing when the scene has none. Returns the playlist."""
+    scenes = get_playlist(store)["scenes"]
+    if not 0 <= index < len(scenes):
+        raise IndexError(f"No scene {index} (playlist has {len(scenes)})")
+    scene = scenes[index]
+    changes = { # Only the index is journaled, not the playlist
+        "scene_index": index,
+        "current_scene": scene["name"],
+        "next_scene": preload_hint(scenes[index + 1] if index + 1 < len(scenes) else None),
+    }
+    if scene["image"]:
+        changes["current_image"] = scene["image"]
+    if scene["music"]:
+        changes["current_music"] = scene["music"]
+    store.apply("scene", changes)
+    prefetcher.warm(scenes[index + 1:index + 1 + PREFETCH_AHEAD])
+    return {"scenes": scenes, "index": index}
+
+
+class Prefetcher:
+    """Fetches the media of upcoming scenes into the proxy cache, one URL at a time.
+
+    Runs in one background thread so warming never competes with displays for more
+    than one upstream connection. Downloads are shared with display requests for the
+    same URL (the cache is single-flight), and fresh entries cost one index lookup.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._thread = None
+        self._stats = {"queued": 0, "warmed": 0, "errors": 0}
+
+    def warm(self, scenes):
+        with self._lock:
+            for scene in scenes:
+                for url in media_urls(scene):
+                    if url not in self._pending:
+                        self._pending.add(url)
+                        self._queue.put(url)
+                        self._stats["queued"] += 1
+            if self._thread is None and self._pending:
+                self._thread = threading.Thread(target=self._run, name="scene-prefetch", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            url = self._queue.get()
+            try:
+                self.cache.fetch(url, timeout=PREFETCH_TIMEOUT)
+                counter = "warmed"
+            except TimeoutError:
+                # The download goes on in the cache; only this thread stops waiting for it
+                print(f"Prefetch of {url} timed out after {PREFETCH_TIMEOUT}s")
+                counter = "errors"
+            except Exception as e:
+                print(f"Prefetch of {url} failed: {e}")
+                counter = "errors"
+            with self._lock:
+                self._pending.discard(url)
+                self._stats[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending))
+
+
+prefetcher = Prefetcher(media_cache)
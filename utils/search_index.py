@@ -0,0 +1,197 @@
+# utils/search_index.py
+import re
+import threading
+import heapq
+import unicodedata
+from bisect import bisect_left, insort
+from utils.file_ops import load_json, save_json
+
+# Inverted index over entity metadata. Tokens are lowercased and stripped of
+# diacritics ("Łódź" -> "lodz"), every query term matches as a prefix.
+SEARCH_INDEX_FILE = "data/search_index.json"
+SAVE_DELAY = 2.0 # Seconds to coalesce saves after a burst of updates
+
+TEXT_FIELDS = ("name", "description", "notes")
+LIST_FIELDS = ("tags",)
+ELEMENT_FIELDS = ("npc", "items", "monsters")
+NAME_WEIGHT = 3
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Letters that have no Unicode decomposition
+_EXTRA_FOLDING = str.maketrans({"ł": "l", "ø": "o", "đ": "d", "ß": "ss"})
+
+_lock = threading.RLock()
+_docs = {} # id -> searchable fields
+_postings = {} # token -> set(ids)
+_name_postings = {} # token -> set(ids) for tokens that appear in the name
+_vocab = [] # sorted tokens, for prefix lookups
+_loaded = False
+_save_timer = None
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", str(text).lower().translate(_EXTRA_FOLDING))
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def searchable_fields(name, metadata):
+    """Extracts the fields we index from an entity metadata dict."""
+    metadata = metadata if isinstance(metadata, dict) else {}
+    elements = metadata.get("elements") or {}
+    doc = {"name": name or metadata.get("name", "")}
+    for field in TEXT_FIELDS[1:]:
+        doc[field] = str(metadata.get(field) or "")
+    for field in LIST_FIELDS:
+        doc[field] = [str(v) for v in metadata.get(field) or []]
+    for field in ELEMENT_FIELDS:
+        doc[field] = [str(v) for v in elements.get(field) or []] if isinstance(elements, dict) else []
+    return doc
+
+
+def _doc_tokens(doc):
+    parts = [doc.get(f, "") for f in TEXT_FIELDS]
+    for field in LIST_FIELDS + ELEMENT_FIELDS:
+        parts.extend(doc.get(field, []))
+    return set(tokenize(" ".join(parts)))
+
+
+def _load():
+    global _loaded
+    if _loaded:
+        return
+    data = load_json(SEARCH_INDEX_FILE)
+    for doc_id, doc in (data.items() if isinstance(data, dict) else []):
+        _add(doc_id, doc)
+    _loaded = True
+
+
+def _schedule_save():
+    global _save_timer
+    if _save_timer is None:
+        _save_timer = threading.Timer(SAVE_DELAY, flush)
+        _save_timer.daemon = True
+        _save_timer.start()
+
+
+def flush():
+    """Writes pending index changes to disk."""
+    global _save_timer
+    with _lock:
+        _save_timer = None
+        save_json(SEARCH_INDEX_FILE, _docs, compact=True)
+
+
+def _add(doc_id, doc):
+    _discard(doc_id)
+    _docs[doc_id] = doc
+    for token in set(tokenize(doc.get("name", ""))):
+        _name_postings.setdefault(token, set()).add(doc_id)
+    for token in _doc_tokens(doc):
+        ids = _postings.get(token)
+        if ids is None:
+            ids = _postings[token] = set()
+            insort(_vocab, token)
+        ids.add(doc_id)
+
+
+def _discard(doc_id):
+    doc = _docs.pop(doc_id, None)
+    if doc is None:
+        return False
+    for token in set(tokenize(doc.get("name", ""))):
+        ids = _name_postings.get(token)
+        if ids is not None:
+            ids.discard(doc_id)
+            if not ids:
+                del _name_postings[token]
+    for token in _doc_tokens(doc):
+        ids = _postings.get(token)
+        if ids is None:
+            continue
+        ids.discard(doc_id)
+        if not ids:
+            del _postings[token]
+            del _vocab[bisect_left(_vocab, token)]
+    return True
+
+
+def index(doc_id, name, metadata):
+    """Adds or replaces the searchable fields of one entity."""
+    with _lock:
+        _load()
+        _add(doc_id, searchable_fields(name, metadata))
+        _schedule_save()
+
+
+def remove(doc_id):
+    with _lock:
+        _load()
+        if _discard(doc_id):
+            _schedule_save()
+
+
+def retain(doc_ids):
+    """Drops every document that is not in doc_ids (after a full rescan)."""
+    with _lock:
+        _load()
+        stale = [d for d in _docs if d not in doc_ids]
+        for doc_id in stale:
+            _discard(doc_id)
+        if stale:
+            _schedule_save()
+
+
+def has(doc_id):
+    with _lock:
+        _load()
+        return doc_id in _docs
+
+
+def _prefix_matches(term):
+    """Returns (ids matching the prefix anywhere, ids matching it in the name)."""
+    ids = set()
+    name_ids = set()
+    i = bisect_left(_vocab, term)
+    while i < len(_vocab) and _vocab[i].startswith(term):
+        ids |= _postings[_vocab[i]]
+        name_ids |= _name_postings.get(_vocab[i], set())
+        i += 1
+    return ids, name_ids
+
+
+def search(query, limit=20, accept=None):
+    """Returns [(doc_id, score)] for documents matching every query term as a prefix.
+
+    `accept(doc_id)` can filter hits before the limit is applied.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    with _lock:
+        _load()
+        matches = [_prefix_matches(t) for t in terms]
+        matches.sort(key=lambda m: len(m[0]))
+        hits = set(matches[0][0])
+        for ids, _ in matches[1:]:
+            hits &= ids
+            if not hits:
+                return []
+        if accept:
+            hits = [doc_id for doc_id in hits if accept(doc_id)]
+        name_hits = [name_ids for _, name_ids in matches]
+        scored = (
+            (len(terms) + (NAME_WEIGHT - 1) * sum(doc_id in n for n in name_hits), doc_id)
+            for doc_id in hits
+        )
+        best = heapq.nsmallest(limit, scored, key=lambda s: (-s[0], _docs[s[1]].get("name", "").lower()))
+    return [(doc_id, score) for score, doc_id in best]
+
+
+def stats():
+    with _lock:
+        _load()
+        return {"documents": len(_docs), "tokens": len(_vocab)}
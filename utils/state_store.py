@@ -0,0 +1,273 @@
+# utils/state_store.py
+import atexit
+import threading
+import time
+import weakref
+from collections import deque
+from utils.file_ops import load_json, save_json, validate_state
+from utils.journal import Journal
+from utils.map_session import apply_ops
+
+STATE_FILE = "data/state.json"
+JOURNAL_DIR = "data/journal"
+CHECKPOINT_INTERVAL = 30 # Seconds between background snapshots of stores with new records
+# The only state keys sent to displays (/vis and its streams need no login). Campaign
+# nodes and the scene playlist with GM notes stay on the server.
+DISPLAY_KEYS = ("current_image", "current_music", "current_scene", "next_scene")
+# Ops that change what the displays show as the scene (image or playlist advance)
+SCENE_OPS = ("set_vis", "scene")
+# Ops carrying a whole map / state; the journal keeps their payloads out of journal.log
+FULL_OPS = ("map", "restore")
+
+
+def display_view(state):
+    return {k: state[k] for k in DISPLAY_KEYS if k in state}
+
+
+def apply_op(doc, op, data):
+    """Journal reducer: applies one record to {"state": {...}, "map": {...}} in place.
+
+    set / set_vis / set_music / scene replace top-level keys (scene is a playlist
+    advance, see utils/scenes.py), node stores one campaign node
+    (path -> Metadata dict), map replaces the shared map, map_ops edits it (see
+    utils/map_session.py), restore is a rewind.
+    """
+    state = doc.setdefault("state", {})
+    if op in ("set", "set_vis", "set_music", "scene"):
+        state.update(data)
+    elif op == "node":
+        state[data["path"]] = data["meta"]
+    elif op == "map":
+        doc["map"] = data
+    elif op == "map_ops":
+        doc["map"] = apply_ops(doc.get("map"), data["ops"], data.get("timestamp"))
+    elif op == "restore":
+        doc["state"] = dict(data.get("state") or {})
+        doc["map"] = data.get("map")
+
+
+class Checkpointer:
+    """One background thread that snapshots journaled stores which have new records.
+
+    Stores are held weakly, so rooms dropped from memory stop being checked.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stores = weakref.WeakSet()
+        self._thread = None
+
+    def watch(self, store):
+        with self._lock:
+            self._stores.add(store)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="state-checkpoint", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                stores = list(self._stores)
+            for store in stores:
+                try:
+                    store.flush()
+                except Exception as e:
+                    print(f"Checkpoint of {store.path} failed: {e}")
+
+
+checkpointer = Checkpointer(CHECKPOINT_INTERVAL)
+
+
+class StateStore:
+    """Live copy of a JSON state file, served from memory.
+
+    Reads never touch the disk. Updates replace top-level keys under a lock and bump
+    `version`; `state_version` / `map_version` record the last version that changed the
+    state dict / the map, and wait_for_change() lets readers block until the next one.
+
+    With a journal directory every update is appended to the journal (O(change)),
+    `version` is the journal seq, and the file is only rewritten together with a
+    snapshot: after `snapshot_every` updates, or by the background checkpointer when
+    anything changed since the last one. Startup loads the newest snapshot and replays
+    the few records after it. Without a journal, writes within `debounce` seconds are
+    coalesced into one atomic save.
+    """
+
+    def __init__(self, path, debounce=0.5, journal_dir=None, snapshot_every=200, flush_at_exit=True):
+        self.path = path
+        self.debounce = debounce
+        self.version = 0
+        self.state_version = 0
+        self.map_version = 0
+        self.nodes_version = 0 # Last version that changed a campaign node ("/..." key)
+        self.journal = Journal(journal_dir, apply_op, snapshot_every, external_ops=FULL_OPS) if journal_dir else None
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._state = None
+        self._map = None
+        self._campaign = None # (version, CampaignState)
+        self._timer = None
+        self._checkpoints = 0
+        self._checkpoint_at = None
+        self._listeners = []
+        self._pending = deque() # (op, data, version) not yet passed to the listeners
+        self._notify_lock = threading.Lock()
+        if flush_at_exit:
+            atexit.register(self.flush)
+
+    def add_listener(self, fn):
+        """Registers fn(op, data, version), called in order after every mutation.
+
+        Listeners run outside the store lock, so they may read the store (which can be newer than `version`).
+        """
+        self._listeners.append(fn)
+
+    def _load(self):
+        if self._state is not None:
+            return
+        data = load_json(self.path)
+        data = data if isinstance(data, dict) else {}
+        if self.journal is None:
+            self._state = data
+            return
+        # Startup: newest snapshot + replay (state.json seeds the journal on first run)
+        doc = self.journal.load(initial={"state": data, "map": None})
+        self._state = doc.get("state") or {}
+        self._map = doc.get("map")
+        self.version = self.state_version = self.map_version = self.nodes_version = self.journal.seq
+        checkpointer.watch(self)
+
+    def get(self):
+        """Returns a shallow copy of the state (values are replaced, never mutated in place)."""
+        with self._lock:
+            self._load()
+            return dict(self._state)
+
+    def get_versioned(self):
+        """Returns (shallow copy of the state, state_version) read atomically."""
+        with self._lock:
+            self._load()
+            return dict(self._state), self.state_version
+
+    def wait_for_change(self, since, timeout=None, which="state"):
+        """Blocks until the "state" or "map" version differs from `since` or `timeout` passes. Returns it."""
+        attr = f"{which}_version"
+        with self._changed:
+            self._load()
+            self._changed.wait_for(lambda: getattr(self, attr) != since, timeout)
+            return getattr(self, attr)
+
+    def get_map(self):
+        """Returns the shared map state (see utils/map_session.py) or None. Treat it as read-only."""
+        with self._lock:
+            self._load()
+            return self._map
+
+    def get_version(self, which="state"):
+        with self._lock:
+            self._load()
+            return getattr(self, f"{which}_version")
+
+    def campaign_state(self):
+        """Returns the validated CampaignState of the node entries, cached until a node changes."""
+        with self._lock:
+            self._load()
+            if self._campaign is None or self._campaign[0] != self.nodes_version:
+                nodes = {k: v for k, v in self._state.items() if k.startswith("/")}
+                self._campaign = (self.nodes_version, validate_state(nodes))
+            return self._campaign[1]
+
+    def apply(self, op, data):
+        """Records one mutation (see apply_op) and returns the new version."""
+        with self._lock:
+            self._load()
+            if self.journal is not None:
+                self.version = self.journal.append(op, data)
+            else:
+                self.version += 1
+            doc = {"state": self._state, "map": self._map}
+            apply_op(doc, op, data)
+            self._state, self._map = doc["state"], doc["map"]
+            if op not in ("map", "map_ops"):
+                self.state_version = self.version
+            if op in ("map", "map_ops", "restore"):
+                self.map_version = self.version
+            if op in ("node", "restore") or (op == "set" and any(k.startswith("/") for k in data)):
+                self.nodes_version = self.version
+            self._changed.notify_all()
+            if self._listeners:
+                self._pending.append((op, data, self.version))
+            if self._timer is None and (self.journal is None or self.journal.needs_snapshot()):
+                self._timer = threading.Timer(self.debounce, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            version = self.version
+        self._notify()
+        return version
+
+    def _notify(self):
+        """Passes queued mutations to the listeners, in version order, without holding the store lock."""
+        with self._notify_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return
+                    op, data, version = self._pending.popleft()
+                for listener in self._listeners:
+                    try:
+                        listener(op, data, version)
+                    except Exception as e:
+                        print(f"State listener failed: {e}")
+
+    def update(self, changes=None, **kwargs):
+        """Sets top-level keys and returns the new version."""
+        return self.apply("set", dict(changes or {}, **kwargs))
+
+    def history(self, limit=None):
+        return self.journal.history(limit) if self.journal else []
+
+    def rewind(self, seq):
+        """Restores the state as it was right after journal record `seq`.
+
+        The restore is itself journaled, so a rewind can be undone. Raises ValueError
+        when `seq` is older than the kept history.
+        """
+        if self.journal is None:
+            raise ValueError("State has no journal")
+        doc = self.journal.state_at(seq)
+        return self.apply("restore", {"seq": seq, "state": doc.get("state") or {}, "map": doc.get("map")})
+
+    def flush(self):
+        """Writes the state (and a journal snapshot) to disk now if there are unsaved updates."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                elif self.journal is None or self._state is None or not self.journal.since_snapshot:
+                    return
+                snapshot = dict(self._state)
+                map_state, version = self._map, self.version
+            if self.journal is not None:
+                self.journal.snapshot({"state": snapshot, "map": map_state}, version)
+            save_json(self.path, snapshot)
+            self._checkpoints += 1
+            self._checkpoint_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "state_version": self.state_version,
+                "map_version": self.map_version,
+                "nodes_version": self.nodes_version,
+                "unsaved_records": self.journal.since_snapshot if self.journal else None,
+                "checkpoints": self._checkpoints,
+                "checkpoint_at": self._checkpoint_at,
+            }
+
+
+state_store = StateStore(STATE_FILE, journal_dir=JOURNAL_DIR)
@@ -0,0 +1,195 @@
+# utils/write_queue.py
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+
+class WriteQueue:
+    """Background writer with per-key coalescing and retry with exponential backoff.
+
+    submit() returns immediately. If a write for the same key is still queued it is
+    replaced, so only the latest content goes out. Writes for one key never overlap.
+    A job fails when it raises or returns a falsy value. Errors for which
+    `is_transient(error)` is true (e.g. no connectivity) are retried indefinitely.
+    `on_finished(key, state, error)` is called (from the worker, outside the queue lock)
+    when the latest write for a key ends as "done" or "failed".
+    """
+
+    HISTORY = 200 # Finished items kept for the status endpoint
+
+    def __init__(self, name="writer", max_attempts=5, base_delay=1.0, max_delay=60.0, clock=time.monotonic, is_transient=None, on_finished=None):
+        self.name = name
+        self.is_transient = is_transient
+        self.on_finished = on_finished
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._pending = OrderedDict() # key -> job
+        self._status = OrderedDict() # key -> status dict
+        self._in_flight = None
+        self._thread = None
+        self._stopping = False
+        self._exit_hook = False
+        self._stats = {"submitted": 0, "coalesced": 0, "written": 0, "retries": 0, "failed": 0}
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs) as the latest write for key. Returns the item status."""
+        with self._cond:
+            self._stats["submitted"] += 1
+            job = self._pending.get(key)
+            coalesced = job is not None
+            if coalesced:
+                self._stats["coalesced"] += 1
+            self._pending[key] = {
+                "fn": fn,
+                "args": args,
+                "kwargs": kwargs,
+                "attempts": 0,
+                "failures": 0,
+                "next_at": 0,
+                "coalesced": job["coalesced"] + 1 if coalesced else 0,
+            }
+            status = self._set_status(key, "queued", attempts=0, error=None)
+            self._ensure_worker()
+            self._cond.notify_all()
+            return dict(status)
+
+    def _set_status(self, key, state, **fields):
+        status = self._status.pop(key, {"key": key})
+        status.update(fields, state=state, updated_at=time.time())
+        if key in self._pending:
+            status["coalesced"] = self._pending[key]["coalesced"]
+        self._status[key] = status
+        while len(self._status) > self.HISTORY:
+            oldest = next(iter(self._status))
+            if oldest in self._pending or oldest == self._in_flight:
+                break
+            del self._status[oldest]
+        return status
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            if not self._exit_hook:
+                atexit.register(self.stop)
+                self._exit_hook = True
+
+    def _next_job(self):
+        """Waits for a due job. Returns (key, job) or None when stopping with nothing left."""
+        with self._cond:
+            while True:
+                now = self.clock()
+                due = [(k, j) for k, j in self._pending.items() if j["next_at"] <= now or self._stopping]
+                if due:
+                    key, job = due[0]
+                    del self._pending[key]
+                    self._in_flight = key
+                    self._set_status(key, "writing", attempts=job["attempts"] + 1)
+                    return key, job
+                if self._stopping and not self._pending:
+                    return None
+                wait = min((j["next_at"] for j in self._pending.values()), default=now + 5) - now
+                self._cond.wait(timeout=max(wait, 0.05))
+
+    def _run(self):
+        while True:
+            item = self._next_job()
+            if item is None:
+                return
+            key, job = item
+            error = None
+            transient = False
+            try:
+                ok = job["fn"](*job["args"], **job["kwargs"])
+                if not ok:
+                    error = "write returned no result"
+            except Exception as e:
+                error = str(e)
+                transient = bool(self.is_transient and self.is_transient(e))
+            self._finish(key, job, error, transient)
+
+    def _finish(self, key, job, error, transient=False):
+        final = self._record(key, job, error, transient)
+        if final and self.on_finished:
+            try:
+                self.on_finished(key, final, error)
+            except Exception as e:
+                print(f"{self.name}: on_finished for {key} failed: {e}")
+        with self._cond:
+            self._in_flight = None # Only now, so flush() also waits for on_finished
+            self._cond.notify_all()
+
+    def _record(self, key, job, error, transient):
+        """Books the outcome of one attempt. Returns "done" / "failed" when the key is settled, else None."""
+        final = None
+        with self._cond:
+            job["attempts"] += 1
+            if error is not None and not transient:
+                job["failures"] += 1
+            superseded = key in self._pending
+            if error is None:
+                self._stats["written"] += 1
+                if not superseded:
+                    self._set_status(key, "done", attempts=job["attempts"], error=None)
+                    final = "done"
+            elif superseded:
+                pass # Newer content is already queued, it replaces this attempt
+            elif (transient or job["failures"] < self.max_attempts) and not self._stopping:
+                self._stats["retries"] += 1
+                delay = min(self.base_delay * 2 ** (job["attempts"] - 1), self.max_delay)
+                job["next_at"] = self.clock() + delay
+                self._pending[key] = job
+                state = "offline" if transient else "retrying"
+                self._set_status(key, state, attempts=job["attempts"], error=error, retry_in=delay)
+            else:
+                self._stats["failed"] += 1
+                self._set_status(key, "failed", attempts=job["attempts"], error=error)
+                print(f"Write {key} failed after {job['attempts']} attempts: {error}")
+                final = "failed"
+            self._cond.notify_all()
+        return final
+
+    def flush(self, timeout=None):
+        """Blocks until nothing is queued or in flight. Returns False on timeout."""
+        deadline = None if timeout is None else self.clock() + timeout
+        with self._cond:
+            # Retries that are waiting for their backoff are attempted right away
+            for job in self._pending.values():
+                job["next_at"] = 0
+            self._cond.notify_all()
+            while self._pending or self._in_flight is not None:
+                remaining = None if deadline is None else deadline - self.clock()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(timeout=remaining)
+        return True
+
+    def stop(self, timeout=30):
+        """Flushes outstanding writes and stops the worker (called at exit)."""
+        with self._cond:
+            if self._thread is None:
+                return True
+            self._stopping = True
+            self._cond.notify_all()
+        flushed = self.flush(timeout)
+        if not flushed:
+            print(f"{self.name}: {len(self._pending)} writes still pending at shutdown")
+        return flushed
+
+    def status(self, key):
+        with self._cond:
+            status = self._status.get(key)
+            return dict(status) if status else None
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["depth"] = len(self._pending)
+            stats["in_flight"] = self._in_flight
+            stats["items"] = [dict(s) for s in reversed(self._status.values())]
+        return stats